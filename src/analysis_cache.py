@@ -0,0 +1,109 @@
+"""
+Persistent, content-addressed cache of per-email AI analyses
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 20000))
+ANALYSIS_CACHE_MAX_AGE_DAYS = float(os.getenv("ANALYSIS_CACHE_MAX_AGE_DAYS", 90))
+
+def analysis_key(model_name: str, prompt_version, subject: str, body: str) -> str:
+    """Hash everything that determines an analysis; any change gives a new key"""
+    digest = hashlib.sha256()
+    for part in (model_name, str(prompt_version), subject or "", body or ""):
+        data = part.encode("utf-8", errors="surrogatepass")
+        # Length prefixes keep ("ab", "c") and ("a", "bc") apart
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+class AnalysisCache:
+    """SQLite-backed analysis cache with LRU size and age eviction.
+
+    Entries older than ``max_age_days`` count as misses; once more than
+    ``max_entries`` are stored the least recently used ones are dropped
+    (checked every ``EVICT_EVERY`` writes, so the cap is approximate).
+    ``hits`` and ``misses`` count lookups since the cache was opened.
+    """
+
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, max_age_days: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries or ANALYSIS_CACHE_MAX_ENTRIES
+        self.max_age = (max_age_days or ANALYSIS_CACHE_MAX_AGE_DAYS) * 86400
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS analyses (
+                    key TEXT PRIMARY KEY,
+                    analysis TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_by_use ON analyses (last_used)")
+        self.evict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT analysis, created_at FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE analyses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, analysis: str):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?)", (key, analysis, now, now)
+            )
+            self._writes += 1
+            due = self._writes % self.EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM analyses WHERE created_at < ?", (time.time() - self.max_age,))
+            self._conn.execute("""
+                DELETE FROM analyses WHERE key IN (
+                    SELECT key FROM analyses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,817 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the ingestion and query pipeline.
+Uses the stand-ins from fake_services, so no credentials or network are needed.
+
+Run with: python src/benchmarks.py
+"""
+
+import asyncio
+import base64
+import gc
+import glob
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from email import message_from_bytes
+from email.message import EmailMessage
+
+from llama_index.core import Settings
+from llama_index.core.schema import MetadataMode
+
+try:
+    from .fake_services import FakeGmailService, FakeLLM, fake_analysis_reply
+    from .gmail_summarizer import (
+        get_email_content, fetch_email_contents, analyze_emails_batched, decode_raw_message, build_digest, estimate_tokens
+    )
+    from .analysis_cache import AnalysisCache
+    from .gmail_chatbot import GmailChatbot, GeminiLLMWrapper
+    from .llm_pool import RateLimiter, RateLimitedLLM
+    from .embeddings import HashingEmbedding
+    from .keyword_index import KeywordIndex
+    from .refresh import BackgroundRefresher
+except ImportError:
+    # Fallback for when running as script
+    from fake_services import FakeGmailService, FakeLLM, fake_analysis_reply
+    from gmail_summarizer import (
+        get_email_content, fetch_email_contents, analyze_emails_batched, decode_raw_message, build_digest, estimate_tokens
+    )
+    from analysis_cache import AnalysisCache
+    from gmail_chatbot import GmailChatbot, GeminiLLMWrapper
+    from llm_pool import RateLimiter, RateLimitedLLM
+    from embeddings import HashingEmbedding
+    from keyword_index import KeywordIndex
+    from refresh import BackgroundRefresher
+
+def make_mailbox(count, latency=0.0):
+    return FakeGmailService(
+        [(f"Subject {i}", f"Body of email {i}\n" * 20) for i in range(count)],
+        latency=latency,
+    )
+
+def bench_fetch(count=200, latency=0.02):
+    """Sequential per-message gets vs batched concurrent fetching"""
+    print(f"\n📥 Fetching {count} emails ({latency * 1000:.0f} ms per round trip)")
+
+    service = make_mailbox(count, latency)
+    ids = [f"msg{i:06d}" for i in range(count, 0, -1)]
+
+    start = time.perf_counter()
+    sequential = [get_email_content(service, msg_id) for msg_id in ids]
+    sequential_time = time.perf_counter() - start
+    print(f"  • Sequential gets:  {sequential_time:.2f}s ({count / sequential_time:.0f} emails/s)")
+
+    for batch_size, workers in [(50, 1), (25, 4), (10, 8)]:
+        service.calls.clear()
+        start = time.perf_counter()
+        batched = fetch_email_contents(
+            service, ids, batch_size=batch_size, max_workers=workers,
+            service_factory=lambda: service,
+        )
+        elapsed = time.perf_counter() - start
+        assert batched == sequential, "batched results must keep mailbox order"
+        print(f"  • Batch {batch_size:>3} x {workers} workers: {elapsed:.2f}s "
+              f"({count / elapsed:.0f} emails/s, {service.calls.get('batch', 0)} round trips)")
+
+def bench_fetch_retries(count=500, rate_limit_every=7):
+    """Batched fetching when Gmail throttles some of the gets inside each batch"""
+    print(f"\n🚦 Fetching {count} emails with every {rate_limit_every}th get rate limited")
+
+    ids = [f"msg{i:06d}" for i in range(count, 0, -1)]
+    for label, max_retries in (("No retries", 0), ("Re-batched", None)):
+        service = FakeGmailService(
+            [(f"Subject {i}", f"Body of email {i}") for i in range(count)], rate_limit_every=rate_limit_every
+        )
+        waits = []
+        results = fetch_email_contents(
+            service, ids, batch_size=50, max_workers=4, service_factory=lambda: service,
+            max_retries=max_retries, sleep=waits.append,
+        )
+        lost = sum(isinstance(result, Exception) for result in results)
+        print(f"  • {label}: {lost} of {count} emails lost, {len(waits)} retry rounds "
+              f"({sum(waits):.1f}s of backoff), {service.calls.get('batch', 0)} round trips")
+
+def make_chatbot(service, llm, workdir):
+    return GmailChatbot(service_factory=lambda: service, llm_factory=lambda: llm, data_dir=workdir)
+
+def bench_sync(count=50, new_emails=3):
+    """Incremental refresh cost after a few new emails arrive"""
+    print(f"\n🔁 Syncing {new_emails} new emails into a {count}-email mailbox")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service, llm = make_mailbox(count), FakeLLM()
+        chatbot = make_chatbot(service, llm, workdir)
+        chatbot.sync_emails(max_emails=count)
+        chatbot.build_index()
+        print(f"  • Initial load: {llm.calls} LLM calls")
+
+        for i in range(new_emails):
+            service.add_message(f"New subject {i}", "Fresh email body")
+        service.calls.clear()
+        llm.calls = 0
+
+        start = time.perf_counter()
+        chatbot.sync_emails(max_emails=count)
+        elapsed = time.perf_counter() - start
+        print(f"  • Refresh: {elapsed:.2f}s, {llm.calls} LLM calls, round trips {service.calls}")
+
+def bench_restart(count=5000):
+    """Rebuilding the document set from the local store after a restart"""
+    print(f"\n💾 Restarting with {count} stored emails")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service, llm = make_mailbox(count), FakeLLM()
+        make_chatbot(service, llm, workdir).sync_emails(max_emails=count)
+
+        service.calls.clear()
+        llm.calls = 0
+        chatbot = make_chatbot(service, llm, workdir)
+        start = time.perf_counter()
+        chatbot.load_from_store(max_emails=count)
+        elapsed = time.perf_counter() - start
+        print(f"  • Rebuilt {len(chatbot.documents)} documents in {elapsed * 1000:.0f} ms "
+              f"({llm.calls} LLM calls, round trips {service.calls})")
+
+def bench_warm_reload(count=200):
+    """Full reload of unchanged emails served from the analysis cache"""
+    print(f"\n🧠 Reloading {count} unchanged emails")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service, llm = make_mailbox(count), FakeLLM()
+        make_chatbot(service, llm, workdir).sync_emails(max_emails=count)
+        print(f"  • Cold load: {llm.calls} LLM calls")
+
+        llm.calls = 0
+        chatbot = make_chatbot(service, llm, workdir)
+        chatbot.history_id = None  # force a full fetch_and_process_emails
+        chatbot.sync_emails(max_emails=count)
+        print(f"  • Warm reload: {llm.calls} LLM calls, cache {chatbot.analysis_cache.stats()}")
+
+def bench_index_reload(count=1000):
+    """Restart with a saved vector index instead of re-embedding every email"""
+    print(f"\n📇 Rebuilding the index for {count} stored emails")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service, llm = make_mailbox(count), FakeLLM()
+        chatbot = make_chatbot(service, llm, workdir)
+        chatbot.sync_emails(max_emails=count)
+        start = time.perf_counter()
+        chatbot.build_index()
+        print(f"  • First build (embed + save): {time.perf_counter() - start:.2f}s")
+
+        chatbot = make_chatbot(service, llm, workdir)
+        chatbot.sync_emails(max_emails=count)
+        start = time.perf_counter()
+        chatbot.build_index()
+        print(f"  • Restart (load saved index): {time.perf_counter() - start:.2f}s")
+
+def bench_incremental_index(count=1000, new_emails=3):
+    """Documents re-embedded when a few emails arrive: positions are ranked at query time, so only new ones"""
+    print(f"\n📌 Indexing {new_emails} new emails into {count} indexed emails")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service, llm = make_mailbox(count), FakeLLM()
+        chatbot = make_chatbot(service, llm, workdir)
+        chatbot.sync_emails(max_emails=count)
+        chatbot.build_index()
+        chatbot.setup_chat_engine()
+        docstore = chatbot.index.docstore
+        hashes = {email_id: docstore.get_document_hash(email_id) for email_id in chatbot.index.ref_doc_info}
+
+        for i in range(new_emails):
+            service.add_message(f"New subject {i}", "Fresh email body")
+        start = time.perf_counter()
+        chatbot.sync_emails(max_emails=count + new_emails)
+        elapsed = time.perf_counter() - start
+        ref_ids = list(chatbot.index.ref_doc_info)
+        changed = sum(hashes.get(email_id) != docstore.get_document_hash(email_id) for email_id in ref_ids)
+        print(f"  • Sync: {elapsed:.2f}s, {changed} of {len(ref_ids)} documents added or re-embedded")
+
+        nodes = chatbot.retriever.retrieve("USER QUERY: what is my most recent email?")
+        newest = nodes[0].node.metadata["subject"] if nodes else None
+        print(f"  • 'most recent email' retrieves '{newest}'; {chatbot.answer_from_metadata('show email #2').splitlines()[0]}")
+
+def bench_chat_turn(counts=(50, 5000), queries=(
+    "What did Subject 7 say?",
+    "Any emails from sender@example.com today?",
+    "What is email #3 about?",
+)):
+    """Per-turn latency and prompt size of the bounded retriever as the mailbox grows"""
+    print("\n💬 Chat turn cost vs mailbox size")
+
+    for count in counts:
+        prompt_sizes = []
+
+        def reply(prompt):
+            prompt_sizes.append(len(prompt))
+            return fake_analysis_reply(prompt)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            service, llm = make_mailbox(count), FakeLLM(reply)
+            chatbot = make_chatbot(service, llm, workdir)
+            chatbot.sync_emails(max_emails=count)
+            chatbot.build_index()
+            chatbot.setup_chat_engine()
+
+            prompt_sizes.clear()
+            start = time.perf_counter()
+            for query in queries:
+                chatbot.chat(query)
+                chatbot.chat_engine.reset()
+            elapsed = (time.perf_counter() - start) / len(queries)
+            print(f"  • {count:>5} emails: {elapsed * 1000:.0f} ms/turn, {len(prompt_sizes) / len(queries):.1f} LLM calls/turn, "
+                  f"~{sum(prompt_sizes) // len(queries) // 4} prompt tokens/turn")
+
+def bench_metadata_routing(count=10, queries=(
+    # The structural questions from test_indexing.py
+    "What is the most recent email?",
+    "What is the last email I received?",
+    "How many emails total?",
+    "List all email subjects",
+    "What is email #1?",
+    "What is the oldest email?",
+    "Show me email #10",
+), topical=(
+    # Structural wording around a topic the filters don't cover: these need the chat engine
+    "How many emails mention the invoice?",
+    "How many times did Acme email me?",
+    "What did the most recent email say about the deadline?",
+    "What is the first email about Python?",
+    "Find work emails about the budget",
+)):
+    """Counts, listings and position lookups are answered from metadata, with no LLM call;
+    questions that also name a topic still reach the LLM"""
+    print(f"\n🧭 Routing {len(queries)} structural and {len(topical)} topical questions over {count} emails")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        llm = FakeLLM()
+        chatbot = make_chatbot(make_mailbox(count), llm, workdir)
+        chatbot.sync_emails(max_emails=count)
+        chatbot.build_index()
+        chatbot.setup_chat_engine()
+
+        llm.calls = 0
+        start = time.perf_counter()
+        answers = [chatbot.chat(query) for query in queries]
+        elapsed = (time.perf_counter() - start) / len(queries)
+        for query, answer in zip(queries, answers):
+            assert not answer.startswith(("❌", "I'm sorry")), f"{query!r} failed: {answer}"
+        assert llm.calls == 0, f"structural questions made {llm.calls} LLM calls"
+        print(f"  • {len(queries)} structural questions answered in {elapsed * 1000:.1f} ms/turn with {llm.calls} LLM calls")
+
+        for query in topical:
+            calls = llm.calls
+            chatbot.chat(query)
+            assert llm.calls > calls, f"{query!r} was answered from metadata"
+        print(f"  • {len(topical)} topical questions sent to the chat engine ({llm.calls} LLM calls)")
+
+def bench_long_emails(count=100, body_words=3000, fact_email=42):
+    """Whole long emails are chunked and indexed: a fact deep in one body still reaches the prompt"""
+    print(f"\n📜 {count} long emails (~{body_words} words each), fact buried in email {fact_email}")
+
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    fact = "The warehouse access code changed to 7731 on Monday."
+    emails = []
+    for i in range(count):
+        words = rng.choices(vocabulary, k=body_words)
+        if i == fact_email:
+            words.insert(body_words * 3 // 4, fact)
+        # Sentences of 12 words, so the splitter has boundaries to work with
+        body = ". ".join(" ".join(words[j:j + 12]) for j in range(0, len(words), 12))
+        emails.append((f"Weekly notes {i}", body))
+
+    prompts = []
+
+    def reply(prompt):
+        prompts.append(prompt)
+        return fake_analysis_reply(prompt)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        chatbot = make_chatbot(FakeGmailService(emails), FakeLLM(reply), workdir)
+        chatbot.sync_emails(max_emails=count)
+        start = time.perf_counter()
+        chatbot.build_index()
+        elapsed = time.perf_counter() - start
+        chunks = len(chatbot.index.vector_store.data.embedding_dict)
+        print(f"  • Indexed {chunks} chunks ({chunks / count:.1f} per email) in {elapsed:.1f}s; "
+              f"fact at character {emails[fact_email][1].index(fact)} of {len(emails[fact_email][1])}")
+
+        chatbot.setup_chat_engine()
+        prompts.clear()
+        chatbot.chat("What is the warehouse access code?")
+        print(f"  • Fact in the answer prompt: {any('7731' in prompt for prompt in prompts)}, "
+              f"context {chatbot.retriever.last_context_tokens} tokens")
+
+def make_thread_mailbox(threads, replies, rng):
+    """Reply chains where, as in real mail clients, every reply quotes the whole conversation"""
+    service = FakeGmailService()
+    vocabulary = [f"word{i}" for i in range(2000)]
+    history = {}
+    for reply in range(replies):
+        for thread in range(threads):
+            sender = f"person{(thread + reply) % 5}@example.com"
+            text = f"Reply {reply} about project {thread}: " + " ".join(rng.choices(vocabulary, k=60))
+            body = f"{text}\n\n--\n{sender}\nExample Corp | +1 555 0100\n"
+            if thread in history:
+                quoted = "\n".join(f"> {line}" for line in history[thread][1].splitlines())
+                body += f"\nOn Mon, 1 Jan 2024 at 10:{reply:02d}, {history[thread][0]} wrote:\n{quoted}\n"
+            subject = f"Project {thread} plan" if not reply else f"Re: Project {thread} plan"
+            service.add_message(subject, body, sender=sender, threadId=f"thread{thread:04d}")
+            history[thread] = (sender, body)
+    return service
+
+def bench_threads(threads=40, replies=6):
+    """Conversation-heavy mailbox: one document per message vs one per thread with quotes stripped"""
+    print(f"\n🧵 {threads} threads x {replies} replies, indexed per message vs per thread")
+
+    for thread_mode in (False, True):
+        prompt_tokens = []
+
+        def reply(prompt):
+            prompt_tokens.append(len(prompt) // 4)
+            return fake_analysis_reply(prompt)
+
+        service = make_thread_mailbox(threads, replies, random.Random(0))
+        with tempfile.TemporaryDirectory() as workdir:
+            chatbot = GmailChatbot(service_factory=lambda: service, llm_factory=lambda: FakeLLM(reply),
+                                   data_dir=workdir, thread_mode=thread_mode)
+            chatbot.sync_emails(max_emails=threads * replies)
+            chatbot.build_index()
+            chunks = len(chatbot.index.vector_store.data.embedding_dict)
+            label = "per thread " if thread_mode else "per message"
+            print(f"  • {label}: {len(chatbot.documents)} documents, {chunks} chunks, "
+                  f"{len(prompt_tokens)} analysis calls, {sum(prompt_tokens)} analysis prompt tokens")
+
+            # One more reply in an existing conversation
+            sender, body = "person1@example.com", "Agreed, let's ship it.\n\nOn Tue, person0 wrote:\n> earlier"
+            service.add_message("Re: Project 3 plan", body, sender=sender, threadId="thread0003")
+            prompt_tokens.clear()
+            chatbot.sync_emails(max_emails=threads * replies + 1)
+            print(f"    new reply: {len(prompt_tokens)} analysis calls, {sum(prompt_tokens)} prompt tokens, "
+                  f"{len(chatbot.documents)} documents")
+            if thread_mode:
+                stats = chatbot.get_email_stats()["threads"]
+                print(f"    quote stripping: {stats['saved_bytes'] / 1024:.0f} KB of "
+                      f"{stats['raw_bytes'] / 1024:.0f} KB body text not indexed ({stats['saved_pct']:.0%})")
+
+def legacy_all_emails_summary(documents):
+    """The previous get_all_emails_summary: every document's text re-split, one string for the whole mailbox"""
+    summary_parts = [f"📧 **Total Emails Processed: {len(documents)}**\n"]
+    for i, doc in enumerate(documents, 1):
+        text_lines = doc.text.split('\n')
+        analysis_line = None
+        for line in text_lines:
+            if line.startswith("AI Analysis:"):
+                analysis_line = text_lines[text_lines.index(line) + 1] if text_lines.index(line) + 1 < len(text_lines) else None
+                break
+        summary_parts.append(f"{i}. **{doc.metadata.get('subject', 'Unknown Subject')}**")
+        if analysis_line and analysis_line.strip():
+            summary_parts.append(f"   {analysis_line.strip()}")
+        summary_parts.append(f"   Email ID: {doc.metadata.get('email_id', 'Unknown')}\n")
+    return "\n".join(summary_parts)
+
+def bench_email_summary(count=10000):
+    """"Summarize all emails": whole-mailbox string vs the first page of precomputed summaries"""
+    print(f"\n📋 Summarizing all of {count} emails")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service, llm = make_mailbox(count), FakeLLM()
+        chatbot = make_chatbot(service, llm, workdir)
+        chatbot.sync_emails(max_emails=count)
+
+        start = time.perf_counter()
+        documents = chatbot._to_documents(chatbot.documents)
+        start = time.perf_counter()
+        legacy = legacy_all_emails_summary(documents)
+        elapsed = time.perf_counter() - start
+        print(f"  • Legacy full summary: {elapsed * 1000:>7.1f} ms ({len(legacy) / 1e6:.1f} MB string)")
+
+        start = time.perf_counter()
+        first_page = chatbot.get_all_emails_summary()
+        elapsed = time.perf_counter() - start
+        print(f"  • First page:          {elapsed * 1000:>7.1f} ms ({len(first_page) / 1e3:.1f} kB string)")
+
+        start = time.perf_counter()
+        page = chatbot.list_email_summaries(offset=50, limit=50, text="subject 12")
+        elapsed = time.perf_counter() - start
+        print(f"  • Filtered page:       {elapsed * 1000:>7.1f} ms ({len(page['items'])} items, has_more={page['has_more']})")
+
+        service.add_message("New subject", "Fresh email body")
+        chatbot.sync_emails(max_emails=count)
+        newest = chatbot.list_email_summaries(limit=1)["items"][0]
+        print(f"  • After sync: #{newest['position']} is '{newest['subject']}', {len(chatbot.summaries)} summaries")
+
+def deep_size(obj):
+    """Bytes reachable from ``obj`` (each object counted once, classes and modules skipped)"""
+    seen, stack, size = set(), [obj], 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, types.ModuleType, types.FunctionType)):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        stack.extend(gc.get_referents(item))
+    return size
+
+def bench_email_records(count=10000):
+    """Memory held for the document set: whole Documents (as before) vs compact records with bodies on disk"""
+    print(f"\n🗃️ In-memory document set for {count} emails")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        chatbot = make_chatbot(make_mailbox(count), FakeLLM(), workdir)
+        chatbot.sync_emails(max_emails=count)
+
+        documents = chatbot._to_documents(chatbot.documents)
+        legacy_mb = deep_size(documents) / 1e6
+        records_mb = deep_size(chatbot.documents) / 1e6
+        print(f"  • Documents (text + metadata): {legacy_mb:>6.1f} MB")
+        print(f"  • EmailRecords:                {records_mb:>6.1f} MB ({legacy_mb / records_mb:.0f}x smaller)")
+
+        start = time.perf_counter()
+        chatbot._to_documents(chatbot.documents[:50])
+        print(f"  • Loading 50 bodies from disk: {(time.perf_counter() - start) * 1000:.0f} ms")
+        print(f"  • Metadata in the LLM text: {documents[0].get_metadata_str(MetadataMode.LLM).splitlines()}")
+        print(f"  • Metadata in the embedding: {documents[0].get_metadata_str(MetadataMode.EMBED).splitlines()}")
+
+def bench_response_cache(count=200, rounds=5):
+    """Quick-question buttons pressed repeatedly: LLM calls with the response cache"""
+    print(f"\n⚡ Repeating quick questions {rounds} times over {count} emails")
+
+    questions = [
+        "Summarize all my emails",
+        "What are the main topics in my inbox?",
+        "Do I have any urgent emails from billing?",
+    ]
+    with tempfile.TemporaryDirectory() as workdir:
+        service, llm = make_mailbox(count), FakeLLM(latency=0.05)
+        chatbot = make_chatbot(service, llm, workdir)
+        chatbot.sync_emails(max_emails=count)
+        chatbot.build_index()
+        chatbot.setup_chat_engine()
+
+        llm.calls = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for question in questions:
+                chatbot.chat(question)
+        elapsed = time.perf_counter() - start
+        print(f"  • {rounds * len(questions)} questions: {elapsed:.2f}s, {llm.calls} LLM calls, "
+              f"cache {chatbot.get_email_stats()['response_cache']}")
+
+        service.add_message("Fresh news", "Something new arrived")
+        chatbot.sync_emails(max_emails=count)
+        chatbot.chat_engine.reset()
+        llm.calls = 0
+        for question in questions:
+            chatbot.chat(question)
+        print(f"  • After a new email: {llm.calls} LLM calls for the same {len(questions)} questions (cache invalidated)")
+
+def bench_streaming(count=5, first_chunk=0.3, per_chunk=0.02):
+    """Time to first token: chat() waits for the whole answer, stream_chat() yields as it arrives"""
+    print(f"\n🌊 Time to first token ({first_chunk * 1000:.0f} ms first chunk, {per_chunk * 1000:.0f} ms per chunk)")
+
+    answer = " ".join(["word"] * 60)
+    with tempfile.TemporaryDirectory() as workdir:
+        service = make_mailbox(count)
+        chatbot = make_chatbot(service, FakeLLM(), workdir)
+        chatbot.sync_emails(max_emails=count)
+        chatbot.build_index()
+        chatbot.llm_wrapper = GeminiLLMWrapper(FakeLLM(answer, latency=first_chunk, chunk_latency=per_chunk))
+        Settings.llm = chatbot.llm_wrapper
+
+        for label, run in (("chat()", lambda q: [chatbot.chat(q)]), ("stream_chat()", chatbot.stream_chat)):
+            chatbot.setup_chat_engine()
+            chatbot.response_cache.clear()
+            start = time.perf_counter()
+            first = None
+            for _ in run("What are the main topics in my inbox?"):
+                first = first or time.perf_counter() - start
+            total = time.perf_counter() - start
+            print(f"  • {label:<14} first text after {first * 1000:.0f} ms, complete after {total * 1000:.0f} ms")
+
+def bench_async_chat(conversations=20, latency=0.2):
+    """Many conversations on one event loop: achat() awaited one at a time vs gathered together"""
+    print(f"\n🔀 {conversations} concurrent conversations ({latency * 1000:.0f} ms per LLM call)")
+
+    questions = [f"What did the team decide in meeting {i}?" for i in range(conversations)]
+    with tempfile.TemporaryDirectory() as workdir:
+        service = make_mailbox(50)
+        chatbot = make_chatbot(service, FakeLLM(), workdir)
+        chatbot.sync_emails(max_emails=50)
+        chatbot.build_index()
+        llm = FakeLLM("The team agreed on next steps.", latency=latency)
+        chatbot.llm_wrapper = GeminiLLMWrapper(llm)
+        Settings.llm = chatbot.llm_wrapper
+
+        async def one_at_a_time():
+            return [await chatbot.achat(q, conversation_id=f"user{i}") for i, q in enumerate(questions)]
+
+        async def together():
+            return await asyncio.gather(*(
+                chatbot.achat(q, conversation_id=f"user{i}") for i, q in enumerate(questions)
+            ))
+
+        timings = []
+        for label, run in (("one at a time", one_at_a_time), ("asyncio.gather", together)):
+            chatbot.setup_chat_engine()
+            chatbot.response_cache.clear()
+            llm.calls = 0
+            start = time.perf_counter()
+            answers = asyncio.run(run())
+            timings.append(time.perf_counter() - start)
+            answered = sum("next steps" in answer for answer in answers)
+            print(f"  • {label:<15} {timings[-1]:.2f}s ({llm.calls} LLM calls, {answered} answered)")
+        print(f"  • Speedup: {timings[0] / timings[1]:.1f}x")
+
+def bench_background_refresh(count=300, new_emails=100, latency=0.01):
+    """Chats while new mail is indexed: blocking refresh vs background build with a snapshot swap"""
+    print(f"\n🔄 Refreshing {new_emails} new emails into a {count}-email mailbox ({latency * 1000:.0f} ms per LLM call)")
+
+    def add_new_mail(service):
+        for i in range(new_emails):
+            service.add_message(f"New subject {i}", f"Fresh email body {i}\n" * 20)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service = make_mailbox(count)
+        chatbot = make_chatbot(service, FakeLLM(latency=latency), workdir)
+        chatbot.sync_emails(max_emails=count + new_emails)
+        chatbot.build_index()
+        chatbot.setup_chat_engine()
+        add_new_mail(service)
+
+        start = time.perf_counter()
+        chatbot.sync_emails(max_emails=count + new_emails)
+        chatbot.build_index()
+        chatbot.setup_chat_engine()
+        blocked = time.perf_counter() - start
+        print(f"  • Blocking refresh: no chats for {blocked:.2f}s")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        service = make_mailbox(count)
+        refresher = BackgroundRefresher(make_chatbot(service, FakeLLM(latency=latency), workdir), count + new_emails)
+        refresher.refresh(wait=True)
+        first = refresher.chatbot
+        first.chat("What is the latest email about?")
+        add_new_mail(service)
+
+        refresher.refresh()
+        latencies, answered = [], 0
+        while refresher.chatbot is first and refresher.state != "failed":
+            start = time.perf_counter()
+            answer = refresher.chatbot.chat(f"What did the email about topic {len(latencies)} say?")
+            latencies.append(time.perf_counter() - start)
+            answered += not answer.startswith(("❌", "I'm sorry"))
+        refresher.stop()
+
+        status = refresher.status()
+        history = len(refresher.chatbot.chat_memory.get_all())
+        print(f"  • Background refresh: built in {status['last_duration']:.2f}s, {answered}/{len(latencies)} chats "
+              f"answered meanwhile (slowest {max(latencies, default=0) * 1000:.0f} ms)")
+        print(f"  • Swapped in {status['emails']} emails after {status['builds']} builds, "
+              f"{history} chat messages carried over")
+
+def bench_keyword_search(count=50000, words_per_email=120):
+    """BM25 lookups, save and load on a large synthetic mailbox"""
+    print(f"\n🔎 Keyword search over {count} emails")
+
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(30000)]
+    # Zipf-like word frequencies, so common words have long posting lists
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+    index = KeywordIndex()
+    start = time.perf_counter()
+    for i in range(count):
+        words = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=words_per_email))
+        index.add(f"msg{i:06d}", f"Invoice {i} from billing@vendor{i % 300}.com\n{words}")
+    print(f"  • Build: {time.perf_counter() - start:.1f}s")
+
+    for query in ("invoice 4471 vendor12", "term1 term2 term3 report", "term12000 term25000"):
+        index.search(query)  # first use merges buffered postings
+        start = time.perf_counter()
+        hits = index.search(query)
+        print(f"  • '{query}': {(time.perf_counter() - start) * 1000:.1f} ms, top hit {hits[0][0] if hits else None}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "keywords.npz")
+        start = time.perf_counter()
+        index.persist(path)
+        print(f"  • Save: {time.perf_counter() - start:.2f}s ({os.path.getsize(path) / 1e6:.0f} MB)")
+        start = time.perf_counter()
+        KeywordIndex.load(path)
+        print(f"  • Load: {time.perf_counter() - start:.2f}s")
+
+def bench_digest(count=5000, new_emails=5):
+    """Mailbox digest: one prompt with every analysis vs a cached map-reduce tree of partial digests"""
+    print(f"\n🗞️ Digest of {count} emails, then again after {new_emails} new ones")
+
+    rng = random.Random(0)
+    categories, priorities = ["Work", "Security", "Promotion", "Personal", "Other"], ["Urgent", "Normal", "Low"]
+
+    def analysis(i):
+        return (f"Email {i} about project {rng.randrange(200)} asks for a review by Friday.\n"
+                f"Category: {rng.choice(categories)}\nPriority: {rng.choice(priorities)}")
+
+    analyses = [(f"msg{i:06d}", analysis(i)) for i in range(count)]
+    legacy_prompt = f"Here are multiple email analyses. Create a short daily digest...\n{[a for _, a in analyses]}"
+    print(f"  • Single digest prompt: {estimate_tokens(legacy_prompt)} tokens, resent in full on every run")
+
+    prompt_tokens = []
+
+    def reply(prompt):
+        prompt_tokens.append(estimate_tokens(prompt))
+        return f"Partial digest of a {len(prompt)}-character prompt: reviews due Friday, two urgent threads."
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cache = AnalysisCache(os.path.join(workdir, "digests.sqlite3"))
+        for label, emails in (("First run", analyses),
+                              (f"+{new_emails} emails", analyses + [(f"msg{i:06d}", analysis(i))
+                                                                     for i in range(count, count + new_emails)])):
+            prompt_tokens.clear()
+            start = time.perf_counter()
+            digest = build_digest(FakeLLM(reply), emails, cache)
+            elapsed = time.perf_counter() - start
+            print(f"  • {label:<10} {digest['llm_calls']:>4} LLM calls ({digest['leaves']} leaves), "
+                  f"largest prompt {max(prompt_tokens, default=0)} tokens, {elapsed:.2f}s")
+        print(f"  • Counts (local): {digest['category_counts']}, urgent {digest['priority_counts']['Urgent']}")
+
+def bench_batch_analysis(count=200, latency=0.005):
+    """LLM calls for a backfill with one email per prompt vs packed prompts"""
+    print(f"\n📦 Analyzing {count} emails ({latency * 1000:.0f} ms per LLM call)")
+
+    emails = [(f"id{i}", f"Subject {i}", f"Body of email {i}\n" * 20) for i in range(count)]
+    for batch_size in [1, 8, 20]:
+        llm = FakeLLM(latency=latency)
+        start = time.perf_counter()
+        analyses = analyze_emails_batched(llm, emails, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        assert all(isinstance(analysis, str) for analysis in analyses)
+        print(f"  • {batch_size:>2} per prompt: {llm.calls} LLM calls, {elapsed:.2f}s")
+
+    # Malformed batch output falls back to one call per email
+    llm = FakeLLM(reply=lambda prompt: "not json" if "<email id=" in prompt else "Summary\nCategory: Other")
+    analyze_emails_batched(llm, emails[:8], batch_size=8)
+    print(f"  • Malformed batch of 8: {llm.calls} LLM calls (1 batch + 8 fallbacks)")
+
+def bench_llm_pool(count=40, latency=0.05):
+    """Analysis wall time as the worker pool grows, plus rate limiting and retries"""
+    print(f"\n🧵 Analyzing {count} emails ({latency * 1000:.0f} ms per LLM call)")
+
+    emails = [(f"id{i}", f"Subject {i}", f"Body of email {i}") for i in range(count)]
+    baseline = None
+    for workers in [1, 2, 4, 8]:
+        llm = FakeLLM(latency=latency)
+        start = time.perf_counter()
+        analyze_emails_batched(llm, emails, batch_size=1, max_workers=workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"  • {workers} workers: {elapsed:.2f}s (speedup {baseline / elapsed:.1f}x)")
+
+    limited = RateLimitedLLM(FakeLLM(), RateLimiter(requests_per_minute=600))
+    limited.limiter.requests.tokens = 0  # start empty to show the steady rate
+    start = time.perf_counter()
+    analyze_emails_batched(limited, emails[:10], batch_size=1, max_workers=4)
+    print(f"  • 10 calls at 600 requests/min: {time.perf_counter() - start:.2f}s (expected ~1s)")
+
+    flaky = RateLimitedLLM(FakeLLM(failures=3), RateLimiter(), base_delay=0.01)
+    results = analyze_emails_batched(flaky, emails[:1], batch_size=1)
+    print(f"  • 3 x 429 then success: {flaky.calls} calls, ok={isinstance(results[0], str)}")
+
+def write_eml_corpus(workdir, count, rng):
+    """Sample .eml files: plain, multipart/alternative, HTML-only newsletters, and plain with a large attachment"""
+    newsletter = (
+        "<html><head><title>Weekly digest</title><style>.x{{color:red}}</style></head><body>"
+        "<p><a href='#'>View this email in your browser</a></p><script>track({i})</script>"
+        "<table><tr><td><h1>Issue {i}</h1><p>Shipping update for order&nbsp;#{i}: "
+        "the package leaves the warehouse on Friday.</p></td></tr></table>"
+        "<img src='https://t.example.com/open/{i}.gif' width=1 height=1>"
+        "<p>You are receiving this because you subscribed. <a href='#'>Unsubscribe</a></p></body></html>"
+    )
+    for i in range(count):
+        message = EmailMessage()
+        message["Subject"] = f"Sample {i}"
+        message["From"] = f"sender{i % 20}@example.com"
+        text = f"Plain body of sample {i} about the quarterly budget.\n" * 10
+        kind = i % 4
+        if kind == 0:
+            message.set_content(text)
+        elif kind == 1:
+            message.set_content(text)
+            message.add_alternative(newsletter.format(i=i), subtype="html")
+        elif kind == 2:
+            message.set_content(newsletter.format(i=i), subtype="html")
+        else:
+            message.set_content(text)
+            message.add_attachment(rng.randbytes(3_000_000), maintype="application", subtype="pdf",
+                                   filename=f"report{i}.pdf")
+        with open(os.path.join(workdir, f"sample{i:04d}.eml"), "wb") as eml:
+            eml.write(message.as_bytes())
+
+def legacy_decode_raw_message(msg):
+    """The previous decoder: full parse of the whole message, text/plain parts only"""
+    mime_msg = message_from_bytes(base64.urlsafe_b64decode(msg["raw"].encode("ASCII")))
+    body = ""
+    if mime_msg.is_multipart():
+        for part in mime_msg.walk():
+            if part.get_content_type() == "text/plain":
+                body = part.get_payload(decode=True).decode(errors="ignore")
+                break
+    else:
+        body = mime_msg.get_payload(decode=True).decode(errors="ignore")
+    return mime_msg, body
+
+def bench_eml_parsing(corpus_dir=None, count=200):
+    """Messages/sec and empty bodies when decoding raw messages, over .eml files in ``corpus_dir``
+    (a generated corpus of ``count`` samples when not given)"""
+    with tempfile.TemporaryDirectory() as workdir:
+        if not corpus_dir:
+            write_eml_corpus(workdir, count, random.Random(0))
+            corpus_dir = workdir
+        messages = []
+        for path in sorted(glob.glob(os.path.join(corpus_dir, "*.eml"))):
+            with open(path, "rb") as eml:
+                messages.append({"raw": base64.urlsafe_b64encode(eml.read()).decode("ASCII")})
+
+    total_mb = sum(len(msg["raw"]) for msg in messages) * 3 / 4 / 1e6
+    print(f"\n📨 Parsing {len(messages)} .eml files ({total_mb:.0f} MB)")
+    if not messages:
+        return
+    for label, decode in [("Legacy decode", legacy_decode_raw_message), ("Single pass", decode_raw_message)]:
+        start = time.perf_counter()
+        bodies = [decode(msg)[1] for msg in messages]
+        elapsed = time.perf_counter() - start
+        empty = sum(not body.strip() for body in bodies)
+        markup = sum("</" in body for body in bodies)
+        print(f"  • {label:<13} {len(messages) / elapsed:>6.0f} msgs/s ({total_mb / elapsed:.0f} MB/s), "
+              f"{empty} empty bodies, {markup} bodies with HTML markup")
+
+def legacy_hash_embedding(text, embedding_dim=384):
+    """The previous SimpleEmbedding: salted hash(), rebuilt one float at a time"""
+    text_hash = hash(text)
+    return [float((text_hash + i) % 1000) / 1000 for i in range(embedding_dim)]
+
+def bench_embeddings(count=2000):
+    """Embeddings/sec of the legacy hash embedding vs the batched hashing embedding
+
+    The legacy embedding never reads the words (one hash() of the whole text),
+    so it is a floor on cost rather than a quality-equivalent baseline.
+    """
+    print(f"\n🔢 Embedding {count} email documents")
+
+    texts = [f"Subject: Invoice {i} from Acme\n" + f"Body of email {i} about the quarterly budget review. " * 15
+             for i in range(count)]
+
+    start = time.perf_counter()
+    for text in texts:
+        legacy_hash_embedding(text)
+    legacy = time.perf_counter() - start
+    print(f"  • Legacy hash():       {count / legacy:>8.0f} embeddings/s (not stable across processes)")
+
+    model = HashingEmbedding()
+    start = time.perf_counter()
+    model.embed_batch(texts)
+    elapsed = time.perf_counter() - start
+    print(f"  • HashingEmbedding:    {count / elapsed:>8.0f} embeddings/s ({model.dim} dims, one NumPy array)")
+
+    start = time.perf_counter()
+    model.get_text_embedding_batch(texts)
+    elapsed = time.perf_counter() - start
+    print(f"  • Through LlamaIndex:  {count / elapsed:>8.0f} embeddings/s (batches of {model.embed_batch_size}, "
+          f"returned as Python lists)")
+
+    a, b, c = model.embed_batch(["invoice 4471 from Acme", "Acme sent invoice 4471", "team lunch on friday"])
+    print(f"  • Cosine related/unrelated: {float(a @ b):.2f} / {float(a @ c):.2f}")
+
+def main():
+    print("⏱️ Gmail Chatbot Benchmarks")
+    print("=" * 50)
+    bench_fetch()
+    bench_fetch_retries()
+    bench_sync()
+    bench_restart()
+    bench_warm_reload()
+    bench_index_reload()
+    bench_incremental_index()
+    bench_chat_turn()
+    bench_metadata_routing()
+    bench_long_emails()
+    bench_threads()
+    bench_eml_parsing(os.getenv("EML_CORPUS_DIR"))
+    bench_email_summary()
+    bench_email_records()
+    bench_response_cache()
+    bench_streaming()
+    bench_async_chat()
+    bench_background_refresh()
+    bench_keyword_search()
+    bench_batch_analysis()
+    bench_digest()
+    bench_llm_pool()
+    bench_embeddings()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Sorted date index: recency ranks ("email #3", "most recent", "oldest") computed at query time
+"""
+
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+def date_key(email_id: str, internal_date: int) -> Tuple[int, str]:
+    """Sort key putting the newest email first; ties are broken by id so the order is total"""
+    return -(internal_date or 0), email_id
+
+class DateIndex:
+    """Email ids ordered newest first by Gmail internal date.
+
+    Documents only store their (immutable) internal date; an email's rank
+    (1 = most recent) and the mailbox total are read from this index when a
+    question needs them, so a new email never changes another document.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[int, str]] = []
+        self._dates: Dict[str, int] = {}
+
+    @classmethod
+    def from_records(cls, records: Iterable) -> "DateIndex":
+        index = cls()
+        index.rebuild(records)
+        return index
+
+    def rebuild(self, records: Iterable):
+        """Replace the contents, in place, with anything that has ``email_id`` and ``internal_date`` (EmailRecords)"""
+        self._dates = {record.email_id: record.internal_date or 0 for record in records}
+        self._keys = sorted(date_key(email_id, date) for email_id, date in self._dates.items())
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, email_id: str) -> bool:
+        return email_id in self._dates
+
+    def add(self, email_id: str, internal_date: int):
+        self.remove(email_id)
+        self._dates[email_id] = internal_date or 0
+        insort(self._keys, date_key(email_id, internal_date))
+
+    def remove(self, email_id: str):
+        internal_date = self._dates.pop(email_id, None)
+        if internal_date is None:
+            return
+        del self._keys[bisect_left(self._keys, date_key(email_id, internal_date))]
+
+    def rank(self, email_id: str) -> Optional[int]:
+        """1 for the most recent email, len(self) for the oldest, None if not indexed"""
+        internal_date = self._dates.get(email_id)
+        if internal_date is None:
+            return None
+        return bisect_left(self._keys, date_key(email_id, internal_date)) + 1
+
+    def ids(self, first: int = 1, last: Optional[int] = None) -> List[str]:
+        """Ids ranked ``first`` to ``last`` (inclusive, 1-based), newest first"""
+        return [email_id for _, email_id in self._keys[max(first, 1) - 1:last]]
@@ -0,0 +1,70 @@
+"""
+Compact per-email records kept in memory instead of whole Documents
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+class EmailRecord:
+    """The small fields of one indexed email (or thread): ids, dates and what routing needs.
+
+    Bodies are not kept; they are read back from the message store when a
+    Document has to be built for the index. ``metadata`` rebuilds the
+    metadata dict that facets, summaries and the metadata router read, and
+    ``doc_id`` matches the Document's id, so a record can stand in for its
+    Document everywhere except the index itself. Nothing depends on the
+    other emails: recency ranks come from a DateIndex.
+    """
+
+    __slots__ = ("email_id", "subject", "sender", "internal_date", "fetched_at", "analysis", "category",
+                 "priority", "message_ids", "raw_bytes", "delta_bytes")
+
+    def __init__(self, email_id: str, subject: str, sender: str, internal_date: int, fetched_at: float,
+                 analysis: str, category: str, priority: str, message_ids: Optional[List[str]] = None,
+                 raw_bytes: int = 0, delta_bytes: int = 0):
+        self.email_id = email_id
+        self.subject = subject
+        self.sender = sender
+        self.internal_date = internal_date
+        self.fetched_at = fetched_at
+        self.analysis = analysis
+        self.category = category
+        self.priority = priority
+        # Thread records only: the Gmail messages behind the thread and its body sizes
+        self.message_ids = message_ids
+        self.raw_bytes = raw_bytes
+        self.delta_bytes = delta_bytes
+
+    @property
+    def doc_id(self) -> str:
+        return self.email_id
+
+    @property
+    def email_date(self) -> str:
+        if not self.internal_date:
+            return ""
+        return datetime.fromtimestamp(self.internal_date / 1000).isoformat(timespec="seconds")
+
+    @property
+    def metadata(self) -> dict:
+        metadata = {
+            "subject": self.subject,
+            "email_id": self.email_id,
+            "sender": self.sender,
+            "email_date": self.email_date,
+            "analysis": self.analysis,
+            "category": self.category,
+            "priority": self.priority,
+            "internal_date": self.internal_date,
+        }
+        if self.message_ids is not None:
+            metadata.update({
+                "message_ids": ",".join(self.message_ids),
+                "message_count": len(self.message_ids),
+                "raw_bytes": self.raw_bytes,
+                "delta_bytes": self.delta_bytes,
+            })
+        return metadata
+
+    def __repr__(self) -> str:
+        return f"EmailRecord({self.email_id!r}, {self.email_date!r}, {self.subject[:40]!r})"
@@ -0,0 +1,104 @@
+"""
+Local, deterministic CPU embeddings for LlamaIndex
+"""
+
+import os
+import re
+import zlib
+from typing import List
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 512))
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9'@.\-]*[a-z0-9]|[a-z0-9]")
+
+# Common English words carry no topical signal; dropping them stands in for IDF
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he
+her here hers him his how i if in into is it its just me more most my no nor not now of off on once
+only or other our out over own same she should so some such than that the their them then there these
+they this those through to too under until up very was we were what when where which while who whom
+why will with would you your yours email emails subject
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens with stopwords removed (shared with the keyword index)"""
+    return [t for t in _TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+class HashingEmbedding(BaseEmbedding):
+    """Feature-hashed bag-of-words embeddings computed in NumPy.
+
+    Unigrams and bigrams are hashed with CRC32 into ``dim`` signed buckets,
+    weighted by sublinear term frequency and L2-normalised. CRC32 is
+    unsalted, so a text maps to the same vector in every process and
+    persisted indexes stay valid. Weights use no corpus statistics, so
+    vectors never drift as the mailbox grows.
+    """
+
+    dim: int = EMBEDDING_DIM
+
+    def __init__(self, dim: int = EMBEDDING_DIM, **kwargs):
+        kwargs.setdefault("model_name", f"hashing-bow-{dim}")
+        kwargs.setdefault("embed_batch_size", 256)
+        super().__init__(dim=dim, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed many texts at once into a ``(len(texts), dim)`` float32 array
+
+        Features (unigrams, then bigrams) of the whole batch are collected in
+        one flat list and factorized; each distinct feature is hashed once,
+        and per-text counts, weights and bucket sums are computed as array
+        operations (one ``np.unique`` and one ``np.bincount``).
+        """
+        dim = self.dim
+        features, lengths = [], []
+        for text in texts:
+            tokens = tokenize(text)
+            features += tokens
+            features += map(" ".join, zip(tokens, tokens[1:]))
+            lengths.append(max(2 * len(tokens) - 1, 0))
+
+        distinct = dict.fromkeys(features)
+        ids = dict(zip(distinct, range(len(distinct))))
+        feature_ids = np.fromiter(map(ids.__getitem__, features), dtype=np.int64, count=len(features))
+        hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in distinct),
+                             dtype=np.int64, count=len(distinct))
+
+        # Term frequency of every (text, feature) pair
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+        pairs, counts = np.unique(rows * max(len(distinct), 1) + feature_ids, return_counts=True)
+        rows, feature_ids = np.divmod(pairs, max(len(distinct), 1))
+        hashes = hashes[feature_ids]
+        # Low bits pick the bucket, the top bit the sign, so collisions cancel out on average
+        signs = np.where(hashes & 0x80000000, 1.0, -1.0)
+
+        matrix = np.bincount(
+            rows * dim + hashes % dim,
+            weights=signs * (1.0 + np.log(counts)),
+            minlength=len(texts) * dim,
+        ).astype(np.float32).reshape(len(texts), dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_batch(texts).tolist()
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.embed_batch([text])[0].tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
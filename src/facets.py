@@ -0,0 +1,87 @@
+"""
+Typed category/priority metadata and an in-memory facet index over emails
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .gmail_summarizer import parse_analysis
+except ImportError:
+    # Fallback for when running as script
+    from gmail_summarizer import parse_analysis
+
+FACET_FIELDS = ("category", "priority")
+DEFAULT_FACETS = {"category": "Other", "priority": "Normal"}
+
+# Words a user might type for each facet value
+FACET_SYNONYMS = {
+    "category": {
+        "Work": ["work", "work-related", "job", "jobs", "career"],
+        "Security": ["security", "security-related"],
+        "Promotion": ["promotion", "promotions", "promotional", "marketing", "promo"],
+        "Personal": ["personal"],
+        "Other": ["other", "miscellaneous"],
+    },
+    "priority": {
+        "Urgent": ["urgent", "important", "high-priority", "high priority"],
+        "Normal": ["normal", "normal-priority"],
+        "Low": ["low", "low-priority", "low priority"],
+    },
+}
+
+class FacetIndex:
+    """Counts and postings (email ids) per facet value, updated incrementally"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, set]] = {field: {} for field in FACET_FIELDS}
+        self._facets_by_id: Dict[str, Dict[str, str]] = {}
+
+    @classmethod
+    def from_documents(cls, documents: Iterable) -> "FacetIndex":
+        index = cls()
+        for doc in documents:
+            index.add(doc.doc_id, doc.metadata)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._facets_by_id)
+
+    def add(self, email_id: str, metadata: dict):
+        self.remove(email_id)
+        facets = {field: metadata.get(field, DEFAULT_FACETS[field]) for field in FACET_FIELDS}
+        self._facets_by_id[email_id] = facets
+        for field, value in facets.items():
+            self.postings[field].setdefault(value, set()).add(email_id)
+
+    def remove(self, email_id: str):
+        facets = self._facets_by_id.pop(email_id, None)
+        if not facets:
+            return
+        for field, value in facets.items():
+            ids = self.postings[field].get(value)
+            if ids is not None:
+                ids.discard(email_id)
+                if not ids:
+                    del self.postings[field][value]
+
+    def count(self, field: str, value: str) -> int:
+        return len(self.postings[field].get(value, ()))
+
+    def ids(self, field: str, value: str) -> set:
+        return self.postings[field].get(value, set())
+
+    def counts(self, field: str) -> Dict[str, int]:
+        """Value -> count for one facet, largest first"""
+        counts = {value: len(ids) for value, ids in self.postings[field].items()}
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+def match_facet(query: str) -> Optional[Tuple[str, str]]:
+    """Find the facet value a query mentions, e.g. "urgent emails" -> ("priority", "Urgent")"""
+    query_lower = query.lower()
+    for field, values in FACET_SYNONYMS.items():
+        for value, words in values.items():
+            for word in words:
+                if re.search(rf"\b{re.escape(word)}\b", query_lower):
+                    return field, value
+    return None
@@ -0,0 +1,279 @@
+"""
+Offline stand-ins for the Gmail API client, used for benchmarks and
+checks that must run without network access or credentials
+"""
+
+import asyncio
+import base64
+import json
+import re
+import threading
+import time
+from email.message import EmailMessage
+
+def make_raw_message(subject, body, sender="sender@example.com"):
+    """Build a base64url-encoded RFC 822 message like Gmail's format="raw" """
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = sender
+    message["To"] = "me@example.com"
+    message.set_content(body)
+    return base64.urlsafe_b64encode(message.as_bytes()).decode("ASCII")
+
+class _Request:
+    """Mimics googleapiclient's HttpRequest: work happens on execute()"""
+
+    def __init__(self, service, kind, fn):
+        self._service = service
+        self.kind = kind
+        self._fn = fn
+
+    def execute(self):
+        self._service._round_trip(self.kind)
+        return self._fn()
+
+class _BatchRequest:
+    """Mimics BatchHttpRequest: all added calls cost a single round trip"""
+
+    def __init__(self, service, callback=None):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id if request_id is not None else str(len(self._requests))
+        self._requests.append((request, callback or self._callback, request_id))
+
+    def execute(self):
+        self._service._round_trip("batch")
+        for request, callback, request_id in self._requests:
+            try:
+                response, exception = request._fn(), None
+            except Exception as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+class _Messages:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId="me", maxResults=100, pageToken=None, q=None, labelIds=None, **kwargs):
+        return _Request(self._service, "list",
+                        lambda: self._service._list_messages(maxResults, pageToken, labelIds))
+
+    def get(self, userId="me", id=None, format="full", **kwargs):
+        return _Request(self._service, "get", lambda: self._service._get_message(id, format))
+
+class _History:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId="me", startHistoryId=None, pageToken=None, maxResults=100, **kwargs):
+        return _Request(self._service, "history",
+                        lambda: self._service._list_history(startHistoryId, pageToken, maxResults))
+
+class _Users:
+    def __init__(self, service):
+        self._service = service
+
+    def messages(self):
+        return _Messages(self._service)
+
+    def history(self):
+        return _History(self._service)
+
+    def getProfile(self, userId="me"):
+        return _Request(self._service, "profile", lambda: {"historyId": str(self._service.history_id)})
+
+class FakeGmailService:
+    """In-memory Gmail service with injectable per-round-trip latency.
+
+    ``messages`` is a list of ``(subject, body)`` tuples ordered newest first.
+    ``calls`` counts round trips by kind ("get", "batch", ...). With
+    ``rate_limit_every`` set, every Nth message get (batched or not) fails
+    with a 429, as Gmail does when too many requests run at once.
+    """
+
+    def __init__(self, messages=None, latency=0.0, rate_limit_every=0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self._gets = 0
+        self.calls = {}
+        self.history_id = 1000
+        self._lock = threading.Lock()
+        self._messages = []
+        self._history = []
+        self._history_floor = 0
+        self._next_id = 1
+        for subject, body in messages or []:
+            self.add_message(subject, body)
+
+    def add_message(self, subject, body, msg_id=None, sender="sender@example.com", **fields):
+        """Add a message as the newest in the mailbox and return its id"""
+        with self._lock:
+            msg_id = msg_id or f"msg{self._next_id:06d}"
+            self._next_id += 1
+            message = {
+                "id": msg_id,
+                "raw": make_raw_message(subject, body, sender),
+                # One minute apart, so newer messages always sort first
+                "internalDate": str(1700000000000 + self._next_id * 60000),
+            }
+            message.update(fields)
+            self._messages.insert(0, message)
+            self._record_history("messagesAdded", msg_id)
+        return msg_id
+
+    def delete_message(self, msg_id):
+        with self._lock:
+            self._messages = [m for m in self._messages if m["id"] != msg_id]
+            self._record_history("messagesDeleted", msg_id)
+
+    def expire_history(self):
+        """Drop the history log, as Gmail does after about a week"""
+        with self._lock:
+            self._history = []
+            self._history_floor = self.history_id
+
+    def _record_history(self, kind, msg_id):
+        self.history_id += 1
+        self._history.append({"id": str(self.history_id), kind: [{"message": {"id": msg_id}}]})
+
+    def users(self):
+        return _Users(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchRequest(self, callback)
+
+    def _round_trip(self, kind):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _list_messages(self, max_results, page_token, label_ids):
+        with self._lock:
+            messages = [
+                m for m in self._messages
+                if not label_ids or set(label_ids) <= set(m.get("labelIds", []))
+            ]
+        offset = int(page_token or 0)
+        page = messages[offset:offset + max_results]
+        result = {"messages": [{"id": m["id"], "threadId": m.get("threadId", m["id"])} for m in page]}
+        if offset + max_results < len(messages):
+            result["nextPageToken"] = str(offset + max_results)
+        return result
+
+    def _list_history(self, start_history_id, page_token, max_results):
+        if int(start_history_id) < self._history_floor:
+            raise LookupError(f"History {start_history_id} is no longer available (404)")
+        with self._lock:
+            records = [r for r in self._history if int(r["id"]) > int(start_history_id)]
+            history_id = str(self.history_id)
+        offset = int(page_token or 0)
+        result = {"history": records[offset:offset + max_results], "historyId": history_id}
+        if offset + max_results < len(records):
+            result["nextPageToken"] = str(offset + max_results)
+        return result
+
+    def _get_message(self, msg_id, format):
+        if self.rate_limit_every:
+            with self._lock:
+                self._gets += 1
+                limited = self._gets % self.rate_limit_every == 0
+            if limited:
+                raise FakeRateLimitError("429 Too many concurrent requests for user")
+        for message in self._messages:
+            if message["id"] == msg_id:
+                resource = {"id": msg_id, "threadId": message.get("threadId", msg_id),
+                            "internalDate": message["internalDate"]}
+                if format == "raw":
+                    resource["raw"] = message["raw"]
+                return resource
+        raise KeyError(f"Message {msg_id} not found")
+
+class FakeMessage:
+    """Shape of a LangChain AIMessage as far as this app uses it"""
+
+    def __init__(self, content):
+        self.content = content
+
+def fake_analysis_reply(prompt):
+    """Answer batch analysis prompts with a JSON array and anything else with plain text"""
+    email_ids = re.findall(r'<email id="([^"]+)">', prompt)
+    if email_ids:
+        return json.dumps([
+            {"id": email_id, "summary": "A short summary of the email.", "category": "Work", "priority": "Normal"}
+            for email_id in email_ids
+        ])
+    return "A short summary of the email.\nCategory: Work\nPriority: Normal"
+
+class FakeRateLimitError(Exception):
+    """Looks like the API's 429 RESOURCE_EXHAUSTED error"""
+
+    status_code = 429
+
+class FakeLLM:
+    """Deterministic stand-in for ChatGoogleGenerativeAI with injectable latency.
+
+    ``reply`` is a string or a ``prompt -> str`` callable; ``calls`` counts
+    invocations. The first ``failures`` calls raise FakeRateLimitError.
+    ``stream`` yields the reply word by word: ``latency`` before the first
+    chunk, then ``chunk_latency`` before each of the others. ``ainvoke`` and
+    ``astream`` behave the same but sleep with asyncio.
+    """
+
+    def __init__(self, reply=None, latency=0.0, failures=0, chunk_latency=0.0):
+        self.reply = reply or fake_analysis_reply
+        self.latency = latency
+        self.failures = failures
+        self.chunk_latency = chunk_latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count_call(self):
+        with self._lock:
+            self.calls += 1
+            failing = self.calls <= self.failures
+        if failing:
+            raise FakeRateLimitError("429 RESOURCE_EXHAUSTED")
+
+    def _start(self, prompt):
+        self._count_call()
+        if self.latency:
+            time.sleep(self.latency)
+        return self.reply(prompt) if callable(self.reply) else self.reply
+
+    async def _astart(self, prompt):
+        self._count_call()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.reply(prompt) if callable(self.reply) else self.reply
+
+    def invoke(self, prompt, **kwargs):
+        text = self._start(prompt)
+        # A full response takes as long as streaming all of it
+        if self.chunk_latency:
+            time.sleep(self.chunk_latency * max(0, len(text.split()) - 1))
+        return FakeMessage(text)
+
+    def stream(self, prompt, **kwargs):
+        text = self._start(prompt)
+        for i, word in enumerate(re.findall(r"\S+\s*", text)):
+            if i and self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield FakeMessage(word)
+
+    async def ainvoke(self, prompt, **kwargs):
+        text = await self._astart(prompt)
+        if self.chunk_latency:
+            await asyncio.sleep(self.chunk_latency * max(0, len(text.split()) - 1))
+        return FakeMessage(text)
+
+    async def astream(self, prompt, **kwargs):
+        text = await self._astart(prompt)
+        for i, word in enumerate(re.findall(r"\S+\s*", text)):
+            if i and self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+            yield FakeMessage(word)
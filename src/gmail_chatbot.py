@@ -2,26 +2,130 @@ import os
 import json
 import email.header
 import re
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from llama_index.core import Document, VectorStoreIndex, Settings, SimpleDirectoryReader
-from llama_index.core.chat_engine import SimpleChatEngine
-from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
-from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.chat_engine import SimpleChatEngine, CondensePlusContextChatEngine
+from llama_index.core.base.llms.generic_utils import (
+    completion_response_to_chat_response, astream_completion_response_to_chat_response
+)
+from llama_index.core.base.llms.types import CompletionResponseAsyncGen, ChatResponse, ChatResponseAsyncGen
+from llama_index.core.llms import (
+    CustomLLM, CompletionResponse, CompletionResponseGen, LLMMetadata, ChatMessage, MessageRole
+)
 from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.llms.callbacks import llm_completion_callback
-from typing import List, Any, Optional
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from typing import Dict, List, Any, Optional, Iterator, Tuple, Sequence
 
 # Import our Gmail functionality
 try:
-    from .gmail_summarizer import get_gmail_service, get_email_content, analyze_with_gemini, get_llm
+    from .gmail_summarizer import (
+        get_gmail_service, iter_message_pages, fetch_email_contents, analyze_emails_batched, get_llm,
+        get_history_id, list_history_changes, parse_message_record, DATA_DIR, ANALYSIS_BATCH_SIZE
+    )
+    from .message_store import MessageStore
+    from .analysis_cache import AnalysisCache
+    from .llm_pool import RateLimiter, RateLimitedLLM, LLM_MAX_CONCURRENCY
+    from .facets import FacetIndex, parse_analysis
+    from .embeddings import HashingEmbedding
+    from .index_storage import persist_index, load_index, load_index_meta
+    from .retrieval import EmailRetriever, QUERY_MARKER, CHAT_CONTEXT_TOKENS, metadata_matches, position_ids, parse_query_filters
+    from .query_router import route_query, describe_filters
+    from .response_cache import ResponseCache, normalize_query, conversation_hash, is_follow_up
+    from .keyword_index import KeywordIndex, KEYWORD_INDEX_FILE
+    from .prompt_budget import PromptBudget, count_tokens, CHAT_MEMORY_TOKENS
+    from .threads import build_threads, thread_report, sender_of
+    from .summaries import SummaryIndex, SUMMARY_PAGE_SIZE
+    from .email_records import EmailRecord
+    from .date_index import DateIndex, date_key
 except ImportError:
     # Fallback for when running as script
-    from gmail_summarizer import get_gmail_service, get_email_content, analyze_with_gemini, get_llm
+    from gmail_summarizer import (
+        get_gmail_service, iter_message_pages, fetch_email_contents, analyze_emails_batched, get_llm,
+        get_history_id, list_history_changes, parse_message_record, DATA_DIR, ANALYSIS_BATCH_SIZE
+    )
+    from message_store import MessageStore
+    from analysis_cache import AnalysisCache
+    from llm_pool import RateLimiter, RateLimitedLLM, LLM_MAX_CONCURRENCY
+    from facets import FacetIndex, parse_analysis
+    from embeddings import HashingEmbedding
+    from index_storage import persist_index, load_index, load_index_meta
+    from retrieval import EmailRetriever, QUERY_MARKER, CHAT_CONTEXT_TOKENS, metadata_matches, position_ids, parse_query_filters
+    from query_router import route_query, describe_filters
+    from response_cache import ResponseCache, normalize_query, conversation_hash, is_follow_up
+    from keyword_index import KeywordIndex, KEYWORD_INDEX_FILE
+    from prompt_budget import PromptBudget, count_tokens, CHAT_MEMORY_TOKENS
+    from threads import build_threads, thread_report, sender_of
+    from summaries import SummaryIndex, SUMMARY_PAGE_SIZE
+    from email_records import EmailRecord
+    from date_index import DateIndex, date_key
 
 load_dotenv()
 
+# Longest subject listing the metadata router returns in one answer
+ROUTER_LIST_LIMIT = 50
+# "Summarize all emails" style requests, answered a page at a time from the precomputed summaries,
+# and the follow-ups that move through the pages
+SUMMARY_REQUEST = re.compile(r"\ball (?:[\w-]+ )?emails\b|summarize emails|show me all|complete summary|all subjects")
+SUMMARY_NEXT_PAGE = re.compile(r"\b(?:next page|more emails|show more|next \d* ?emails)\b")
+SUMMARY_PAGE_NUMBER = re.compile(r"\bpage\s+(\d+)\b")
+# Room left in every chat prompt for the question and its per-turn hints
+QUERY_RESERVE_TOKENS = 200
+
+# Emails are indexed in full as chunks of EMAIL_CHUNK_SIZE tokens, each embedded on its own
+EMAIL_CHUNK_SIZE = int(os.getenv("EMAIL_CHUNK_SIZE", 512))
+EMAIL_CHUNK_OVERLAP = int(os.getenv("EMAIL_CHUNK_OVERLAP", 64))
+# Body text indexed per email, so one huge message can't bloat the index
+EMAIL_MAX_BODY_CHARS = int(os.getenv("EMAIL_MAX_BODY_CHARS", 50000))
+
+# Index whole Gmail threads (quoted history and signatures stripped) instead of single messages
+INGEST_THREADS = os.getenv("INGEST_THREADS", "false").lower() in ("1", "true", "yes")
+# Threads read back from the message store and analyzed per step of a thread-mode fetch
+THREAD_BATCH_SIZE = 200
+# Syncs that retry a message which failed to fetch or analyze before it is given up on
+SYNC_RETRY_ATTEMPTS = 5
+
+# Document metadata every chunk inherits (and retrieval filters on) but that would only add noise
+# to its embedding or prompt text; the analysis, raw subject and fetch time are in the text alone.
+# Nothing positional is stored: ranks come from the DateIndex, so documents never change once built
+EXCLUDED_LLM_METADATA = ["email_id", "internal_date", "message_ids", "message_count", "raw_bytes", "delta_bytes"]
+EXCLUDED_EMBED_METADATA = EXCLUDED_LLM_METADATA
+
+# Standing instructions, sent once per prompt; per-turn hints are added by GmailChatbot._engine_prompt
+CHAT_SYSTEM_PROMPT = """You are a friendly, helpful assistant for the user's Gmail inbox. Be warm, conversational and professional, address the user directly, avoid technical jargon and use emojis sparingly.
+
+Each email shows the date it was received: "recent" or "latest" means the newest dates, "old" or "first" the oldest.
+
+When answering:
+- Start with a friendly acknowledgment and end by offering more help
+- Organize information clearly, with bullet points or numbered lists where useful, and highlight what matters
+- Show email subjects human-readable, decoding encoded ones like "=?UTF-8?Q?...?="
+- Add helpful context and suggest follow-up actions such as drafting replies or summarizing action items
+- Use the conversation so far to understand references like "this email"
+
+When asked to write a reply or draft a response, always give actual draft content: a greeting, the main message and a professional closing, matching the tone of the original email. For LinkedIn invitations suggest accepting with a brief professional message, for job emails show interest and next steps, and for notifications acknowledge them and ask for clarification if needed."""
+
+CHAT_CONTEXT_PROMPT = """Relevant emails:
+{context_str}
+
+Answer from these emails and the conversation; if they don't contain the answer, say so.
+
+"""
+
+CHAT_CONTEXT_REFINE_PROMPT = """More relevant emails:
+{context_msg}
+
+Existing answer:
+{existing_answer}
+
+Refine the existing answer with these emails, or repeat it unchanged if they don't help.
+
+"""
+
 def decode_email_subject(subject):
     """Decode email subject from encoded format to readable text"""
     if not subject:
@@ -57,11 +161,16 @@ class GeminiLLMWrapper(CustomLLM):
     
     context_window: int = 4096
     num_output: int = 256
-    model_name: str = "gemini-1.5-flash"
+    model_name: str = "gemini-2.0-flash"
     
-    def __init__(self):
-        super().__init__()
-        self._llm = get_llm()
+    def __init__(self, llm=None):
+        llm = llm or get_llm()
+        # Report the model's real limits, so LlamaIndex doesn't split context meant for one call
+        budget = PromptBudget(getattr(llm, "model", None) or os.getenv("MODEL_NAME", "gemini-2.0-flash"))
+        super().__init__(
+            context_window=budget.context_window, num_output=budget.num_output, model_name=budget.model_name
+        )
+        self._llm = llm
     
     @property
     def metadata(self) -> LLMMetadata:
@@ -78,122 +187,633 @@ class GeminiLLMWrapper(CustomLLM):
         return CompletionResponse(text=text)
     
     @llm_completion_callback()
-    def stream_complete(self, prompt: str, **kwargs):
-        # For streaming, we'll just return the complete response
-        response = self.complete(prompt, **kwargs)
-        yield response
-
-class SimpleEmbedding(BaseEmbedding):
-    """Simple embedding class for demonstration"""
-    
-    def __init__(self):
-        super().__init__()
-    
-    def _get_embedding(self, text: str) -> List[float]:
-        # Simple hash-based embedding for demo purposes
-        # In production, you'd use proper embeddings like OpenAI or Hugging Face
-        embedding_dim = 384  # Standard embedding dimension
-        text_hash = hash(text)
-        return [float((text_hash + i) % 1000) / 1000 for i in range(embedding_dim)]
+    def stream_complete(self, prompt: str, **kwargs) -> CompletionResponseGen:
+        # Chunks are passed on as the model produces them
+        def gen() -> CompletionResponseGen:
+            text = ""
+            for chunk in self._llm.stream(prompt):
+                delta = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if not delta:
+                    continue
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+        
+        return gen()
     
-    def _get_text_embedding(self, text: str) -> List[float]:
-        return self._get_embedding(text)
+    # CustomLLM's async methods just call the sync ones and block the event loop;
+    # these await the LangChain model's own async API instead
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs) -> CompletionResponse:
+        response = await self._llm.ainvoke(prompt)
+        text = response.content if hasattr(response, 'content') else str(response)
+        return CompletionResponse(text=text)
     
-    def _get_query_embedding(self, query: str) -> List[float]:
-        return self._get_embedding(query)
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            text = ""
+            async for chunk in self._llm.astream(prompt):
+                delta = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if not delta:
+                    continue
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+        
+        return gen()
     
-    async def _aget_text_embedding(self, text: str) -> List[float]:
-        return self._get_text_embedding(text)
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs) -> ChatResponse:
+        prompt = self.messages_to_prompt(messages)
+        return completion_response_to_chat_response(await self.acomplete(prompt, formatted=True, **kwargs))
     
-    async def _aget_query_embedding(self, query: str) -> List[float]:
-        return self._get_query_embedding(query)
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs) -> ChatResponseAsyncGen:
+        prompt = self.messages_to_prompt(messages)
+        return astream_completion_response_to_chat_response(
+            await self.astream_complete(prompt, formatted=True, **kwargs)
+        )
 
 class GmailChatbot:
-    def __init__(self):
-        self.llm_wrapper = GeminiLLMWrapper()
-        self.embedding = SimpleEmbedding()
+    def __init__(self, service_factory=None, llm_factory=None, data_dir: Optional[str] = None,
+                 thread_mode: Optional[bool] = None, shared: Optional["GmailChatbot"] = None):
+        # Both factories are swappable so offline stand-ins can replace Gmail and Gemini
+        self.service_factory = service_factory or get_gmail_service
+        self.llm_factory = llm_factory or get_llm
+        # One document per Gmail thread instead of per message (INGEST_THREADS)
+        self.thread_mode = INGEST_THREADS if thread_mode is None else thread_mode
+        
+        # One limiter shared by ingestion and chat so together they stay under the API quota;
+        # a snapshot built in the background (see new_snapshot) also shares it with the one serving chats
+        self.rate_limiter = shared.rate_limiter if shared else RateLimiter()
+        self.llm_wrapper = GeminiLLMWrapper(self._limited_llm())
+        self.embedding = HashingEmbedding()
         
         # Configure LlamaIndex settings
         Settings.llm = self.llm_wrapper
         Settings.embed_model = self.embedding
+        # Chunks carry a SOURCE link to their email and PREVIOUS/NEXT links to their neighbours
+        Settings.node_parser = SentenceSplitter(chunk_size=EMAIL_CHUNK_SIZE, chunk_overlap=EMAIL_CHUNK_OVERLAP)
         
-        self.documents = []
+        # One EmailRecord per indexed email (or thread), in date_index order; bodies stay in the message store
+        self.documents: List[EmailRecord] = []
+        # Recency ranks and totals, computed when a question needs them
+        self.date_index = DateIndex()
+        # Category/priority counts and postings, kept in step with self.documents
+        self.facets = FacetIndex()
+        # One-line summary per email for paged listings, also kept in step with self.documents
+        self.summaries = SummaryIndex()
         self.index = None
+        self.retriever = None
         self.chat_engine = None
+        self.chat_memory = None
+        # Engines for achat(conversation_id=...), each with its own memory, created on first use
+        self.conversations: Dict[str, Tuple[CondensePlusContextChatEngine, ChatMemoryBuffer]] = {}
+        # Filters and offset of the overview page each conversation (None: chat()) saw last, for "next page"
+        self.summary_cursors: Dict[Optional[str], Tuple[dict, int]] = {}
+        # Per-turn prompt size limits and log
+        self.prompt_budget = PromptBudget(
+            self.llm_wrapper.model_name, self.llm_wrapper.context_window, self.llm_wrapper.num_output
+        )
+        # Bumped whenever the document set changes; part of every response cache key
+        self.documents_version = 0
+        # Answers to repeated questions (LRU + TTL, see CHAT_CACHE_*)
+        self.response_cache = ResponseCache()
         self.gmail_service = None
         
-    def fetch_and_process_emails(self, max_emails: int = 20):
-        """Fetch emails and create documents for indexing"""
+        self.data_dir = data_dir or DATA_DIR
+        os.makedirs(self.data_dir, exist_ok=True)
+        # Every fetched message is kept on disk, so it is never downloaded twice
+        self.message_store = shared.message_store if shared else MessageStore(os.path.join(self.data_dir, "messages.sqlite3"))
+        # Unchanged emails are never re-analyzed, even after a restart
+        self.analysis_cache = (shared.analysis_cache if shared else
+                               AnalysisCache(os.path.join(self.data_dir, "analysis_cache.sqlite3")))
+        # Emails per analysis prompt; above 1, results come back as structured JSON
+        self.analysis_batch_size = ANALYSIS_BATCH_SIZE
+        # Concurrent analysis calls (LLM_MAX_CONCURRENCY)
+        self.analysis_workers = LLM_MAX_CONCURRENCY
+        
+        # Docstore + vector store, saved after every build or sync
+        self.index_dir = os.path.join(self.data_dir, "index")
+        # BM25 over subjects, senders and full bodies, saved alongside the vector index
+        self.keyword_index = KeywordIndex.load(os.path.join(self.index_dir, KEYWORD_INDEX_FILE))
+        
+        # Gmail historyId of the last full fetch or sync, kept across runs
+        self.sync_state_path = os.path.join(self.data_dir, "sync_state.json")
+        sync_state = self._load_sync_state()
+        self.history_id = sync_state.get("history_id")
+        # How many of the newest emails the last listing covered (None: the whole mailbox);
+        # a sync asking for more lists the mailbox again to backfill older mail
+        self.listed = sync_state.get("listed", 0)
+        # Messages that failed to fetch or analyze, with their attempts so far; the historyId has moved
+        # past them, so every sync retries them until SYNC_RETRY_ATTEMPTS
+        self.retry_ids: Dict[str, int] = sync_state.get("retry_ids", {})
+        
+    def fetch_and_process_emails(self, max_emails: Optional[int] = 20, batch_size: Optional[int] = None,
+                                 max_workers: Optional[int] = None, query: Optional[str] = None,
+                                 label_ids: Optional[List[str]] = None, after: Any = None, before: Any = None):
+        """Fetch emails and create documents for indexing
+
+        Messages are listed page by page (following nextPageToken) and each
+        page is fetched and analyzed as it arrives, so ``max_emails=None``
+        walks the whole mailbox without holding every id or body in memory.
+        ``query``, ``label_ids``, ``after`` and ``before`` narrow the listing.
+        Message bodies are downloaded in Gmail batch requests of ``batch_size``
+        calls with up to ``max_workers`` batches in flight (defaults come from
+        FETCH_BATCH_SIZE / FETCH_WORKERS).
+        """
         print("🔄 Fetching emails...")
         
         try:
-            self.gmail_service = get_gmail_service()
-            llm = get_llm()
+            self.gmail_service = self.service_factory()
+            llm = self._limited_llm()
+            # Read before listing so nothing that arrives mid-fetch is missed by the next sync
+            history_id = get_history_id(self.gmail_service)
             
-            # Get recent emails
-            results = self.gmail_service.users().messages().list(
-                userId="me", 
-                maxResults=max_emails
-            ).execute()
-            messages = results.get("messages", [])
+            pages = iter_message_pages(
+                self.gmail_service,
+                max_results=max_emails,
+                query=query,
+                label_ids=label_ids,
+                after=after,
+                before=before,
+            )
+            
+            # Only compact records are kept between pages; bodies are read back from the store to index
+            processed = []
+            thread_ids = {}
+            failed = []
+            total = 0
+            for page in pages:
+                print(f"📧 Processing {len(page)} emails...")
+                msg_ids = [msg["id"] for msg in page]
+                if self.thread_mode:
+                    # Threads span pages, so only ids are kept until the listing is done
+                    records, errors = self._fetch_records(msg_ids, batch_size, max_workers)
+                    thread_ids.update((record["thread_id"], True) for record in records.values())
+                    failed.extend(errors)
+                else:
+                    records = self._process_messages(llm, msg_ids, total, batch_size, max_workers)
+                    done = {record.doc_id for record in records}
+                    failed.extend(email_id for email_id in msg_ids if email_id not in done)
+                    processed.extend(records)
+                total += len(page)
             
-            print(f"📧 Processing {len(messages)} emails...")
+            if self.thread_mode:
+                self.documents.extend(self._thread_records(llm, list(thread_ids), failed))
+            self.documents.extend(processed)
+            self._sort_documents()
+            
+            self.facets = FacetIndex.from_documents(self.documents)
+            self.summaries = SummaryIndex.from_documents(self.documents)
+            self._documents_changed()
+            self._save_sync_state(history_id, max_emails, self._next_retries(failed))
+            print(f"✅ Successfully processed {len(self.documents)} emails")
+            
+        except Exception as e:
+            print(f"❌ Error fetching emails: {str(e)}")
+            return False
             
-            for i, msg in enumerate(messages):
-                try:
-                    subject, body = get_email_content(self.gmail_service, msg["id"])
-                    # Decode the subject to make it readable
-                    clean_subject = decode_email_subject(subject)
-                    analysis = analyze_with_gemini(llm, clean_subject, body)
-                    
-                    # Create document with email content and analysis
-                    doc_text = f"""
-Email #{i+1} of {len(messages)}
-Subject: {clean_subject}
-Email ID: {msg["id"]}
+        return True
+    
+    def _process_messages(self, llm, msg_ids: List[str], first_position: int = 0,
+                          batch_size: Optional[int] = None, max_workers: Optional[int] = None) -> list:
+        """Fetch, decode and analyze messages, returning an EmailRecord per email
 
-Email Content:
-{body[:1000]}...
+        Messages already in the local store are not downloaded again, and
+        analyses come from the analysis cache when the content is unchanged.
+        Uncached emails are analyzed ``analysis_batch_size`` per LLM call, with
+        up to ``analysis_workers`` calls in flight. ``first_position`` only
+        numbers the progress output. Failed emails are skipped.
+        """
+        records, errors = self._fetch_records(msg_ids, batch_size, max_workers)
+        
+        fetched_ids = [email_id for email_id in msg_ids if email_id in records]
+        analyses = dict(zip(fetched_ids, analyze_emails_batched(
+            llm,
+            [(email_id, records[email_id]["subject"], records[email_id]["body"]) for email_id in fetched_ids],
+            self.analysis_cache,
+            self.analysis_batch_size,
+            max_workers=self.analysis_workers,
+        )))
+        
+        processed = []
+        for i, email_id in enumerate(msg_ids, first_position):
+            try:
+                if email_id in errors:
+                    raise errors[email_id]
+                record = records[email_id]
+                analysis = analyses[email_id]
+                if isinstance(analysis, Exception):
+                    raise analysis
+                if analysis != record.get("analysis"):
+                    self.message_store.set_analysis(email_id, analysis)
+                
+                self._index_keywords(record)
+                processed.append(self._make_record(record, analysis))
+                print(f"✅ Processed email {i+1}: {record['subject'][:50]}...")
+                
+            except Exception as e:
+                print(f"⚠️ Error processing email {i+1}: {str(e)}")
+                continue
+        
+        return processed
+    
+    def _fetch_records(self, msg_ids: List[str], batch_size: Optional[int] = None,
+                       max_workers: Optional[int] = None) -> Tuple[dict, dict]:
+        """Stored or freshly downloaded records for ``msg_ids``, plus the errors of those that failed"""
+        records = self.message_store.get_many(msg_ids)
+        missing = [email_id for email_id in msg_ids if email_id not in records]
+        
+        errors = {}
+        if missing:
+            contents = fetch_email_contents(
+                self.gmail_service,
+                missing,
+                batch_size=batch_size,
+                max_workers=max_workers,
+                service_factory=self.service_factory,
+                parse=parse_message_record,
+            )
+            fetched = []
+            for email_id, content in zip(missing, contents):
+                if isinstance(content, Exception):
+                    errors[email_id] = content
+                    continue
+                # Decode the subject to make it readable
+                content["subject"] = decode_email_subject(content["raw_subject"])
+                content["fetched_at"] = time.time()
+                records[email_id] = content
+                fetched.append(content)
+            self.message_store.put_many(fetched)
+        return records, errors
+    
+    def _thread_records(self, llm, thread_ids: List[str], failed: Optional[List[str]] = None) -> List[EmailRecord]:
+        """One record per thread, built from every stored message of it, most recently active first
+
+        Each thread is analyzed as a whole, once per change: unchanged
+        threads hit the analysis cache. Records keep the thread's message
+        ids and how many body bytes stripping quoted history and signatures
+        saved. The message ids of threads that fail are appended to ``failed``.
+        """
+        threads = []
+        for start in range(0, len(thread_ids), THREAD_BATCH_SIZE):
+            threads.extend(build_threads(self.message_store.get_threads(thread_ids[start:start + THREAD_BATCH_SIZE])))
+        threads.sort(key=lambda thread: thread["internal_date"], reverse=True)
+        
+        analyses = analyze_emails_batched(
+            llm,
+            [(thread["email_id"], thread["subject"], thread["body"]) for thread in threads],
+            self.analysis_cache,
+            self.analysis_batch_size,
+            max_workers=self.analysis_workers,
+        )
+        
+        records = []
+        for thread, analysis in zip(threads, analyses):
+            if isinstance(analysis, Exception):
+                print(f"⚠️ Error processing thread {thread['subject'][:50]}: {str(analysis)}")
+                if failed is not None:
+                    failed.extend(thread["message_ids"])
+                continue
+            self._index_keywords(thread, replace=True)
+            record = self._make_record(thread, analysis)
+            record.message_ids = thread["message_ids"]
+            record.raw_bytes = thread["raw_bytes"]
+            record.delta_bytes = thread["delta_bytes"]
+            records.append(record)
+        
+        stats = thread_report(threads)
+        if threads:
+            print(f"🧵 {stats['messages']} messages in {stats['threads']} threads: indexed "
+                  f"{stats['indexed_bytes'] / 1024:.0f} KB of {stats['raw_bytes'] / 1024:.0f} KB "
+                  f"({stats['saved_pct']:.0%} quoted text and signatures skipped)")
+        return records
+    
+    def new_snapshot(self) -> "GmailChatbot":
+        """An empty chatbot over the same data directory, to be loaded and indexed while this one serves chats
+        
+        It shares the rate limiter, message store and analysis cache; its
+        documents, index and engines are its own until it replaces this one.
+        """
+        return GmailChatbot(self.service_factory, self.llm_factory, self.data_dir, self.thread_mode, shared=self)
+    
+    def adopt_conversations(self, previous: "GmailChatbot"):
+        """Continue ``previous``'s conversations (chat() memory and every achat() conversation) on this index"""
+        if not self.chat_engine or not previous.chat_memory:
+            return
+        self.chat_memory.set(previous.chat_memory.get_all())
+        for conversation_id, (_, memory) in list(previous.conversations.items()):
+            engine, new_memory = self._new_chat_engine()
+            new_memory.set(memory.get_all())
+            self.conversations[conversation_id] = (engine, new_memory)
+    
+    def _limited_llm(self):
+        """A fresh model client that honours the shared rate limits and retries 429/5xx errors"""
+        return RateLimitedLLM(self.llm_factory(), self.rate_limiter)
+    
+    def load_from_store(self, max_emails: Optional[int] = 20) -> bool:
+        """Rebuild the document set from the local message store without any network calls"""
+        # Thread mode analyzes whole threads, so its messages have no analysis of their own
+        records = self.message_store.recent(max_emails, analyzed_only=not self.thread_mode)
+        if not records:
+            return False
+        
+        total = len(records)
+        if self.thread_mode:
+            # Thread analyses come from the analysis cache unless a thread changed
+            self.documents = self._thread_records(self._limited_llm(), list(dict.fromkeys(
+                record["thread_id"] for record in records
+            )))
+        else:
+            for record in records:
+                self._index_keywords(record)
+            self.documents = [self._make_record(record, record["analysis"]) for record in records]
+        self._sort_documents()
+        self.facets = FacetIndex.from_documents(self.documents)
+        self.summaries = SummaryIndex.from_documents(self.documents)
+        self.index = None
+        self._documents_changed()
+        print(f"💾 Loaded {total} emails from local store"
+              + (f" ({len(self.documents)} threads)" if self.thread_mode else ""))
+        return True
+    
+    def _index_keywords(self, record: dict, replace: bool = False):
+        """Add an email to the keyword index; messages never change, so known ids are skipped unless ``replace``"""
+        if replace or record["email_id"] not in self.keyword_index:
+            sender = sender_of(record)
+            # The address is indexed whole and split up, so "acme" and "billing@acme.com" both match
+            sender_words = re.sub(r"[@.<>\"]", " ", sender)
+            self.keyword_index.add(record["email_id"], f"{record['subject']}\n{sender} {sender_words}\n{record['body']}")
+    
+    @staticmethod
+    def _make_record(record: dict, analysis: str) -> EmailRecord:
+        """The compact in-memory record of a stored message or thread record; the body is left behind"""
+        sender = sender_of(record)
+        facets = parse_analysis(analysis)  # typed "category" and "priority"
+        return EmailRecord(
+            email_id=record["email_id"],
+            subject=record["subject"],
+            sender=sender,
+            internal_date=record.get("internal_date", 0),
+            fetched_at=record["fetched_at"],
+            analysis=analysis,
+            category=facets["category"],
+            priority=facets["priority"],
+        )
+    
+    def _load_bodies(self, records: List[EmailRecord]) -> Dict[str, str]:
+        """Bodies of ``records`` read back from the message store (thread bodies are rebuilt from their messages)"""
+        email_ids = [record.email_id for record in records]
+        if not self.thread_mode:
+            return {email_id: stored["body"] for email_id, stored in self.message_store.get_many(email_ids).items()}
+        bodies = {}
+        for start in range(0, len(email_ids), THREAD_BATCH_SIZE):
+            for thread in build_threads(self.message_store.get_threads(email_ids[start:start + THREAD_BATCH_SIZE])):
+                bodies[thread["email_id"]] = thread["body"]
+        return bodies
+    
+    def _to_documents(self, records: List[EmailRecord]) -> List[Document]:
+        """Indexable Documents for ``records``, with their bodies loaded from disk"""
+        bodies = self._load_bodies(records)
+        return [self._make_document(record, bodies.get(record.email_id, "")) for record in records]
+    
+    def _make_document(self, record: EmailRecord, body: str) -> Document:
+        """Create the indexable document for one email
+
+        The processed time is the message's fetch time, so rebuilding an
+        unchanged email yields an identical document (and document hash).
+        The body is included up to EMAIL_MAX_BODY_CHARS; the node parser
+        splits it into chunks, and the analysis comes first so it shares a
+        chunk with the headers. Nothing in it depends on the other emails, so
+        a document never has to be re-embedded because mail arrived. Document
+        metadata holds only what retrieval filters on; the analysis lives in
+        the text.
+        """
+        processed = datetime.fromtimestamp(record.fetched_at)
+        omitted = len(body) - EMAIL_MAX_BODY_CHARS
+        if omitted > 0:
+            body = body[:EMAIL_MAX_BODY_CHARS] + f"\n[... {omitted} more characters not indexed]"
+        doc_text = f"""
+Subject: {record.subject}
+From: {record.sender}
+Date: {record.email_date}
+Email ID: {record.email_id}
+Processed: {processed.strftime('%Y-%m-%d %H:%M:%S')}
 
 AI Analysis:
-{analysis}
+{record.analysis}
 
-Processed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-Email Position: {i+1} out of {len(messages)} (1 = most recent, {len(messages)} = oldest)
+Email Content:
+{body}
 """
-                    
-                    document = Document(
-                        text=doc_text,
-                        metadata={
-                            "subject": clean_subject,
-                            "raw_subject": subject,  # Keep original for reference
-                            "email_id": msg["id"],
-                            "analysis": analysis,
-                            "processed_date": datetime.now().isoformat(),
-                            "email_position": i+1,
-                            "total_emails": len(messages),
-                            "is_most_recent": i == 0,
-                            "is_oldest": i == len(messages) - 1
-                        }
-                    )
-                    
-                    self.documents.append(document)
-                    print(f"✅ Processed email {i+1}/{len(messages)}: {clean_subject[:50]}...")
-                    
-                except Exception as e:
-                    print(f"⚠️ Error processing email {i+1}: {str(e)}")
-                    continue
+        metadata = record.metadata
+        del metadata["analysis"]
+        return Document(
+            id_=record.email_id,
+            text=doc_text,
+            metadata=metadata,
+            excluded_llm_metadata_keys=EXCLUDED_LLM_METADATA,
+            excluded_embed_metadata_keys=EXCLUDED_EMBED_METADATA,
+        )
+    
+    def sync_emails(self, max_emails: Optional[int] = 20, batch_size: Optional[int] = None,
+                    max_workers: Optional[int] = None, label_id: Optional[str] = None):
+        """Incrementally update documents (and the index) from Gmail history
+
+        Only messages added since the stored historyId are fetched and
+        analyzed; deleted ones are dropped. When ``max_emails`` is larger than
+        what was listed before, or deletions would leave fewer, the newest
+        ``max_emails`` are listed again and the older emails missing from the
+        document set are added. Messages
+        that fail to fetch or analyze are retried on the next syncs. Falls back to a full
+        fetch_and_process_emails when nothing is loaded yet or the history
+        window has expired. ``max_emails`` caps how many of the newest emails
+        are kept.
+        """
+        if not self.documents and self.history_id:
+            # Fresh process: start from what is on disk, then catch up through history
+            self.load_from_store(max_emails)
+        
+        if not self.documents or not self.history_id:
+            self.documents = []
+            self.index = None
+            return self.fetch_and_process_emails(max_emails, batch_size, max_workers,
+                                                 label_ids=[label_id] if label_id else None)
+        
+        print("🔄 Syncing emails...")
+        
+        try:
+            self.gmail_service = self.service_factory()
+            try:
+                added_ids, deleted_ids, history_id = list_history_changes(
+                    self.gmail_service, self.history_id, label_id
+                )
+            except Exception as e:
+                print(f"⚠️ Incremental sync unavailable ({str(e)}), reloading all emails...")
+                self.history_id = None
+                return self.sync_emails(max_emails, batch_size, max_workers, label_id)
             
-            print(f"✅ Successfully processed {len(self.documents)} emails")
+            known_ids = {doc.doc_id for doc in self.documents}
+            known_messages = self._known_message_ids()
+            added_ids = [email_id for email_id in added_ids if email_id not in known_messages]
+            if max_emails is not None:
+                added_ids = added_ids[:max_emails]
+            # Messages a previous sync failed on, unless they have been deleted since
+            added_ids += [email_id for email_id in self.retry_ids
+                          if email_id not in known_messages and email_id not in deleted_ids and email_id not in added_ids]
+            
+            # More emails wanted than the last listing covered, or deletions about to shrink the set below
+            # max_emails: list the newest max_emails again and add the missing ones (stored messages are
+            # read back, not downloaded, and their analyses are cached)
+            backfill = self._needs_backfill(max_emails) or (
+                max_emails is not None and not known_messages.isdisjoint(deleted_ids)
+            )
+            if backfill:
+                seen = known_messages.union(added_ids)
+                backfill_ids = [
+                    msg["id"]
+                    for page in iter_message_pages(self.gmail_service, max_results=max_emails,
+                                                   label_ids=[label_id] if label_id else None)
+                    for msg in page if msg["id"] not in seen
+                ]
+                if backfill_ids:
+                    print(f"📥 Backfilling {len(backfill_ids)} older emails...")
+                added_ids += backfill_ids
+            
+            # New emails, or in thread mode every thread with a new or deleted message, rebuilt whole
+            new_records = []
+            failed = []
+            if self.thread_mode:
+                records, errors = self._fetch_records(added_ids, batch_size, max_workers)
+                failed.extend(errors)
+                deleted = self.message_store.get_many(deleted_ids)
+                thread_ids = list(dict.fromkeys(
+                    record["thread_id"] for record in list(records.values()) + list(deleted.values())
+                ))
+                self.message_store.delete_many(deleted_ids)
+                if thread_ids:
+                    print(f"📧 Processing {len(thread_ids)} updated threads...")
+                    new_records = self._thread_records(self._limited_llm(), thread_ids, failed)
+                # Only threads with no stored message left are gone; one whose re-analysis failed keeps its
+                # previous record until the retry succeeds
+                stored = {record.get("thread_id") or record["email_id"] for record in self.message_store.get_threads(thread_ids)}
+                gone_ids = set(thread_ids) - stored
+            else:
+                if added_ids:
+                    print(f"📧 Processing {len(added_ids)} new emails...")
+                    new_records = self._process_messages(self._limited_llm(), added_ids, 0, batch_size, max_workers)
+                done = {record.doc_id for record in new_records}
+                failed.extend(email_id for email_id in added_ids if email_id not in done)
+                self.message_store.delete_many(deleted_ids)
+                gone_ids = deleted_ids
+            
+            new_ids = {record.doc_id for record in new_records}
+            kept = [doc for doc in self.documents if doc.doc_id not in gone_ids and doc.doc_id not in new_ids]
+            self.documents = new_records + kept
+            self.documents.sort(key=lambda record: date_key(record.email_id, record.internal_date))
+            if max_emails is not None:
+                del self.documents[max_emails:]
+            current_ids = {doc.doc_id for doc in self.documents}
+            removed_ids = known_ids - current_ids
+            
+            for email_id in removed_ids:
+                self.date_index.remove(email_id)
+                self.facets.remove(email_id)
+            for record in new_records:
+                if record.doc_id in current_ids:
+                    self.date_index.add(record.doc_id, record.internal_date)
+                    self.facets.add(record.doc_id, record.metadata)
+                    self.summaries.add(record.doc_id, record.metadata)
+            self.keyword_index.retain(doc.doc_id for doc in self.documents)
+            self.summaries.set_order(doc.doc_id for doc in self.documents)
+            if new_records or removed_ids:
+                self._documents_changed()
+            
+            if self.index is not None:
+                for email_id in removed_ids:
+                    self.index.delete_ref_doc(email_id, delete_from_docstore=True)
+                # Other documents carry no position, so they stay as they are
+                for document in self._to_documents([r for r in new_records if r.doc_id in current_ids]):
+                    if document.doc_id in known_ids:
+                        self.index.update_ref_doc(document)
+                    else:
+                        self.index.insert(document)
+                self._persist_index()
+            
+            # Truncating to a smaller max_emails also shrinks what is covered
+            listed = max_emails if backfill or self.listed is None else (
+                self.listed if max_emails is None else min(self.listed, max_emails)
+            )
+            self._save_sync_state(history_id, listed, self._next_retries(failed))
+            print(f"✅ Sync complete: {len(new_records)} added or updated, {len(removed_ids)} removed, "
+                  f"{len(self.documents)} emails total")
             
         except Exception as e:
-            print(f"❌ Error fetching emails: {str(e)}")
+            print(f"❌ Error syncing emails: {str(e)}")
             return False
-            
+        
         return True
     
+    def _known_message_ids(self) -> set:
+        """Gmail message ids behind the current documents (several per document in thread mode)"""
+        if not self.thread_mode:
+            return {doc.doc_id for doc in self.documents}
+        return {email_id for record in self.documents for email_id in record.message_ids or [record.email_id]}
+    
+    def _sort_documents(self):
+        """Order the records newest first and rebuild the date index they are ranked by"""
+        self.documents.sort(key=lambda record: date_key(record.email_id, record.internal_date))
+        # Rebuilt in place: the retriever holds on to this index
+        self.date_index.rebuild(self.documents)
+    
+    def _documents_changed(self):
+        """Invalidate cached answers after the document set changed"""
+        self.documents_version += 1
+        self.response_cache.clear()
+    
+    def _load_sync_state(self) -> dict:
+        try:
+            with open(self.sync_state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _needs_backfill(self, max_emails: Optional[int]) -> bool:
+        """Whether ``max_emails`` reaches past what the last listing covered"""
+        if self.listed is None:
+            return False
+        return max_emails is None or max_emails > self.listed
+    
+    def _next_retries(self, failed: List[str]) -> Dict[str, int]:
+        """Attempt counts for the messages to retry next sync, dropping those out of attempts"""
+        retries = {}
+        for email_id in dict.fromkeys(failed):
+            attempts = self.retry_ids.get(email_id, 0) + 1
+            if attempts < SYNC_RETRY_ATTEMPTS:
+                retries[email_id] = attempts
+            else:
+                print(f"⚠️ Giving up on email {email_id} after {attempts} failed attempts")
+        if retries:
+            print(f"⚠️ {len(retries)} emails failed and will be retried on the next sync")
+        return retries
+    
+    def _save_sync_state(self, history_id, listed: Optional[int], retry_ids: Dict[str, int]):
+        self.history_id = history_id
+        self.listed = listed
+        self.retry_ids = retry_ids
+        try:
+            with open(self.sync_state_path, "w") as f:
+                json.dump({"history_id": history_id, "listed": listed, "retry_ids": retry_ids}, f)
+        except OSError as e:
+            print(f"⚠️ Could not save sync state: {str(e)}")
+    
     def build_index(self):
-        """Build the vector index from documents"""
+        """Build the vector index from documents
+
+        A previously persisted index is loaded and reconciled instead of
+        rebuilt: only new or changed emails are embedded, and emails no
+        longer in the document set are deleted from it.
+        """
         if not self.documents:
             print("❌ No documents to index. Please fetch emails first.")
             return False
@@ -201,8 +821,22 @@ Email Position: {i+1} out of {len(messages)} (1 = most recent, {len(messages)} =
         print("🔄 Building knowledge index...")
         
         try:
-            # Create index from documents
-            self.index = VectorStoreIndex.from_documents(self.documents)
+            self.keyword_index.retain(doc.doc_id for doc in self.documents)
+            # Full Documents exist only while they are being indexed
+            documents = self._to_documents(self.documents)
+            self.index = self._load_persisted_index()
+            if self.index is None:
+                # Create index from documents
+                self.index = VectorStoreIndex.from_documents(documents)
+            else:
+                current_ids = {doc.doc_id for doc in self.documents}
+                for ref_doc_id in list(self.index.ref_doc_info):
+                    if ref_doc_id not in current_ids:
+                        self.index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+                refreshed = self.index.refresh_ref_docs(documents)
+                print(f"♻️ Reused saved index ({sum(refreshed)} of {len(self.documents)} emails re-embedded)")
+            
+            self._persist_index()
             print("✅ Index built successfully!")
             return True
             
@@ -210,6 +844,28 @@ Email Position: {i+1} out of {len(messages)} (1 = most recent, {len(messages)} =
             print(f"❌ Error building index: {str(e)}")
             return False
     
+    def _load_persisted_index(self) -> Optional[VectorStoreIndex]:
+        """Load the saved index, or None if there is none or it used another embedding model"""
+        meta = load_index_meta(self.index_dir)
+        if meta is None:
+            return None
+        if meta.get("embed_model") != self.embedding.model_name:
+            print("ℹ️ Saved index used a different embedding model, rebuilding...")
+            return None
+        
+        try:
+            return load_index(self.index_dir)
+        except Exception as e:
+            print(f"⚠️ Could not load saved index ({str(e)}), rebuilding...")
+            return None
+    
+    def _persist_index(self):
+        try:
+            persist_index(self.index, self.index_dir, {"embed_model": self.embedding.model_name})
+            self.keyword_index.persist(os.path.join(self.index_dir, KEYWORD_INDEX_FILE))
+        except OSError as e:
+            print(f"⚠️ Could not save index: {str(e)}")
+    
     def setup_chat_engine(self):
         """Setup the chat engine for Q&A"""
         if not self.index:
@@ -217,75 +873,17 @@ Email Position: {i+1} out of {len(messages)} (1 = most recent, {len(messages)} =
             return False
             
         try:
-            # Create chat engine with memory
-            memory = ChatMemoryBuffer.from_defaults(token_limit=3000)
-            
-            self.chat_engine = self.index.as_chat_engine(
-                chat_mode="best",  # Use best retrieval mode
-                memory=memory,
-                similarity_top_k=len(self.documents),  # Retrieve ALL documents
-                response_mode="tree_summarize",  # Better for multiple documents
-                system_prompt="""You are a friendly, helpful AI assistant that specializes in helping users understand and manage their Gmail emails. You should communicate in a warm, conversational, and professional manner.
-
-PERSONALITY & TONE:
-- Be friendly, warm, and conversational
-- Use natural language, not technical jargon
-- Show enthusiasm when helping
-- Be empathetic and understanding
-- Use emojis sparingly but appropriately
-- Address the user directly and personally
-
-EMAIL INFORMATION CONTEXT:
-- You have access to {} processed emails
-- Email #1 is the MOST RECENT email
-- Email #{} is the OLDEST email
-- When users ask about "recent" or "latest" emails, refer to lower-numbered emails (Email #1, #2, etc.)
-- When users ask about "old" or "first" emails, refer to higher-numbered emails
-
-RESPONSE GUIDELINES:
-1. Always start with a friendly greeting or acknowledgment
-2. Present information in a clear, organized way
-3. Use bullet points or numbered lists when appropriate
-4. Decode and clean up any encoded email subjects to show proper, readable titles
-5. Provide helpful context and insights
-6. When showing email subjects, make them human-readable
-7. Suggest follow-up actions when relevant
-8. End responses helpfully, asking if they need more information
-9. When users ask to "write a reply" or "draft a response", provide actual helpful draft content
-10. Use context from previous conversation to understand what "this email" refers to
-11. Be proactive in offering practical help like drafting replies, summarizing action items, etc.
-12. If asked about writing replies, always provide a sample response based on the email content
-
-FORMATTING RULES:
-- Clean up encoded subjects like "=?UTF-8?Q?..." to show the actual readable title
-- Present email information in an easy-to-read format
-- Use proper spacing and organization
-- Highlight important information clearly
-
-EXAMPLE GOOD RESPONSES:
-- "I'd be happy to help you with that! Your most recent email is..."
-- "Looking at your emails, I can see that..."
-- "Great question! Here's what I found in your inbox..."
-- "I've analyzed your emails and here's a summary..."
-
-SPECIAL INSTRUCTIONS FOR REPLY WRITING:
-When users ask to "write a reply" or "draft a response":
-1. ALWAYS provide actual draft content - never say you can't do it
-2. Use the email content and context to create a relevant response
-3. Include proper greeting, main message, and professional closing
-4. Match the tone of the original email (professional, casual, etc.)
-5. For LinkedIn invitations: suggest accepting and a brief professional message
-6. For job emails: provide professional interest and next steps
-7. For notifications: acknowledge and ask for clarification if needed
-
-EXAMPLE REPLY RESPONSES:
-- "I'd be happy to help you draft a reply! Here's a suggested response: [actual draft content]"
-- "Based on this LinkedIn invitation, here's a professional response you could send: [draft]"
-- "For this job opportunity, here's a response that shows your interest: [draft]"
-
-Remember: Be helpful, friendly, and make the user feel like they're talking to a knowledgeable friend who cares about helping them manage their email effectively. Always provide practical, actionable help!
-""".format(len(self.documents), len(self.documents))
+            # Only the best vector + keyword matches (after date/sender/category/position filters) reach the LLM,
+            # capped at CHAT_TOP_K (CHAT_WIDE_TOP_K for whole-mailbox questions) and whatever the prompt
+            # budget leaves after the instructions, chat memory and question (at most CHAT_CONTEXT_TOKENS)
+            token_budget = self.prompt_budget.context_budget(
+                CHAT_SYSTEM_PROMPT, CHAT_CONTEXT_PROMPT,
+                reserved=CHAT_MEMORY_TOKENS + QUERY_RESERVE_TOKENS, cap=CHAT_CONTEXT_TOKENS,
             )
+            self.retriever = EmailRetriever(self.index, self.embedding, self.keyword_index, token_budget=token_budget,
+                                            date_index=self.date_index)
+            self.conversations = {}
+            self.chat_engine, self.chat_memory = self._new_chat_engine()
             
             print("✅ Chat engine ready!")
             return True
@@ -294,50 +892,269 @@ Remember: Be helpful, friendly, and make the user feel like they're talking to a
             print(f"❌ Error setting up chat engine: {str(e)}")
             return False
     
+    def _new_chat_engine(self) -> Tuple[CondensePlusContextChatEngine, ChatMemoryBuffer]:
+        """A chat engine over the shared retriever, with its own conversation memory"""
+        memory = ChatMemoryBuffer.from_defaults(token_limit=CHAT_MEMORY_TOKENS)
+        engine = CondensePlusContextChatEngine.from_defaults(
+            retriever=self.retriever,
+            memory=memory,
+            system_prompt=CHAT_SYSTEM_PROMPT,
+            context_prompt=CHAT_CONTEXT_PROMPT,
+            context_refine_prompt=CHAT_CONTEXT_REFINE_PROMPT,
+        )
+        return engine, memory
+    
     def chat(self, query: str) -> str:
-        """Chat with the assistant about emails"""
+        """Chat with the assistant about emails
+
+        The all-emails summary and chat engine answers are cached by
+        normalized query and document-set version; answers to follow-up
+        questions ("reply to it", "what about that one") also key on the
+        conversation so far.
+        """
         if not self.chat_engine:
             return "❌ Chat engine not initialized. Please run setup first."
         
-        # Handle special queries that need comprehensive data
-        query_lower = query.lower()
-        if any(phrase in query_lower for phrase in ["all emails", "summarize emails", "show me all", "complete summary", "all subjects"]):
-            return self.get_all_emails_summary()
+        answer = self._direct_answer(query)
+        if answer is not None:
+            return answer
         
         try:
-            # Add friendly context about email ordering and total count
-            context_info = f"""
-IMPORTANT CONTEXT FOR FRIENDLY RESPONSE:
-- User has {len(self.documents)} emails total
-- Email #1 is the MOST RECENT (newest)
-- Email #{len(self.documents)} is the OLDEST
-- Remember to be friendly, conversational, and helpful
-- Always decode and clean up any encoded subjects
-- Use natural, warm language in your response
-- If user asks to write a reply or response, provide actual helpful draft content
-- Use context from the conversation to understand references like "this email"
-
-USER QUERY: """
+            full_query, key = self._engine_prompt(query)
+            response = self._cached_turn(full_query, key)
+            if response is not None:
+                return response
             
-            # Handle specific chronological queries with clear guidance
-            if any(phrase in query_lower for phrase in ["last email", "most recent", "latest email", "newest email"]):
-                context_info += "The user wants information about the MOST RECENT email (Email #1). Be warm and helpful in your response. "
-            elif any(phrase in query_lower for phrase in ["first email", "oldest email", "earliest email"]):
-                context_info += f"The user wants information about the OLDEST email (Email #{len(self.documents)}). Be friendly and informative. "
-            elif any(phrase in query_lower for phrase in ["write a reply", "draft a response", "reply to", "respond to", "write back"]):
-                context_info += """The user wants help writing a reply to an email. Based on the previous conversation context:
-                - If they just asked about a specific email, help them write a reply to that email
-                - Provide actual draft content, not just say you can't do it
-                - Make the reply professional and appropriate for the email type
-                - Include greeting, main message, and closing
-                - Be helpful and provide real value. """
+            history = self._history_tokens(self.chat_memory)
+            result = self.chat_engine.chat(full_query)
+            self._log_turn(full_query, history, result.source_nodes)
+            response = str(result)
+            self.response_cache.put(key, response)
+            return response
+        except Exception as e:
+            return f"I'm sorry, I encountered an issue while processing your request: {str(e)}. Please try asking in a different way, and I'll do my best to help!"
+    
+    def stream_chat(self, query: str) -> Iterator[str]:
+        """Like chat(), but yields the answer in pieces as the model generates it
+        
+        Answers that need no generation (metadata, facets, cache hits) come
+        back as a single piece.
+        """
+        if not self.chat_engine:
+            yield "❌ Chat engine not initialized. Please run setup first."
+            return
+        
+        answer = self._direct_answer(query)
+        if answer is not None:
+            yield answer
+            return
+        
+        try:
+            full_query, key = self._engine_prompt(query)
+            response = self._cached_turn(full_query, key)
+            if response is not None:
+                yield response
+                return
+            
+            history = self._history_tokens(self.chat_memory)
+            result = self.chat_engine.stream_chat(full_query)
+            self._log_turn(full_query, history, result.source_nodes)
+            parts = []
+            for delta in result.response_gen:
+                parts.append(delta)
+                yield delta
+            self.response_cache.put(key, "".join(parts))
+        except Exception as e:
+            yield f"I'm sorry, I encountered an issue while processing your request: {str(e)}. Please try asking in a different way, and I'll do my best to help!"
+    
+    async def achat(self, query: str, conversation_id: Optional[str] = None) -> str:
+        """Async chat(); LLM calls are awaited, so one event loop can serve many conversations at once
+        
+        Each ``conversation_id`` gets its own chat memory; without one, the
+        conversation shared with chat() and stream_chat() is used.
+        """
+        if not self.chat_engine:
+            return "❌ Chat engine not initialized. Please run setup first."
+        
+        answer = self._direct_answer(query, conversation_id)
+        if answer is not None:
+            return answer
+        
+        try:
+            if conversation_id is None:
+                engine, memory = self.chat_engine, self.chat_memory
+            else:
+                if conversation_id not in self.conversations:
+                    self.conversations[conversation_id] = self._new_chat_engine()
+                engine, memory = self.conversations[conversation_id]
             
-            full_query = context_info + query
-            response = self.chat_engine.chat(full_query)
-            return str(response)
+            full_query, key = self._engine_prompt(query, memory)
+            response = self._cached_turn(full_query, key, memory)
+            if response is not None:
+                return response
+            
+            history = self._history_tokens(memory)
+            result = await engine.achat(full_query)
+            self._log_turn(full_query, history, result.source_nodes)
+            response = str(result)
+            self.response_cache.put(key, response)
+            return response
         except Exception as e:
             return f"I'm sorry, I encountered an issue while processing your request: {str(e)}. Please try asking in a different way, and I'll do my best to help!"
     
+    def _direct_answer(self, query: str, conversation_id: Optional[str] = None) -> Optional[str]:
+        """Answers that come from indexes and metadata rather than the LLM, or None"""
+        # Overview pages come from the precomputed summaries
+        summary = self._summary_page(query, conversation_id)
+        if summary is not None:
+            return summary
+        
+        # Counts, subject listings and "email #N" style lookups are answered from metadata
+        return self.answer_from_metadata(query)
+    
+    def _summary_page(self, query: str, conversation_id: Optional[str] = None) -> Optional[str]:
+        """A page of the email overview for "all emails" requests and their "next page" / "page 3" follow-ups, or None
+
+        Category, priority and sender come from the request ("all urgent
+        emails from acme"); a follow-up keeps the filters of the page before.
+        """
+        query_lower = query.lower()
+        page_number = SUMMARY_PAGE_NUMBER.search(query_lower)
+        previous = self.summary_cursors.get(conversation_id)
+        if SUMMARY_REQUEST.search(query_lower):
+            parsed = parse_query_filters(query)
+            filters = {field: parsed[field] for field in ("category", "priority", "sender") if field in parsed}
+            offset = 0
+        elif previous and (SUMMARY_NEXT_PAGE.search(query_lower) or page_number):
+            filters, offset = previous
+            offset += SUMMARY_PAGE_SIZE
+        else:
+            return None
+        if page_number:
+            offset = (max(int(page_number.group(1)), 1) - 1) * SUMMARY_PAGE_SIZE
+        self.summary_cursors[conversation_id] = (filters, offset)
+        
+        key = ("all_emails_summary", self.documents_version, tuple(sorted(filters.items())), offset)
+        summary = self.response_cache.get(key)
+        if summary is None:
+            summary = self.get_all_emails_summary(offset, SUMMARY_PAGE_SIZE, **filters)
+            self.response_cache.put(key, summary)
+        return summary
+    
+    def _engine_prompt(self, query: str, memory: Optional[ChatMemoryBuffer] = None) -> Tuple[str, tuple]:
+        """The message sent to the chat engine for ``query`` and its response cache key"""
+        query_lower = query.lower()
+        # Standing instructions live in CHAT_SYSTEM_PROMPT; only facts and hints for this turn go here
+        hints = [f"The mailbox has {len(self.documents)} emails."]
+        # Positions aren't stored in the emails, so name the ones a position refers to
+        picked = position_ids(parse_query_filters(query), self.date_index)
+        if picked and len(picked) <= 5:
+            hints.append("By date, " + "; ".join(self._describe_rank(email_id) for email_id in picked) + ".")
+        elif any(phrase in query_lower for phrase in ["write a reply", "draft a response", "reply to", "respond to", "write back"]):
+            hints.append("The user wants a reply drafted, most likely to the email just discussed; give the full draft.")
+        
+        # Retrieval only sees the text after the marker, so the hints don't skew the search
+        full_query = " ".join(hints) + "\n\n" + QUERY_MARKER + query
+        
+        # Standalone questions get the same answer whatever was said before
+        memory = memory or self.chat_memory
+        history = conversation_hash(memory.get_all()) if is_follow_up(query) else None
+        return full_query, (normalize_query(query), self.documents_version, history)
+    
+    def _describe_rank(self, email_id: str) -> str:
+        """'email #2 of 40 is "Subject" (2024-05-01T10:00:00)', with the rank read from the date index"""
+        rank = self.date_index.rank(email_id)
+        record = self.documents[rank - 1]
+        return f'email #{rank} of {len(self.date_index)} is "{record.subject}" ({record.email_date or "undated"})'
+    
+    def _history_tokens(self, memory: ChatMemoryBuffer) -> int:
+        """Tokens of chat history the next prompt will carry"""
+        return sum(count_tokens(message.content) for message in memory.get())
+    
+    def _log_turn(self, full_query: str, history: int, source_nodes: list):
+        """Log the size of the prompt just sent, by part"""
+        self.prompt_budget.log_turn(
+            instructions=count_tokens(CHAT_SYSTEM_PROMPT + CHAT_CONTEXT_PROMPT),
+            history=history,
+            context=sum(count_tokens(n.node.get_content(metadata_mode=MetadataMode.LLM)) for n in source_nodes),
+            query=count_tokens(full_query),
+        )
+    
+    def _cached_turn(self, full_query: str, key: tuple, memory: Optional[ChatMemoryBuffer] = None) -> Optional[str]:
+        """A cached answer for this turn, recorded in chat memory as the engine would, or None"""
+        response = self.response_cache.get(key)
+        if response is not None:
+            # Follow-up questions must still see this turn
+            memory = memory or self.chat_memory
+            memory.put(ChatMessage(role=MessageRole.USER, content=full_query))
+            memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=response))
+        return response
+    
+    def answer_from_metadata(self, query: str) -> Optional[str]:
+        """Answer counts, subject listings and position lookups ("most recent", "email #3") without the LLM
+
+        Returns None for open-ended questions, which go to the chat engine.
+        Category and priority filters are looked up in the facet index.
+        """
+        route = route_query(query)
+        if route is None or not self.documents:
+            return None
+        
+        intent, filters = route
+        total = len(self.documents)
+        picked = position_ids(filters, self.date_index)
+        picked = set(picked) if picked is not None else None
+        candidates = self.documents
+        facet_ids = [self.facets.ids(field, filters[field]) for field in ("category", "priority") if field in filters]
+        if facet_ids:
+            facet_ids = set.intersection(*facet_ids)
+            candidates = [doc for doc in self.documents if doc.doc_id in facet_ids]
+        matches = [doc for doc in candidates
+                   if (picked is None or doc.doc_id in picked) and metadata_matches(doc.metadata, filters)]
+        label = " ".join(
+            filters[field].lower() if field == "category" or filters[field] == "Urgent" else f"{filters[field].lower()}-priority"
+            for field in ("priority", "category") if field in filters
+        )
+        label = f"{label} " if label else ""
+        suffix = describe_filters(filters)
+        
+        if intent == "count":
+            if not filters:
+                return f"📊 You have **{total}** emails processed in total."
+            count = len(matches)
+            return (f"📊 You have **{count}** {label}email{'' if count == 1 else 's'}{suffix} "
+                    f"out of {total} processed.")
+        
+        if intent == "show":
+            if not matches:
+                position = filters.get("positions", (total,))[0]
+                return (f"I only have {total} emails processed, so there's no email #{position}. "
+                        f"Email #1 is the most recent and #{total} the oldest.")
+            metadata = matches[0].metadata
+            rank = self.date_index.rank(matches[0].doc_id)
+            where = " (most recent)" if rank == 1 else " (oldest)" if rank == total else ""
+            lines = [
+                f"📧 **Email #{rank} of {total}**{where}",
+                f"**Subject:** {metadata.get('subject', 'Unknown Subject')}",
+            ]
+            if metadata.get("sender"):
+                lines.append(f"**From:** {metadata['sender']}")
+            if metadata.get("email_date"):
+                lines.append(f"**Date:** {metadata['email_date'].replace('T', ' ')}")
+            lines.append(f"**Category:** {metadata.get('category')} · **Priority:** {metadata.get('priority')}")
+            lines.append(f"\n🧠 **AI Analysis:**\n{metadata.get('analysis', '').strip()}")
+            return "\n".join(lines)
+        
+        if not matches:
+            return f"I couldn't find any {label}emails{suffix} among your {total} processed emails."
+        heading = f"is your {label}email{suffix}" if len(matches) == 1 else f"are your {len(matches)} {label}emails{suffix}"
+        lines = [f"📋 Here {heading}:\n"]
+        for doc in matches[:ROUTER_LIST_LIMIT]:
+            lines.append(f"{self.date_index.rank(doc.doc_id)}. **{doc.subject}**")
+        if len(matches) > ROUTER_LIST_LIMIT:
+            lines.append(f"\n…and {len(matches) - ROUTER_LIST_LIMIT} more. Ask about a narrower set (a sender, a date range, a category) to see them.")
+        return "\n".join(lines)
+    
     def draft_email_reply(self, email_content: str, email_type: str = "general") -> str:
         """Helper method to draft email replies based on content and type"""
         
@@ -405,36 +1222,56 @@ Best regards,
             "total_emails": len(self.documents),
             "subjects": [doc.metadata.get("subject", "Unknown") for doc in self.documents[:5]],
             "all_subjects": [doc.metadata.get("subject", "Unknown") for doc in self.documents],
-            "processed_date": datetime.now().isoformat()
+            "processed_date": datetime.now().isoformat(),
+            "analysis_cache": self.analysis_cache.stats(),
+            "response_cache": self.response_cache.stats(),
+            "threads": thread_report(doc.metadata for doc in self.documents) if self.thread_mode else None,
+            "prompt_tokens": self.prompt_budget.stats(),
+            "category_counts": self.facets.counts("category"),
+            "priority_counts": self.facets.counts("priority"),
+            "email_categories": [doc.metadata.get("category", "Other") for doc in self.documents]
         }
         
         return stats
     
-    def get_all_emails_summary(self) -> str:
-        """Get a comprehensive summary of all processed emails"""
+    def list_email_summaries(self, offset: int = 0, limit: Optional[int] = None, category: Optional[str] = None,
+                             priority: Optional[str] = None, sender: Optional[str] = None,
+                             text: Optional[str] = None) -> dict:
+        """One page of per-email summaries (position, subject, sender, date, category, priority, headline, id)
+
+        Summaries are precomputed as emails are added, so a page costs the
+        same at 10 or 10,000 emails. See SummaryIndex.page for the filters.
+        """
+        return self.summaries.page(offset, limit, category=category, priority=priority, sender=sender, text=text)
+    
+    def iter_email_summaries(self, **filters) -> Iterator[dict]:
+        """Every matching per-email summary, most recent first, without building a list"""
+        return self.summaries.iter(**filters)
+    
+    def get_all_emails_summary(self, offset: int = 0, limit: Optional[int] = None, **filters) -> str:
+        """A page of the email overview as markdown (SUMMARY_PAGE_SIZE emails unless ``limit`` is given)"""
         if not self.documents:
             return "No emails have been processed yet."
         
-        summary_parts = []
-        summary_parts.append(f"📧 **Total Emails Processed: {len(self.documents)}**\n")
-        
-        for i, doc in enumerate(self.documents, 1):
-            subject = doc.metadata.get("subject", "Unknown Subject")
-            email_id = doc.metadata.get("email_id", "Unknown")
-            
-            # Extract a brief snippet from the document text
-            text_lines = doc.text.split('\n')
-            analysis_line = None
-            for line in text_lines:
-                if line.startswith("AI Analysis:"):
-                    analysis_line = text_lines[text_lines.index(line) + 1] if text_lines.index(line) + 1 < len(text_lines) else None
-                    break
-            
-            summary_parts.append(f"{i}. **{subject}**")
-            if analysis_line and analysis_line.strip():
-                summary_parts.append(f"   {analysis_line.strip()}")
-            summary_parts.append(f"   Email ID: {email_id}\n")
+        page = self.list_email_summaries(offset, limit, **filters)
+        items = page["items"]
+        summary_parts = [f"📧 **Total Emails Processed: {page['total']}**\n"]
+        for item in items:
+            summary_parts.append(f"{item['position']}. **{item['subject']}**")
+            if item["headline"]:
+                summary_parts.append(f"   {item['headline']}")
+            summary_parts.append(f"   Email ID: {item['email_id']}\n")
         
+        filtered = any(filters.values())
+        if not items:
+            summary_parts.append("That's past the last page." if offset else "No emails match these filters.")
+        elif page["has_more"] or offset:
+            shown = f"emails {offset + 1}–{offset + len(items)}" + (" of those matching" if filtered else f" of {page['total']}")
+            more = ""
+            if page["has_more"]:
+                more = ' Say "next page" for more'
+                more += "." if filtered else ', or narrow it down, e.g. "all urgent emails" or "all emails from acme".'
+            summary_parts.append(f"Showing {shown}.{more}")
         return "\n".join(summary_parts)
 
 def main():
@@ -447,7 +1284,7 @@ def main():
     # Setup process
     print("\n1️⃣ Setting up Gmail Chatbot...")
     
-    if not chatbot.fetch_and_process_emails(max_emails=10):
+    if not chatbot.sync_emails(max_emails=10):
         print("❌ Failed to fetch emails. Please check your Gmail setup.")
         return
     
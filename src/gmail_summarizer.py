@@ -1,109 +1,643 @@
-import os
-import base64
-import pickle
-from email import message_from_bytes
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from langchain_google_genai import ChatGoogleGenerativeAI
-from dotenv import load_dotenv
-
-load_dotenv()
-
-SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
-
-def get_llm():
-    model_name = os.getenv("MODEL_NAME", "gemini-2.0-flash")
-    temperature = float(os.getenv("TEMPERATURE", 0.2))
-    return ChatGoogleGenerativeAI(model=model_name, temperature=temperature)
-
-def get_gmail_service():
-    creds = None
-    BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-    CREDENTIALS_PATH = os.path.join(BASE_DIR, "credentials.json")
-    TOKEN_PATH = os.path.join(BASE_DIR, "token.pickle")
-
-    if os.path.exists(TOKEN_PATH):
-        with open(TOKEN_PATH, "rb") as token:
-            creds = pickle.load(token)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_PATH, SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open(TOKEN_PATH, "wb") as token:
-            pickle.dump(creds, token)
-
-    return build("gmail", "v1", credentials=creds)
-
-def get_email_content(service, msg_id):
-    msg = service.users().messages().get(userId="me", id=msg_id, format="raw").execute()
-    raw_msg = base64.urlsafe_b64decode(msg["raw"].encode("ASCII"))
-    mime_msg = message_from_bytes(raw_msg)
-
-    subject = mime_msg["subject"]
-    body = ""
-    if mime_msg.is_multipart():
-        for part in mime_msg.walk():
-            if part.get_content_type() == "text/plain":
-                body = part.get_payload(decode=True).decode(errors="ignore")
-                break
-    else:
-        body = mime_msg.get_payload(decode=True).decode(errors="ignore")
-
-    return subject, body
-
-def analyze_with_gemini(llm, subject, body):
-    prompt = f"""
-Summarize the following email in 2-3 sentences.
-Also classify:
-- Category: [Work, Security, Promotion, Personal, Other]
-- Priority: [Urgent, Normal, Low]
-
-Email:
-Subject: {subject}
-Body: {body}
-"""
-    response = llm.invoke(prompt)
-    return response.content.strip()
-
-def main():
-    service = get_gmail_service()
-    llm = get_llm()
-
-    results = service.users().messages().list(userId="me", maxResults=5).execute()
-    messages = results.get("messages", [])
-
-    summaries = []
-
-    print("📬 Raw Emails + Gemini Analysis:\n")
-    for msg in messages:
-        subject, body = get_email_content(service, msg["id"])
-        analysis = analyze_with_gemini(llm, subject, body)
-
-        email_summary = f"""
----
-📩 Subject: {subject}
-🔎 Analysis: {analysis}
-"""
-        summaries.append(analysis)
-        print(email_summary)
-
-    digest_prompt = f"""
-Here are multiple email analyses. Create a short daily digest summary highlighting:
-- Count per category (Work, Security, Promotion, Personal, Other)
-- How many urgent items
-- 2-line executive summary
-
-Emails:
-{summaries}
-"""
-    digest = llm.invoke(digest_prompt)
-    print("\n📊 Daily Digest Report:\n")
-    print(digest.content.strip())
-
-if __name__ == "__main__":
-    main()
+import os
+import re
+import json
+import base64
+import hashlib
+import pickle
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from email import message_from_bytes
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from langchain_google_genai import ChatGoogleGenerativeAI
+from dotenv import load_dotenv
+
+try:
+    from .analysis_cache import AnalysisCache, analysis_key
+    from .llm_pool import RateLimitedLLM, run_in_pool, is_retryable, backoff_delay
+    from .html_text import html_to_text
+except ImportError:
+    # Fallback for when running as script
+    from analysis_cache import AnalysisCache, analysis_key
+    from llm_pool import RateLimitedLLM, run_in_pool, is_retryable, backoff_delay
+    from html_text import html_to_text
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+# Local state shared by the CLI and the chatbot: message store, analysis cache, sync state
+DATA_DIR = os.getenv("EMAIL_DATA_DIR", os.path.join(BASE_DIR, ".email_data"))
+
+SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+
+# Gmail accepts up to 100 calls per batch but recommends staying at or below 50
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", 50))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 4))
+# Rounds of re-batching the gets that failed with 429/5xx, with jittered exponential backoff between them
+FETCH_MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", 5))
+# messages().list returns at most 500 ids per page
+LIST_PAGE_SIZE = 500
+# Bytes of each raw message that are decoded and parsed; body parts come before
+# attachments, so only oversized attachments are cut off
+EMAIL_MAX_DECODED_BYTES = int(os.getenv("EMAIL_MAX_DECODED_BYTES", 2_000_000))
+
+# Emails packed into one analysis prompt (1 = one call per email) and that prompt's size cap
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", 1))
+ANALYSIS_BATCH_TOKENS = int(os.getenv("ANALYSIS_BATCH_TOKENS", 12000))
+
+def get_llm():
+    model_name = os.getenv("MODEL_NAME", "gemini-2.0-flash")
+    temperature = float(os.getenv("TEMPERATURE", 0.2))
+    return ChatGoogleGenerativeAI(model=model_name, temperature=temperature)
+
+def get_gmail_service():
+    creds = None
+    BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+    CREDENTIALS_PATH = os.path.join(BASE_DIR, "credentials.json")
+    TOKEN_PATH = os.path.join(BASE_DIR, "token.pickle")
+
+    if os.path.exists(TOKEN_PATH):
+        with open(TOKEN_PATH, "rb") as token:
+            creds = pickle.load(token)
+
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_PATH, SCOPES)
+            creds = flow.run_local_server(port=0)
+        with open(TOKEN_PATH, "wb") as token:
+            pickle.dump(creds, token)
+
+    return build("gmail", "v1", credentials=creds)
+
+def get_email_content(service, msg_id):
+    msg = service.users().messages().get(userId="me", id=msg_id, format="raw").execute()
+    return parse_raw_message(msg)
+
+def parse_raw_message(msg):
+    """Parse a format="raw" Gmail message resource into (subject, body)"""
+    mime_msg, body = decode_raw_message(msg)
+    return mime_msg["subject"], body
+
+def parse_message_record(msg):
+    """Parse a format="raw" Gmail message resource into a storable record"""
+    mime_msg, body = decode_raw_message(msg)
+    return {
+        "email_id": msg["id"],
+        "headers": [(name, str(value)) for name, value in mime_msg.items()],
+        "raw_subject": mime_msg["subject"],
+        "body": body,
+        "internal_date": int(msg.get("internalDate", 0)),
+        "thread_id": msg.get("threadId", msg["id"]),
+    }
+
+def decode_raw_message(msg, max_bytes=None):
+    """Decode a raw message and extract its body in a single walk of the MIME tree
+
+    The first non-empty text/plain part wins; HTML-only messages fall back to
+    their first text/html part, converted by html_to_text. Attachments are
+    skipped, and only the first ``max_bytes`` (EMAIL_MAX_DECODED_BYTES) of
+    the message are decoded and parsed.
+    """
+    max_bytes = max_bytes or EMAIL_MAX_DECODED_BYTES
+    # 4 base64 characters per 3 bytes; a multiple of 4 keeps the cut decodable
+    raw = msg["raw"][:(max_bytes // 3 + 1) * 4]
+    mime_msg = message_from_bytes(base64.urlsafe_b64decode(raw.encode("ASCII")))
+
+    body, html_part = "", None
+    for part in mime_msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            body = decode_text_part(part)
+            if body.strip():
+                break
+        elif content_type == "text/html" and html_part is None:
+            html_part = part
+    if not body.strip() and html_part is not None:
+        body = html_to_text(decode_text_part(html_part))
+
+    return mime_msg, body
+
+def decode_text_part(part):
+    """Payload of a text MIME part as str, in its declared charset"""
+    payload = part.get_payload(decode=True) or b""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
+    except LookupError:
+        return payload.decode("utf-8", errors="ignore")
+
+def build_gmail_query(query=None, after=None, before=None):
+    """Combine a Gmail search string with after/before date filters"""
+    def as_term(value):
+        if isinstance(value, datetime):
+            return str(int(value.timestamp()))
+        if isinstance(value, date):
+            return value.strftime("%Y/%m/%d")
+        return str(value)
+
+    terms = [query] if query else []
+    if after is not None:
+        terms.append(f"after:{as_term(after)}")
+    if before is not None:
+        terms.append(f"before:{as_term(before)}")
+    return " ".join(terms) or None
+
+def iter_message_pages(service, max_results=None, query=None, label_ids=None, after=None, before=None,
+                       page_size=LIST_PAGE_SIZE):
+    """Lazily list message stubs page by page, following nextPageToken.
+
+    Yields lists of ``{"id", "threadId"}`` dicts, newest first, stopping after
+    ``max_results`` messages (None = the whole mailbox). Only one page of ids
+    is held at a time, so callers can process a page before the next is fetched.
+    """
+    q = build_gmail_query(query, after, before)
+    remaining = max_results
+    page_token = None
+
+    while remaining is None or remaining > 0:
+        request = {"userId": "me", "maxResults": min(page_size, remaining or page_size)}
+        if q:
+            request["q"] = q
+        if label_ids:
+            request["labelIds"] = list(label_ids)
+        if page_token:
+            request["pageToken"] = page_token
+
+        results = service.users().messages().list(**request).execute()
+        messages = results.get("messages", [])
+        if remaining is not None:
+            messages = messages[:remaining]
+            remaining -= len(messages)
+        if messages:
+            yield messages
+
+        page_token = results.get("nextPageToken")
+        if not page_token or not messages:
+            break
+
+def iter_messages(service, **kwargs):
+    """Flattened view of iter_message_pages yielding one message stub at a time"""
+    for page in iter_message_pages(service, **kwargs):
+        yield from page
+
+def get_history_id(service):
+    """Current mailbox historyId, the starting point for the next incremental sync"""
+    return service.users().getProfile(userId="me").execute()["historyId"]
+
+def list_history_changes(service, start_history_id, label_id=None):
+    """Collect messages added and deleted since ``start_history_id``.
+
+    Follows nextPageToken through users().history().list and nets out
+    messages that were both added and deleted in the window. Returns
+    ``(added_ids, deleted_ids, latest_history_id)`` with ``added_ids`` newest
+    first. Raises the client's error (404) when ``start_history_id`` is too
+    old, in which case callers should fall back to a full fetch.
+    """
+    added, deleted = {}, set()
+    latest_history_id = start_history_id
+    page_token = None
+
+    while True:
+        request = {
+            "userId": "me",
+            "startHistoryId": start_history_id,
+            "historyTypes": ["messageAdded", "messageDeleted"],
+        }
+        if label_id:
+            request["labelId"] = label_id
+        if page_token:
+            request["pageToken"] = page_token
+
+        results = service.users().history().list(**request).execute()
+        for record in results.get("history", []):
+            for change in record.get("messagesAdded", []):
+                msg_id = change["message"]["id"]
+                added[msg_id] = True
+                deleted.discard(msg_id)
+            for change in record.get("messagesDeleted", []):
+                msg_id = change["message"]["id"]
+                if added.pop(msg_id, None) is None:
+                    deleted.add(msg_id)
+        latest_history_id = results.get("historyId", latest_history_id)
+
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+
+    # History records are oldest first; callers want mailbox order
+    return list(reversed(list(added))), deleted, latest_history_id
+
+def fetch_email_contents(service, msg_ids, batch_size=None, max_workers=None, service_factory=None,
+                         parse=parse_raw_message, max_retries=None, sleep=time.sleep):
+    """Fetch and parse many messages using Gmail batch requests.
+
+    Message gets are grouped into batch HTTP requests of ``batch_size`` calls
+    and up to ``max_workers`` batches run concurrently. The Gmail client is not
+    thread-safe, so each worker thread gets its own service object from
+    ``service_factory`` (defaults to ``get_gmail_service``); the calling
+    thread keeps using ``service``.
+
+    Gets that fail with a rate-limit or server error (429/5xx) are collected
+    and re-batched on the calling thread after a jittered exponential
+    backoff, for up to ``max_retries`` rounds (FETCH_MAX_RETRIES).
+
+    Returns a list in the same order as ``msg_ids``. Each entry is either the
+    ``parse`` result for that message (``(subject, body)`` by default) or the
+    exception raised for it.
+    """
+    max_retries = FETCH_MAX_RETRIES if max_retries is None else max_retries
+    batch_size = max(1, min(batch_size or FETCH_BATCH_SIZE, 100))
+    max_workers = max(1, max_workers or FETCH_WORKERS)
+    service_factory = service_factory or get_gmail_service
+
+    msg_ids = list(msg_ids)
+    results = [None] * len(msg_ids)
+    local = threading.local()
+
+    def thread_service():
+        if not hasattr(local, "service"):
+            local.service = service_factory()
+        return local.service
+
+    def run_batch(indices, batch_service=None):
+        batch_service = batch_service or thread_service()
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            if exception is not None:
+                results[index] = exception
+                return
+            try:
+                results[index] = parse(response)
+            except Exception as e:
+                results[index] = e
+
+        batch = batch_service.new_batch_http_request(callback=callback)
+        for index in indices:
+            batch.add(
+                batch_service.users().messages().get(userId="me", id=msg_ids[index], format="raw"),
+                request_id=str(index),
+            )
+        try:
+            batch.execute()
+        except Exception as e:
+            for index in indices:
+                if results[index] is None:
+                    results[index] = e
+
+    def batches(indices):
+        return [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+
+    groups = batches(list(range(len(msg_ids))))
+    if max_workers == 1 or len(groups) <= 1:
+        for indices in groups:
+            run_batch(indices, service)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(run_batch, groups))
+
+    # Throttled gets come back one by one inside otherwise successful batches; retry just those
+    for attempt in range(max_retries):
+        failed = [index for index, result in enumerate(results) if isinstance(result, Exception) and is_retryable(result)]
+        if not failed:
+            break
+        sleep(backoff_delay(attempt))
+        for index in failed:
+            results[index] = None
+        for indices in batches(failed):
+            run_batch(indices, service)
+
+    return results
+
+# Bump whenever ANALYSIS_PROMPT changes so cached analyses are not reused
+ANALYSIS_PROMPT_VERSION = 1
+ANALYSIS_PROMPT = """
+Summarize the following email in 2-3 sentences.
+Also classify:
+- Category: [Work, Security, Promotion, Personal, Other]
+- Priority: [Urgent, Normal, Low]
+
+Email:
+Subject: {subject}
+Body: {body}
+"""
+
+def get_analysis_cache():
+    return AnalysisCache(os.path.join(DATA_DIR, "analysis_cache.sqlite3"))
+
+def analyze_with_gemini(llm, subject, body, cache=None):
+    """Summarize and classify one email, reusing ``cache`` when the same content was seen before"""
+    key = None
+    if cache is not None:
+        model_name = getattr(llm, "model", None) or type(llm).__name__
+        key = analysis_key(model_name, ANALYSIS_PROMPT_VERSION, subject, body)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    prompt = ANALYSIS_PROMPT.format(subject=subject, body=body)
+    response = llm.invoke(prompt)
+    analysis = response.content.strip()
+
+    if key is not None:
+        cache.put(key, analysis)
+    return analysis
+
+CATEGORIES = ["Work", "Security", "Promotion", "Personal", "Other"]
+PRIORITIES = ["Urgent", "Normal", "Low"]
+
+BATCH_ANALYSIS_PROMPT_VERSION = "batch-1"
+BATCH_ANALYSIS_PROMPT = """
+For each email below, summarize it in 2-3 sentences and classify it.
+Respond with ONLY a JSON array, one object per email, in this exact shape:
+[{{"id": "<email id>", "summary": "...", "category": "<one of {categories}>", "priority": "<one of {priorities}>"}}]
+
+{emails}
+"""
+BATCH_EMAIL_TEMPLATE = """<email id="{id}">
+Subject: {subject}
+Body: {body}
+</email>
+"""
+# Per-email body cap inside a batch, so one long email cannot crowd out the others
+BATCH_BODY_CHARS = 4000
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+def format_analysis(summary, category, priority):
+    """Render structured results in the same text shape as a single-email analysis"""
+    return f"{summary.strip()}\nCategory: {category}\nPriority: {priority}"
+
+_ANALYSIS_FIELDS = {
+    "category": (re.compile(r"category\W*:\W*([A-Za-z]+)", re.IGNORECASE), CATEGORIES, "Other"),
+    "priority": (re.compile(r"priority\W*:\W*([A-Za-z]+)", re.IGNORECASE), PRIORITIES, "Normal"),
+}
+
+def parse_analysis(analysis):
+    """Pull Category/Priority back out of an analysis, falling back to Other/Normal"""
+    fields = {}
+    for field, (pattern, allowed, default) in _ANALYSIS_FIELDS.items():
+        match = pattern.search(analysis or "")
+        value = match.group(1).title() if match else None
+        fields[field] = value if value in allowed else default
+    return fields
+
+def parse_batch_analysis(text):
+    """Parse the model's JSON array into {email_id: analysis}, dropping malformed items"""
+    text = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.M).strip()
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    analyses = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        summary = item.get("summary")
+        category = str(item.get("category", "")).strip().title()
+        priority = str(item.get("priority", "")).strip().title()
+        if not isinstance(summary, str) or not summary.strip():
+            continue
+        if category not in CATEGORIES or priority not in PRIORITIES:
+            continue
+        analyses[str(item.get("id"))] = format_analysis(summary, category, priority)
+    return analyses
+
+def analyze_emails_batched(llm, emails, cache=None, batch_size=None, token_budget=None, max_workers=None):
+    """Analyze many ``(email_id, subject, body)`` emails with as few LLM calls as possible.
+
+    Uncached emails are packed ``batch_size`` at a time into one JSON-output
+    prompt of at most ``token_budget`` tokens. Emails missing from or
+    malformed in a batch response fall back to analyze_with_gemini. Up to
+    ``max_workers`` LLM calls run concurrently (LLM_MAX_CONCURRENCY by
+    default); wrap ``llm`` in RateLimitedLLM to apply rate limits and retries.
+    Returns a list in input order with an analysis string or the exception
+    per email.
+    """
+    batch_size = max(1, batch_size or ANALYSIS_BATCH_SIZE)
+    token_budget = token_budget or ANALYSIS_BATCH_TOKENS
+    model_name = getattr(llm, "model", None) or type(llm).__name__
+
+    results = [None] * len(emails)
+    pending = []
+    for index, (email_id, subject, body) in enumerate(emails):
+        if cache is not None and batch_size > 1:
+            cached = cache.get(analysis_key(model_name, BATCH_ANALYSIS_PROMPT_VERSION, subject, body))
+            if cached is not None:
+                results[index] = cached
+                continue
+        pending.append(index)
+
+    overhead = estimate_tokens(BATCH_ANALYSIS_PROMPT)
+    batches, batch, used = [], [], overhead
+    for index in pending if batch_size > 1 else []:
+        email_id, subject, body = emails[index]
+        cost = estimate_tokens(BATCH_EMAIL_TEMPLATE) + estimate_tokens(subject or "") + \
+            estimate_tokens(body[:BATCH_BODY_CHARS])
+        if batch and (len(batch) >= batch_size or used + cost > token_budget):
+            batches.append(batch)
+            batch, used = [], overhead
+        batch.append(index)
+        used += cost
+    if batch:
+        batches.append(batch)
+
+    def run_batch(batch):
+        prompt = BATCH_ANALYSIS_PROMPT.format(
+            categories=", ".join(CATEGORIES),
+            priorities=", ".join(PRIORITIES),
+            emails="".join(
+                BATCH_EMAIL_TEMPLATE.format(
+                    id=emails[i][0], subject=emails[i][1], body=emails[i][2][:BATCH_BODY_CHARS]
+                )
+                for i in batch
+            ),
+        )
+        return parse_batch_analysis(llm.invoke(prompt).content)
+
+    multi = [batch for batch in batches if len(batch) > 1]
+    for batch, analyses in zip(multi, run_in_pool(run_batch, multi, max_workers)):
+        if isinstance(analyses, Exception):
+            print(f"⚠️ Batch analysis failed, analyzing emails one by one: {str(analyses)}")
+            continue
+        for i in batch:
+            email_id, subject, body = emails[i]
+            if email_id in analyses:
+                results[i] = analyses[email_id]
+                if cache is not None:
+                    cache.put(analysis_key(model_name, BATCH_ANALYSIS_PROMPT_VERSION, subject, body), results[i])
+
+    # Per-email fallback for singletons, failed batches and malformed items
+    remaining = [index for index in pending if results[index] is None]
+    fallback = run_in_pool(
+        lambda index: analyze_with_gemini(llm, emails[index][1], emails[index][2], cache),
+        remaining,
+        max_workers,
+    )
+    for index, analysis in zip(remaining, fallback):
+        results[index] = analysis
+
+    return results
+
+# Digest tree shape: analyses per leaf digest (on average) and partial digests per merge
+DIGEST_LEAF_SIZE = int(os.getenv("DIGEST_LEAF_SIZE", 25))
+DIGEST_FANOUT = int(os.getenv("DIGEST_FANOUT", 8))
+# Bump whenever the digest prompts change so cached partial digests are not reused
+DIGEST_PROMPT_VERSION = "digest-1"
+DIGEST_LEAF_PROMPT = """
+Here are AI analyses of {count} emails from one mailbox.
+In 2-3 sentences, say what matters most in them: important conversations, deadlines and anything urgent.
+Don't count emails per category; that is done separately.
+
+{analyses}
+"""
+DIGEST_MERGE_PROMPT = """
+Here are partial digests covering {count} emails of one mailbox.
+Merge them into a 2-line executive summary that keeps the most important items.
+
+{digests}
+"""
+
+def digest_counts(analyses):
+    """Emails per category and priority, parsed from the analyses themselves (no LLM involved)"""
+    counts = {"category": Counter({category: 0 for category in CATEGORIES}),
+              "priority": Counter({priority: 0 for priority in PRIORITIES})}
+    for analysis in analyses:
+        for field, value in parse_analysis(analysis).items():
+            counts[field][value] += 1
+    return {field: dict(counter) for field, counter in counts.items()}
+
+def _chunk_by_key(items, keys, size):
+    """Split ``items`` where ``hash(key) % size == 0``, so inserting or removing one item only changes its own chunk"""
+    chunks, chunk = [], []
+    for item, key in zip(items, keys):
+        chunk.append(item)
+        if int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % size == 0 or len(chunk) >= 4 * size:
+            chunks.append(chunk)
+            chunk = []
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def build_digest(llm, analyses, cache=None, leaf_size=None, fanout=None, max_workers=None):
+    """Digest of any number of ``(email_id, analysis)`` pairs, listed oldest first.
+
+    Analyses are split into leaves of about ``leaf_size`` (DIGEST_LEAF_SIZE)
+    emails, each summarized by one LLM call; partial digests are then
+    merged ``fanout`` (DIGEST_FANOUT) at a time until one remains. Leaf
+    boundaries depend on the email ids, not their positions, and every
+    partial digest is cached under its inputs, so after a few new emails
+    only their leaves and the merges above them are recomputed. Category
+    and priority counts are computed locally. Returns ``{"total",
+    "category_counts", "priority_counts", "summary", "leaves",
+    "llm_calls"}``.
+    """
+    leaf_size = max(1, leaf_size or DIGEST_LEAF_SIZE)
+    fanout = max(2, fanout or DIGEST_FANOUT)
+    model_name = getattr(llm, "model", None) or type(llm).__name__
+    counts = digest_counts(analysis for _, analysis in analyses)
+    llm_calls = 0
+
+    def summarize(prompts):
+        """Cached LLM output for each ``(key, prompt)``, computing only the misses"""
+        nonlocal llm_calls
+        results = [cache.get(key) if cache is not None else None for key, _ in prompts]
+        missing = [i for i, result in enumerate(results) if result is None]
+        outputs = run_in_pool(lambda i: llm.invoke(prompts[i][1]).content.strip(), missing, max_workers)
+        for i, output in zip(missing, outputs):
+            if isinstance(output, Exception):
+                raise output
+            results[i] = output
+            if cache is not None:
+                cache.put(prompts[i][0], output)
+        llm_calls += len(missing)
+        return results
+
+    # Leaves: (email count, digest) per chunk of analyses
+    leaves = _chunk_by_key(analyses, [email_id for email_id, _ in analyses], leaf_size)
+    prompts = []
+    for leaf in leaves:
+        text = "\n".join(f"- {analysis.strip()}".replace("\n", " ") for _, analysis in leaf)
+        prompt = DIGEST_LEAF_PROMPT.format(count=len(leaf), analyses=text)
+        prompts.append((analysis_key(model_name, DIGEST_PROMPT_VERSION, "leaf", text), prompt))
+    level = list(zip([len(leaf) for leaf in leaves], summarize(prompts)))
+
+    # Merge partial digests until one is left; group boundaries follow the digests' content too
+    while len(level) > 1:
+        groups = _chunk_by_key(level, [digest for _, digest in level], fanout)
+        if len(groups) == len(level):
+            # Every digest happened to end a group; fall back to fixed groups so the tree still shrinks
+            groups = [level[start:start + fanout] for start in range(0, len(level), fanout)]
+        prompts = []
+        for group in groups:
+            text = "\n\n".join(f"[{count} emails]\n{digest}" for count, digest in group)
+            prompt = DIGEST_MERGE_PROMPT.format(count=sum(count for count, _ in group), digests=text)
+            prompts.append((analysis_key(model_name, DIGEST_PROMPT_VERSION, "merge", text), prompt))
+        merged = iter(summarize([prompt for group, prompt in zip(groups, prompts) if len(group) > 1]))
+        # A group of one passes through unchanged
+        level = [(sum(count for count, _ in group), next(merged) if len(group) > 1 else group[0][1])
+                 for group in groups]
+
+    return {
+        "total": len(analyses),
+        "category_counts": counts["category"],
+        "priority_counts": counts["priority"],
+        "summary": level[0][1] if level else "No emails to summarize.",
+        "leaves": len(leaves),
+        "llm_calls": llm_calls,
+    }
+
+def format_digest(digest):
+    """Printable daily digest report"""
+    categories = ", ".join(f"{name} {count}" for name, count in digest["category_counts"].items())
+    return (f"📧 {digest['total']} emails: {categories}\n"
+            f"🚨 Urgent items: {digest['priority_counts'].get('Urgent', 0)}\n\n"
+            f"{digest['summary']}")
+
+def main():
+    service = get_gmail_service()
+    llm = RateLimitedLLM(get_llm())
+    cache = get_analysis_cache()
+
+    summaries = []
+
+    print("📬 Raw Emails + Gemini Analysis:\n")
+    messages = list(iter_messages(service, max_results=5))
+    contents = fetch_email_contents(service, [msg["id"] for msg in messages])
+    emails = [(msg["id"], *content) for msg, content in zip(messages, contents)
+              if not isinstance(content, Exception)]
+    analyses = analyze_emails_batched(llm, emails, cache)
+
+    for (email_id, subject, body), analysis in zip(emails, analyses):
+        if isinstance(analysis, Exception):
+            print(f"⚠️ Could not analyze {subject}: {str(analysis)}")
+            continue
+
+        email_summary = f"""
+---
+📩 Subject: {subject}
+🔎 Analysis: {analysis}
+"""
+        summaries.append((email_id, analysis))
+        print(email_summary)
+
+    # Gmail lists newest first; the digest takes emails oldest first so new ones extend the last leaf
+    digest = build_digest(llm, summaries[::-1], cache)
+    print("\n📊 Daily Digest Report:\n")
+    print(format_digest(digest))
+
+if __name__ == "__main__":
+    main()
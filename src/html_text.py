@@ -0,0 +1,60 @@
+"""
+Fast HTML-to-text conversion for HTML-only emails (newsletters, notifications)
+"""
+
+import html
+import re
+
+# One regex pass over the markup: invisible elements and comments vanish, block-level tags
+# become line breaks, every other tag is dropped
+_MARKUP = re.compile(
+    r"<(script|style|head|title|noscript|template|svg)\b.*?</\1\s*>"
+    r"|<!--.*?-->"
+    r"|<!\[CDATA\[.*?\]\]>"
+    r"|<(/?)(?:p|div|br|hr|tr|li|ul|ol|h[1-6]|table|thead|tbody|tfoot|blockquote|pre|section|article|"
+    r"header|footer|center|dt|dd)\b[^>]*>"
+    r"|<[^>]*>",
+    re.S | re.I,
+)
+_SPACES = re.compile(r"[ \t\r\f\v\xa0\u200b\u200c\u200d\u2007\u202f\ufeff]+")
+_BLANK_LINES = re.compile(r"\n\s*\n\s*(?:\n\s*)+")
+
+# Paragraphs that only serve tracking, list management or legal boilerplate
+_FOOTER = re.compile(
+    r"unsubscribe|manage (?:your )?(?:email )?(?:preferences|subscriptions?)|email preferences|"
+    r"view (?:this email )?in (?:your |a )?browser|view (?:it )?online|you(?:'re| are) receiving this|"
+    r"you received this|sent to [\w.+-]+@|this email was sent|privacy policy|all rights reserved|©|\(c\) \d{4}|"
+    r"update your preferences|opt[ -]out|add us to your address book",
+    re.I,
+)
+
+def _replace_markup(match: re.Match) -> str:
+    if match.group(1):
+        return " "
+    return "\n" if match.group(2) is not None else ""
+
+def strip_footer(text: str) -> str:
+    """Drop trailing unsubscribe/legal paragraphs, then trailing footer lines of the last one kept
+
+    The first paragraph, and the first line of it, are always kept, so a
+    short notification that mentions why it was sent never comes out empty.
+    """
+    paragraphs = text.split("\n\n")
+    while len(paragraphs) > 1 and _FOOTER.search(paragraphs[-1]):
+        paragraphs.pop()
+    lines = paragraphs[-1].split("\n")
+    while len(lines) > 1 and _FOOTER.search(lines[-1]):
+        lines.pop()
+    paragraphs[-1] = "\n".join(lines)
+    return "\n\n".join(paragraphs)
+
+def html_to_text(markup: str) -> str:
+    """Readable text of an HTML email body
+
+    Scripts, styles and comments are removed, block elements become line
+    breaks, entities are decoded, whitespace is collapsed and tracking or
+    unsubscribe footers are stripped.
+    """
+    text = html.unescape(_MARKUP.sub(_replace_markup, markup))
+    lines = (_SPACES.sub(" ", line).strip() for line in text.split("\n"))
+    return strip_footer(_BLANK_LINES.sub("\n\n", "\n".join(lines)).strip())
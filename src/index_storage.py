@@ -0,0 +1,77 @@
+"""
+Fast save/load of the email VectorStoreIndex.
+
+LlamaIndex's SimpleVectorStore.persist round-trips every float through
+dataclasses_json, which takes tens of seconds per thousand emails. Here the
+docstore and index store use their normal JSON files, while the vectors go
+to a single float32 .npy matrix plus a small JSON file of ids.
+"""
+
+import json
+import os
+from typing import Optional
+
+import numpy as np
+from llama_index.core import StorageContext, load_index_from_storage
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.index_store import SimpleIndexStore
+from llama_index.core.vector_stores.simple import SimpleVectorStore, SimpleVectorStoreData
+
+DOCSTORE_FILE = "docstore.json"
+INDEX_STORE_FILE = "index_store.json"
+VECTORS_FILE = "vectors.npy"
+VECTOR_IDS_FILE = "vector_ids.json"
+META_FILE = "index_meta.json"
+
+def _replace_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def persist_index(index, persist_dir: str, meta: dict):
+    """Save ``index`` under ``persist_dir``; ``meta`` is written last and marks a complete save"""
+    os.makedirs(persist_dir, exist_ok=True)
+    storage_context = index.storage_context
+    storage_context.docstore.persist(persist_path=os.path.join(persist_dir, DOCSTORE_FILE))
+    storage_context.index_store.persist(persist_path=os.path.join(persist_dir, INDEX_STORE_FILE))
+
+    data = storage_context.vector_store.data
+    ids = list(data.embedding_dict)
+    matrix = np.asarray([data.embedding_dict[node_id] for node_id in ids], dtype=np.float32)
+    tmp_path = os.path.join(persist_dir, f"{VECTORS_FILE}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, os.path.join(persist_dir, VECTORS_FILE))
+    _replace_json(os.path.join(persist_dir, VECTOR_IDS_FILE), {
+        "ids": ids,
+        "text_id_to_ref_doc_id": data.text_id_to_ref_doc_id,
+        "metadata_dict": data.metadata_dict,
+    })
+    _replace_json(os.path.join(persist_dir, META_FILE), meta)
+
+def load_index_meta(persist_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(persist_dir, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_index(persist_dir: str):
+    """Load an index saved by persist_index"""
+    docstore = SimpleDocumentStore.from_persist_path(os.path.join(persist_dir, DOCSTORE_FILE))
+    index_store = SimpleIndexStore.from_persist_path(os.path.join(persist_dir, INDEX_STORE_FILE))
+
+    matrix = np.load(os.path.join(persist_dir, VECTORS_FILE))
+    with open(os.path.join(persist_dir, VECTOR_IDS_FILE)) as f:
+        vector_ids = json.load(f)
+    vector_store = SimpleVectorStore(data=SimpleVectorStoreData(
+        embedding_dict=dict(zip(vector_ids["ids"], matrix.tolist())),
+        text_id_to_ref_doc_id=vector_ids["text_id_to_ref_doc_id"],
+        metadata_dict=vector_ids["metadata_dict"],
+    ))
+
+    storage_context = StorageContext.from_defaults(
+        docstore=docstore, index_store=index_store, vector_store=vector_store
+    )
+    return load_index_from_storage(storage_context)
@@ -0,0 +1,183 @@
+"""
+Local BM25 keyword index over email subjects, senders and bodies
+"""
+
+import math
+import os
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .embeddings import tokenize
+except ImportError:
+    # Fallback for when running as script
+    from embeddings import tokenize
+
+KEYWORD_INDEX_FILE = "keywords.npz"
+
+class KeywordIndex:
+    """Inverted index with BM25 scoring, updated one email at a time.
+
+    Exact tokens (invoice numbers, names, domains) that hashed embeddings
+    blur together are matched here. Each email gets an integer slot and
+    every term a NumPy array of (slot, term frequency) postings, so a query
+    term costs one vectorised pass over its postings. New postings are
+    buffered and merged into the arrays the first time the term is queried;
+    removed emails are only marked dead and dropped by ``compact``, which
+    runs once they outnumber the live ones.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._slot_of: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []  # slot -> email id, None once removed
+        self._lengths: List[int] = []
+        self._live_length = 0
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._arrays = None  # cached (alive mask, lengths) for scoring
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, email_id: str) -> bool:
+        return email_id in self._slot_of
+
+    def ids(self) -> List[str]:
+        return list(self._slot_of)
+
+    def add(self, email_id: str, text: str):
+        self.remove(email_id)
+        tokens = tokenize(text)
+        slot = len(self._ids)
+        self._slot_of[email_id] = slot
+        self._ids.append(email_id)
+        self._lengths.append(len(tokens))
+        self._live_length += len(tokens)
+        for term, count in Counter(tokens).items():
+            slots, counts = self._pending.setdefault(term, ([], []))
+            slots.append(slot)
+            counts.append(count)
+        self._arrays = None
+
+    def remove(self, email_id: str):
+        slot = self._slot_of.pop(email_id, None)
+        if slot is None:
+            return
+        self._ids[slot] = None
+        self._live_length -= self._lengths[slot]
+        self._arrays = None
+        if len(self._ids) - len(self._slot_of) > max(1000, len(self._slot_of)):
+            self.compact()
+
+    def retain(self, email_ids) -> int:
+        """Drop every email not in ``email_ids``, returning how many were removed"""
+        keep = set(email_ids)
+        stale = [email_id for email_id in self._slot_of if email_id not in keep]
+        for email_id in stale:
+            self.remove(email_id)
+        return len(stale)
+
+    def _term_postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        pending = self._pending.pop(term, None)
+        postings = self._postings.get(term)
+        if pending is not None:
+            slots, counts = np.asarray(pending[0], dtype=np.int64), np.asarray(pending[1], dtype=np.int64)
+            if postings is not None:
+                slots, counts = np.concatenate([postings[0], slots]), np.concatenate([postings[1], counts])
+            postings = self._postings[term] = (slots, counts)
+        return postings
+
+    def _scoring_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._arrays is None:
+            alive = np.fromiter((email_id is not None for email_id in self._ids), dtype=bool, count=len(self._ids))
+            self._arrays = (alive, np.asarray(self._lengths, dtype=np.float64))
+        return self._arrays
+
+    def search(self, query: str, limit: int = 10, allowed: Optional[set] = None) -> List[Tuple[str, float]]:
+        """Best ``(email_id, score)`` matches for ``query``, optionally restricted to ``allowed`` ids"""
+        if not self._slot_of:
+            return []
+        alive, lengths = self._scoring_arrays()
+        total = len(self._slot_of)
+        avg_length = self._live_length / total or 1.0
+        k1, b = self.k1, self.b
+
+        scores = np.zeros(len(self._ids))
+        for term in set(tokenize(query)):
+            postings = self._term_postings(term)
+            if postings is None:
+                continue
+            slots, counts = postings
+            frequency = np.count_nonzero(alive[slots])
+            if not frequency:
+                continue
+            idf = math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            scores[slots] += idf * counts * (k1 + 1) / (counts + k1 * (1 - b + b * lengths[slots] / avg_length))
+        scores[~alive] = 0.0
+
+        if allowed is None:
+            hits = np.flatnonzero(scores)
+        else:
+            hits = np.fromiter((self._slot_of[email_id] for email_id in allowed if email_id in self._slot_of),
+                               dtype=np.int64)
+            hits = hits[scores[hits] > 0]
+        if len(hits) > limit:
+            hits = hits[np.argpartition(-scores[hits], limit - 1)[:limit]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self._ids[slot], float(scores[slot])) for slot in hits]
+
+    def compact(self):
+        """Renumber slots without the removed emails and drop their postings"""
+        alive, _ = self._scoring_arrays()
+        remap = np.full(len(self._ids), -1, dtype=np.int64)
+        remap[alive] = np.arange(np.count_nonzero(alive))
+        for term in set(self._postings) | set(self._pending):
+            postings = self._term_postings(term)
+            keep = alive[postings[0]]
+            if keep.any():
+                self._postings[term] = (remap[postings[0][keep]], postings[1][keep])
+            else:
+                del self._postings[term]
+        self._ids = [email_id for email_id in self._ids if email_id is not None]
+        self._lengths = [length for length, live in zip(self._lengths, alive) if live]
+        self._slot_of = {email_id: slot for slot, email_id in enumerate(self._ids)}
+        self._arrays = None
+
+    def persist(self, path: str):
+        self.compact()
+        terms = list(self._postings)
+        slot_arrays = [self._postings[term][0] for term in terms]
+        count_arrays = [self._postings[term][1] for term in terms]
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            params=np.array([self.k1, self.b]),
+            ids=np.array(self._ids, dtype=str),
+            lengths=np.asarray(self._lengths, dtype=np.int32),
+            terms=np.array(terms, dtype=str),
+            offsets=np.cumsum([0] + [len(slots) for slots in slot_arrays]),
+            slots=np.concatenate(slot_arrays) if terms else np.zeros(0, dtype=np.int64),
+            counts=np.concatenate(count_arrays) if terms else np.zeros(0, dtype=np.int64),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "KeywordIndex":
+        """Load a saved index; a missing or unreadable file gives an empty one"""
+        try:
+            data = np.load(path)
+            index = cls(*data["params"].tolist())
+            index._ids = data["ids"].tolist()
+            index._lengths = data["lengths"].tolist()
+            slots, counts, offsets = data["slots"].astype(np.int64), data["counts"].astype(np.int64), data["offsets"]
+            for i, term in enumerate(data["terms"].tolist()):
+                index._postings[term] = (slots[offsets[i]:offsets[i + 1]], counts[offsets[i]:offsets[i + 1]])
+        except (OSError, ValueError, KeyError):
+            return cls()
+        index._slot_of = {email_id: slot for slot, email_id in enumerate(index._ids)}
+        index._live_length = sum(index._lengths)
+        return index
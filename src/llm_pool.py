@@ -0,0 +1,214 @@
+"""
+Concurrency, rate limiting and retries for LLM calls
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 0 disables a limit; the Gemini free tier allows 15 requests/minute
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 0))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("429", "RESOURCE_EXHAUSTED", "ResourceExhausted", "UNAVAILABLE", "503", "500 Internal")
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``per_minute``"""
+
+    def __init__(self, per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _take(self, amount):
+        """Take ``amount`` tokens if available and return 0, else return how long to wait"""
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount=1):
+        """Block until ``amount`` tokens are available, then take them"""
+        if self.rate <= 0:
+            return
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            self._sleep(wait)
+
+    async def acquire_async(self, amount=1):
+        """Like ``acquire``, but waits without blocking the event loop"""
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        requests_per_minute = LLM_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+        tokens_per_minute = LLM_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens=1):
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+    async def acquire_async(self, tokens=1):
+        await self.requests.acquire_async(1)
+        await self.tokens.acquire_async(tokens)
+
+def is_retryable(error):
+    """True for rate-limit (429) and server-side (5xx) failures"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        for attr in ("status_code", "code", "status"):
+            value = getattr(error, attr, None)
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    value = None
+            if isinstance(value, int) and value in RETRYABLE_STATUS:
+                return True
+        resp = getattr(error, "resp", None)
+        if getattr(resp, "status", None) in RETRYABLE_STATUS:
+            return True
+        if any(marker in str(error) for marker in RETRYABLE_MARKERS):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """Seconds to wait before retry number ``attempt + 1``: exponential, with equal jitter
+    (half the delay is kept, the rest randomized) so workers don't retry in lockstep"""
+    delay = min(max_delay, base_delay * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def call_with_retry(fn, max_retries=None, base_delay=1.0, max_delay=60.0, sleep=time.sleep):
+    """Call ``fn``, retrying retryable errors with jittered exponential backoff"""
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+
+async def call_with_retry_async(fn, max_retries=None, base_delay=1.0, max_delay=60.0):
+    """``call_with_retry`` for a coroutine function; backoff sleeps don't block the event loop"""
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+
+class RateLimitedLLM:
+    """Wraps a LangChain chat model so every invoke and stream, sync or async, is rate limited and retried.
+
+    Other attributes (``model``, ``stream``...) pass through to the wrapped model.
+    """
+
+    def __init__(self, llm, limiter=None, max_retries=None, base_delay=1.0):
+        self.llm = llm
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+    def invoke(self, prompt, **kwargs):
+        def attempt():
+            # Prompt size is a good enough proxy for tokens/minute accounting
+            self.limiter.acquire(len(str(prompt)) // 4 + 1)
+            return self.llm.invoke(prompt, **kwargs)
+
+        return call_with_retry(attempt, self.max_retries, self.base_delay)
+
+    def stream(self, prompt, **kwargs):
+        """Rate-limited ``llm.stream``; retried only until the first chunk arrives"""
+        def start():
+            self.limiter.acquire(len(str(prompt)) // 4 + 1)
+            chunks = iter(self.llm.stream(prompt, **kwargs))
+            return next(chunks, None), chunks
+
+        first, chunks = call_with_retry(start, self.max_retries, self.base_delay)
+        if first is not None:
+            yield first
+        yield from chunks
+
+    async def ainvoke(self, prompt, **kwargs):
+        async def attempt():
+            await self.limiter.acquire_async(len(str(prompt)) // 4 + 1)
+            return await self.llm.ainvoke(prompt, **kwargs)
+
+        return await call_with_retry_async(attempt, self.max_retries, self.base_delay)
+
+    async def astream(self, prompt, **kwargs):
+        """Rate-limited ``llm.astream``; retried only until the first chunk arrives"""
+        async def start():
+            await self.limiter.acquire_async(len(str(prompt)) // 4 + 1)
+            chunks = self.llm.astream(prompt, **kwargs).__aiter__()
+            try:
+                return await chunks.__anext__(), chunks
+            except StopAsyncIteration:
+                return None, None
+
+        first, chunks = await call_with_retry_async(start, self.max_retries, self.base_delay)
+        if first is None:
+            return
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+def run_in_pool(fn, items, max_workers=None):
+    """Apply ``fn`` to every item on a bounded thread pool.
+
+    Results come back in input order; an item whose call raised gets the exception instead.
+    """
+    max_workers = max(1, max_workers or LLM_MAX_CONCURRENCY)
+
+    def safe(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            return e
+
+    items = list(items)
+    if max_workers == 1 or len(items) <= 1:
+        return [safe(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(safe, items))
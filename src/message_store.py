@@ -0,0 +1,139 @@
+"""
+Local SQLite store of fetched Gmail messages, keyed by Gmail message ID
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+# SQLite's default limit on bound parameters per statement is 999
+_QUERY_CHUNK = 500
+
+class MessageStore:
+    """Persists parsed messages so they never have to be downloaded twice.
+
+    Each record holds the raw headers, the raw and decoded subject, the
+    plain-text body, Gmail's internal date (ms since epoch), the Gmail thread
+    id, the fetch time and the latest AI analysis. Records are plain dicts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Streamlit reruns the script on different threads, so share one guarded connection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    email_id TEXT PRIMARY KEY,
+                    headers TEXT NOT NULL,
+                    raw_subject TEXT,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    internal_date INTEGER NOT NULL DEFAULT 0,
+                    fetched_at REAL NOT NULL,
+                    analysis TEXT,
+                    thread_id TEXT
+                )
+            """)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(messages)")}
+            if "thread_id" not in columns:
+                # Stores created before thread ids were kept; those messages count as their own thread
+                self._conn.execute("ALTER TABLE messages ADD COLUMN thread_id TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS messages_by_date ON messages (internal_date DESC)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_by_thread ON messages (thread_id)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def get_many(self, email_ids: Iterable[str]) -> Dict[str, dict]:
+        """Return stored records for the given ids; missing ids are left out"""
+        email_ids = list(email_ids)
+        records = {}
+        with self._lock:
+            for start in range(0, len(email_ids), _QUERY_CHUNK):
+                chunk = email_ids[start:start + _QUERY_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT * FROM messages WHERE email_id IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for row in rows:
+                    records[row["email_id"]] = self._to_record(row)
+        return records
+
+    def get_threads(self, thread_ids: Iterable[str]) -> List[dict]:
+        """Every stored message of the given threads"""
+        thread_ids = list(thread_ids)
+        records = []
+        with self._lock:
+            for start in range(0, len(thread_ids), _QUERY_CHUNK):
+                chunk = thread_ids[start:start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT * FROM messages WHERE thread_id IN ({placeholders}) "
+                    f"OR (thread_id IS NULL AND email_id IN ({placeholders}))", chunk + chunk
+                )
+                records.extend(self._to_record(row) for row in rows)
+        return records
+
+    def recent(self, limit: Optional[int] = None, analyzed_only: bool = True) -> List[dict]:
+        """Newest records first, as Gmail lists them"""
+        sql = "SELECT * FROM messages"
+        if analyzed_only:
+            sql += " WHERE analysis IS NOT NULL"
+        sql += " ORDER BY internal_date DESC, rowid DESC"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            return [self._to_record(row) for row in self._conn.execute(sql, params)]
+
+    def put_many(self, records: Iterable[dict]):
+        """Insert or replace records in a single transaction"""
+        rows = [
+            (
+                record["email_id"],
+                json.dumps(record.get("headers", [])),
+                record.get("raw_subject"),
+                record["subject"],
+                record["body"],
+                record.get("internal_date", 0),
+                record["fetched_at"],
+                record.get("analysis"),
+                record.get("thread_id"),
+            )
+            for record in records
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (email_id, headers, raw_subject, subject, body, internal_date, "
+                "fetched_at, analysis, thread_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def set_analysis(self, email_id: str, analysis: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE messages SET analysis = ? WHERE email_id = ?", (analysis, email_id))
+
+    def delete_many(self, email_ids: Iterable[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM messages WHERE email_id = ?", [(i,) for i in email_ids])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_record(row: sqlite3.Row) -> dict:
+        record = dict(row)
+        record["headers"] = [tuple(header) for header in json.loads(record["headers"])]
+        record["thread_id"] = record["thread_id"] or record["email_id"]
+        return record
@@ -0,0 +1,87 @@
+"""
+Model limits and per-turn token accounting for chat prompts
+"""
+
+import os
+from collections import deque
+from typing import Optional, Tuple
+
+try:
+    from .gmail_summarizer import estimate_tokens
+except ImportError:
+    # Fallback for when running as script
+    from gmail_summarizer import estimate_tokens
+
+# (context window, max output tokens) by model name prefix; the longest matching prefix wins
+MODEL_LIMITS = {
+    "gemini-2.5": (1_048_576, 65_536),
+    "gemini-2.0-flash-lite": (1_048_576, 8_192),
+    "gemini-2.0": (1_048_576, 8_192),
+    "gemini-1.5-pro": (2_097_152, 8_192),
+    "gemini-1.5": (1_048_576, 8_192),
+    "gemini-1.0": (30_720, 2_048),
+}
+# Used for models not listed above
+DEFAULT_MODEL_LIMITS = (32_768, 2_048)
+
+# 0 takes the limit from MODEL_LIMITS
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", 0))
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", 0))
+# Target size of one chat prompt (system prompt + history + retrieved emails + question)
+CHAT_PROMPT_TOKENS = int(os.getenv("CHAT_PROMPT_TOKENS", 10000))
+CHAT_MEMORY_TOKENS = int(os.getenv("CHAT_MEMORY_TOKENS", 3000))
+
+def count_tokens(text: str) -> int:
+    """Token estimate used for every prompt budget decision (same heuristic as the retriever)"""
+    return estimate_tokens(text or "")
+
+def model_limits(model_name: str) -> Tuple[int, int]:
+    """``(context window, max output tokens)`` for a model name such as "models/gemini-2.0-flash" """
+    name = (model_name or "").lower().rsplit("/", 1)[-1]
+    matches = [prefix for prefix in MODEL_LIMITS if name.startswith(prefix)]
+    return MODEL_LIMITS[max(matches, key=len)] if matches else DEFAULT_MODEL_LIMITS
+
+class PromptBudget:
+    """Real model limits plus the token budget a chat turn is assembled against.
+
+    ``prompt_limit`` is the smaller of ``target_tokens`` and what the model
+    can take after reserving its output; retrieved context gets whatever
+    the fixed parts (system prompt, chat memory, question) leave of it.
+    ``log_turn`` prints and records the size of every prompt sent.
+    """
+
+    def __init__(self, model_name: str, context_window: Optional[int] = None, num_output: Optional[int] = None,
+                 target_tokens: Optional[int] = None, history: int = 200):
+        window, output = model_limits(model_name)
+        self.model_name = model_name
+        self.context_window = context_window or LLM_CONTEXT_WINDOW or window
+        self.num_output = num_output or LLM_MAX_OUTPUT_TOKENS or output
+        self.target_tokens = target_tokens or CHAT_PROMPT_TOKENS
+        self.turns = deque(maxlen=history)
+
+    @property
+    def prompt_limit(self) -> int:
+        return max(0, min(self.target_tokens, self.context_window - self.num_output))
+
+    def context_budget(self, *fixed_texts: str, reserved: int = 0, cap: Optional[int] = None) -> int:
+        """Tokens left for retrieved context after ``fixed_texts`` and ``reserved`` tokens, at most ``cap``"""
+        left = self.prompt_limit - reserved - sum(count_tokens(text) for text in fixed_texts)
+        return max(0, min(left, cap) if cap else left)
+
+    def log_turn(self, **parts: int) -> int:
+        """Record one turn's prompt size by part (e.g. system=..., history=..., context=...) and print it"""
+        total = sum(parts.values())
+        self.turns.append(dict(parts, total=total))
+        breakdown = " + ".join(f"{name} {tokens}" for name, tokens in parts.items())
+        print(f"🧮 Prompt tokens: {breakdown} = {total} / {self.prompt_limit}")
+        return total
+
+    def stats(self) -> dict:
+        totals = [turn["total"] for turn in self.turns]
+        return {
+            "turns": len(totals),
+            "avg_prompt_tokens": sum(totals) // len(totals) if totals else 0,
+            "max_prompt_tokens": max(totals, default=0),
+            "prompt_limit": self.prompt_limit,
+            "context_window": self.context_window,
+        }
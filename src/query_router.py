@@ -0,0 +1,78 @@
+"""
+Deterministic routing for structural questions (counts, listings, position lookups)
+that document metadata answers without an LLM round trip
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+try:
+    from .retrieval import parse_query_filters, strip_filters
+except ImportError:
+    # Fallback for when running as script
+    from retrieval import parse_query_filters, strip_filters
+
+# Asking for any of these needs the LLM, even when the question names specific emails
+_OPEN_ENDED = re.compile(
+    r"\b(reply|respond|response|draft|write|explain|why|should|help|suggest|compare|translate|"
+    r"action items?|mean|means|think|feel|tone)\b"
+)
+_COUNT = re.compile(r"\b(how many|count|number of)\b")
+_LIST = re.compile(r"^\s*(?:please\s+)?(?:list|show|give|display|find|which|what are|tell me)\b")
+_SUBJECTS = re.compile(r"\b(subjects?|titles?)\b")
+_EMAILS = re.compile(r"\b(e-?mails?|messages?|mails?)\b")
+_ALL = re.compile(r"\b(all|every)\b")
+_WORD = re.compile(r"[a-z0-9]+")
+# What a structural question is made of besides its filters; any other word is a topic
+# ("mention", "about", "invoice", a name) that only the chat engine can answer
+_STRUCTURE_WORDS = frozenset("""
+a all am an any are at can could count currently did do does e email emails every far find get give got have
+has had how i in inbox is it list mail mailbox mails many me message messages my now number of please
+processed received receive s show display so subject subjects tell the there title titles total ve
+what which you your
+""".split())
+
+def topic_words(query: str) -> List[str]:
+    """Words of ``query`` that are neither a filter nor part of asking for a count, listing or position"""
+    return [word for word in _WORD.findall(strip_filters(query)) if word not in _STRUCTURE_WORDS]
+
+def route_query(query: str) -> Optional[Tuple[str, dict]]:
+    """Classify a question as ``("count" | "list" | "show", filters)``, or None if it needs the LLM
+
+    "count" counts the emails matching the filters, "list" lists their
+    subjects and "show" displays the one email a position picks out
+    ("most recent", "oldest", "email #3"). Filters come from
+    parse_query_filters, and they have to cover the whole question: any
+    topic left over ("how many emails mention the invoice") goes to the LLM.
+    """
+    query_lower = query.lower().strip()
+    if _OPEN_ENDED.search(query_lower) or topic_words(query):
+        return None
+
+    filters = parse_query_filters(query)
+    filters.pop("wide", None)
+
+    if _COUNT.search(query_lower) and _EMAILS.search(query_lower):
+        return "count", filters
+
+    positions = filters.get("positions")
+    if filters.get("oldest") or (positions and positions[0] == positions[1]):
+        return "show", filters
+
+    if _LIST.search(query_lower) and (_SUBJECTS.search(query_lower) or _EMAILS.search(query_lower)):
+        # A bare "show me emails about X" is a search, which the LLM path handles
+        if filters or _SUBJECTS.search(query_lower) or _ALL.search(query_lower):
+            return "list", filters
+
+    return None
+
+def describe_filters(filters: dict) -> str:
+    """Human-readable suffix for a filtered count or listing, e.g. " from acme since 2024-05-01" """
+    parts = []
+    if "sender" in filters:
+        parts.append(f"from {filters['sender']}")
+    if "after" in filters:
+        parts.append(f"since {filters['after'][:10]}")
+    if "before" in filters:
+        parts.append(f"before {filters['before'][:10]}")
+    return (" " + " ".join(parts)) if parts else ""
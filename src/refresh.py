@@ -0,0 +1,156 @@
+"""
+Background refresh: the next document set and index are built off-thread and swapped in when ready
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    from .gmail_chatbot import GmailChatbot
+except ImportError:
+    # Fallback for when running as script
+    from gmail_chatbot import GmailChatbot
+
+# Seconds between automatic refreshes; 0 refreshes only on request
+REFRESH_INTERVAL_SECONDS = float(os.getenv("REFRESH_INTERVAL_SECONDS", 0))
+
+class BackgroundRefresher:
+    """Serves chats from one GmailChatbot snapshot while the next one is built on a worker thread.
+
+    Each refresh syncs, indexes and sets up a fresh snapshot (``new_snapshot``:
+    same data directory, stores and rate limits), so only new mail is fetched,
+    analyzed and embedded. When it is ready it replaces ``chatbot`` in a
+    single assignment; callers read ``chatbot`` once per request and keep
+    answering from the previous snapshot until then. A failed build leaves
+    the previous snapshot in place.
+    """
+
+    def __init__(self, chatbot: GmailChatbot, max_emails: Optional[int] = 20,
+                 interval: Optional[float] = None):
+        # Template for new snapshots; it serves chats itself if it is already set up
+        self._base = chatbot
+        self.chatbot: Optional[GmailChatbot] = chatbot if chatbot.chat_engine else None
+        self.max_emails = max_emails
+        self.interval = REFRESH_INTERVAL_SECONDS if interval is None else interval
+
+        self._lock = threading.Lock()
+        # Set by refresh() and stop() to wake the worker before the interval is up
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        # Notified after every build, for refresh(wait=True)
+        self._built = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+        self.state = "idle"
+        self.builds = 0
+        self.failures = 0
+        self.last_started: Optional[float] = None
+        self.last_finished: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self) -> "BackgroundRefresher":
+        """Start the worker thread (idempotent); with an interval it refreshes right away and then periodically"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gmail-refresh", daemon=True)
+            self._thread.start()
+        if self.interval > 0:
+            self._wake.set()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the worker after its current build, if any"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def refresh(self, max_emails: Optional[int] = None, wait: bool = False, timeout: Optional[float] = None) -> bool:
+        """Ask for a refresh; returns at once unless ``wait``, then returns whether a snapshot is being served
+
+        Requests made while a build is running are merged into one more build.
+        """
+        self.start()
+        with self._lock:
+            if max_emails is not None:
+                self.max_emails = max_emails
+            builds = self.builds + self.failures
+            self._wake.set()
+            if wait:
+                self._built.wait_for(lambda: self.builds + self.failures > builds, timeout)
+        return self.chatbot is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.chatbot is not None
+
+    def status(self) -> dict:
+        """Refresh state (idle, refreshing or failed), timings and the size of the snapshot being served"""
+        with self._lock:
+            status = {
+                "state": self.state,
+                "ready": self.chatbot is not None,
+                "builds": self.builds,
+                "failures": self.failures,
+                "last_started": self.last_started,
+                "last_finished": self.last_finished,
+                "last_duration": self.last_duration,
+                "last_error": self.last_error,
+                "emails": len(self.chatbot.documents) if self.chatbot else 0,
+                "interval": self.interval,
+            }
+        if status["state"] == "refreshing":
+            status["running_for"] = time.time() - status["last_started"]
+        elif self.interval > 0 and status["last_finished"]:
+            status["next_refresh_in"] = max(0.0, status["last_finished"] + self.interval - time.time())
+        return status
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval if self.interval > 0 else None)
+            if self._stop.is_set():
+                break
+            self._wake.clear()
+            self._build()
+
+    def _build(self):
+        with self._lock:
+            self.state = "refreshing"
+            self.last_started = time.time()
+            max_emails = self.max_emails
+        start = time.perf_counter()
+        print("🔄 Refreshing in the background...")
+
+        error = None
+        try:
+            current = self.chatbot
+            snapshot = (current or self._base).new_snapshot()
+            if not (snapshot.sync_emails(max_emails=max_emails) and snapshot.build_index()
+                    and snapshot.setup_chat_engine()):
+                raise RuntimeError("refresh failed, see the log above")
+            if current is not None:
+                snapshot.adopt_conversations(current)
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            self.last_duration = time.perf_counter() - start
+            self.last_finished = time.time()
+            if error is None:
+                # The swap: requests already running finish on the old snapshot, new ones get this one
+                self.chatbot = snapshot
+                self.builds += 1
+                self.state = "idle"
+                self.last_error = None
+                print(f"✅ Refreshed {len(snapshot.documents)} emails in {self.last_duration:.1f}s")
+            else:
+                self.failures += 1
+                self.state = "failed"
+                self.last_error = error
+                print(f"❌ Background refresh failed, still serving the previous snapshot: {error}")
+            self._built.notify_all()
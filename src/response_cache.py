@@ -0,0 +1,87 @@
+"""
+In-memory cache of chat answers with LRU and TTL eviction
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", 256))
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", 3600))
+
+def normalize_query(query: str) -> str:
+    """Case, punctuation and spacing don't change the answer: "Summarize all my emails!" == "summarize all my emails" """
+    return " ".join(re.sub(r"[^\w#\s]", " ", query.lower()).split())
+
+# Words that point back at earlier turns; answers to such questions depend on the conversation
+_FOLLOW_UP = re.compile(
+    r"\b(it|its|this|that|these|those|them|they|he|she|his|her|above|previous|earlier|again|"
+    r"more|also|else|same|one|reply|respond|back)\b"
+)
+
+def is_follow_up(query: str) -> bool:
+    return bool(_FOLLOW_UP.search(query.lower()))
+
+def conversation_hash(messages: Iterable) -> str:
+    """Digest of a chat history (LlamaIndex ChatMessages), for answers that depend on earlier turns"""
+    digest = hashlib.sha256()
+    for message in messages:
+        data = f"{message.role}\x00{message.content}".encode("utf-8", errors="surrogatepass")
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+class ResponseCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl_seconds``.
+
+    Keys are tuples built by the caller; ``hits`` and ``misses`` count
+    lookups since the cache was created.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None, clock=time.monotonic):
+        self.max_entries = max_entries or CHAT_CACHE_MAX_ENTRIES
+        self.ttl = ttl_seconds or CHAT_CACHE_TTL_SECONDS
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._clock() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value: str):
+        with self._lock:
+            self._entries[key] = (value, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,267 @@
+"""
+Bounded retrieval for the chat engine: metadata pre-filters, hybrid vector + BM25 ranking, top-k and a context token budget
+"""
+
+import os
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+try:
+    from .facets import DEFAULT_FACETS, FACET_SYNONYMS, match_facet
+    from .gmail_summarizer import estimate_tokens
+except ImportError:
+    # Fallback for when running as script
+    from facets import DEFAULT_FACETS, FACET_SYNONYMS, match_facet
+    from gmail_summarizer import estimate_tokens
+
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", 8))
+# Used instead of CHAT_TOP_K for questions about the whole mailbox ("summarize", "any", "every"...)
+CHAT_WIDE_TOP_K = int(os.getenv("CHAT_WIDE_TOP_K", 40))
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 6000))
+# Reciprocal rank fusion constant: higher values flatten the gap between top and lower ranks
+RRF_K = 60
+
+# GmailChatbot.chat puts its instructions before this marker; retrieval only looks at what follows
+QUERY_MARKER = "USER QUERY: "
+
+_WIDE = re.compile(r"\b(all|any|every|each|overview|overall|summari[sz]e|summary|across|trends?)\b")
+_EMAIL_NUMBER = re.compile(r"\bemail\s*(?:#|number|no\.?)\s*(\d+)\b")
+_NEWEST_N = re.compile(r"\b(?:last|latest|recent|newest)\s+(\d+)\s+(?:emails?|messages?)\b")
+_NEWEST = re.compile(r"\b(?:most recent|latest|newest|last)\s+(?:email|message)\b")
+_OLDEST = re.compile(r"\b(?:oldest|earliest|first)\s+(?:email|message)\b")
+_PAST_N = re.compile(r"\b(?:last|past)\s+(\d+)\s+(day|week|month)s?\b")
+_PAST_ONE = re.compile(r"\b(?:last|past)\s+(day|week|month)\b")
+_SINCE = re.compile(r"\b(?:since|after)\s+(\d{4}-\d{2}-\d{2})\b")
+_UNTIL = re.compile(r"\b(?:before|until)\s+(\d{4}-\d{2}-\d{2})\b")
+_SENDER = re.compile(r"\bfrom\s+([\w.+-]+(?:@[\w.-]+)?)")
+_NOT_SENDERS = {
+    "a", "an", "the", "my", "me", "this", "that", "last", "past", "today", "yesterday", "any",
+    "all", "each", "every", "anyone", "someone", "email", "emails", "inbox", "work", "home",
+}
+_DAYS = re.compile(r"\b(?:today|yesterday|this week)\b")
+# Facet words parse_query_filters filters on ("other"/"normal" are not among them), longest first
+_FACET_WORDS = re.compile(r"\b(?:" + "|".join(sorted(
+    (re.escape(word) for field, values in FACET_SYNONYMS.items() for value, words in values.items()
+     if value != DEFAULT_FACETS[field] for word in words),
+    key=len, reverse=True,
+)) + r")\b")
+_UNIT_DAYS = {"day": 1, "week": 7, "month": 30}
+
+def parse_query_filters(query: str, now: Optional[datetime] = None) -> dict:
+    """Turn the metadata constraints a question mentions into retrieval filters
+
+    Recognises email positions ("email #3", "last 5 emails", "oldest email"),
+    dates ("today", "past 2 weeks", "since 2024-05-01"), a sender ("from acme")
+    and a category or priority. Returns only the keys found, plus ``wide``
+    when the question is about the mailbox as a whole.
+    """
+    query_lower = query.lower()
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    filters = {}
+
+    match = _EMAIL_NUMBER.search(query_lower)
+    newest_n = _NEWEST_N.search(query_lower)
+    if match:
+        filters["positions"] = (int(match.group(1)), int(match.group(1)))
+    elif newest_n:
+        filters["positions"] = (1, int(newest_n.group(1)))
+    elif _NEWEST.search(query_lower):
+        filters["positions"] = (1, 1)
+    elif _OLDEST.search(query_lower):
+        filters["oldest"] = True
+
+    if re.search(r"\btoday\b", query_lower):
+        filters["after"] = today
+    elif re.search(r"\byesterday\b", query_lower):
+        filters["after"], filters["before"] = today - timedelta(days=1), today
+    elif re.search(r"\bthis week\b", query_lower):
+        filters["after"] = today - timedelta(days=today.weekday())
+    else:
+        past_n, past_one = _PAST_N.search(query_lower), _PAST_ONE.search(query_lower)
+        if past_n:
+            filters["after"] = now - timedelta(days=int(past_n.group(1)) * _UNIT_DAYS[past_n.group(2)])
+        elif past_one:
+            filters["after"] = now - timedelta(days=_UNIT_DAYS[past_one.group(1)])
+    for key, pattern in (("after", _SINCE), ("before", _UNTIL)):
+        match = pattern.search(query_lower)
+        if match:
+            filters[key] = datetime.strptime(match.group(1), "%Y-%m-%d")
+    for key in ("after", "before"):
+        if key in filters:
+            # Same format as the "email_date" metadata, so plain string comparison works
+            filters[key] = filters[key].isoformat(timespec="seconds")
+
+    match = _SENDER.search(query_lower)
+    if match and _is_sender(match.group(1)):
+        filters["sender"] = match.group(1)
+
+    facet = match_facet(query)
+    # "other"/"normal" are too common as plain words to filter on
+    if facet and DEFAULT_FACETS[facet[0]] != facet[1]:
+        filters[facet[0]] = facet[1]
+
+    if _WIDE.search(query_lower):
+        filters["wide"] = True
+    return filters
+
+def _is_sender(word: str) -> bool:
+    return word not in _NOT_SENDERS and not word.isdigit()
+
+def strip_filters(query: str) -> str:
+    """``query`` lowercased, with every phrase parse_query_filters turns into a filter blanked out"""
+    text = _SENDER.sub(lambda match: " " if _is_sender(match.group(1)) else match.group(0), query.lower())
+    for pattern in (_EMAIL_NUMBER, _NEWEST_N, _NEWEST, _OLDEST, _PAST_N, _PAST_ONE, _SINCE, _UNTIL, _DAYS, _FACET_WORDS):
+        text = pattern.sub(" ", text)
+    return text
+
+def position_ids(filters: dict, date_index) -> Optional[List[str]]:
+    """Ids the position filters ("email #3", "last 5 emails", "oldest email") pick from a DateIndex, or None"""
+    if "positions" in filters:
+        return date_index.ids(*filters["positions"])
+    if filters.get("oldest"):
+        return date_index.ids(len(date_index)) if len(date_index) else []
+    return None
+
+def metadata_matches(metadata: dict, filters: dict) -> bool:
+    """True if one email's metadata satisfies filters from parse_query_filters
+
+    Positions are not metadata: resolve them with position_ids first.
+    ``wide`` is ignored.
+    """
+    date = metadata.get("email_date", "")
+    if "after" in filters and date < filters["after"]:
+        return False
+    if "before" in filters and not (date and date < filters["before"]):
+        return False
+    for field in DEFAULT_FACETS:
+        if field in filters and metadata.get(field) != filters[field]:
+            return False
+    if "sender" in filters and filters["sender"] not in metadata.get("sender", "").lower():
+        return False
+    return True
+
+class EmailRetriever(BaseRetriever):
+    """Hybrid vector + BM25 search over the email index, pre-filtered on metadata and capped by a token budget
+
+    Embeddings are read from the index's SimpleVectorStore into one NumPy
+    matrix, rebuilt only when the index changes, so a query is a single
+    matrix-vector product whatever the mailbox size. When a keyword index
+    is given, its BM25 ranking is merged with the vector ranking by
+    reciprocal rank fusion, so exact tokens (names, invoice numbers) count.
+    Retrieved nodes are added best-first until ``token_budget`` tokens of
+    context are used. Position filters are resolved against ``date_index``
+    at query time, since documents carry no position.
+    """
+
+    def __init__(self, index, embed_model, keyword_index=None, top_k: Optional[int] = None,
+                 wide_top_k: Optional[int] = None, token_budget: Optional[int] = None, date_index=None):
+        super().__init__()
+        self.index = index
+        self.embed_model = embed_model
+        self.keyword_index = keyword_index
+        self.date_index = date_index
+        self.top_k = top_k or CHAT_TOP_K
+        self.wide_top_k = wide_top_k or CHAT_WIDE_TOP_K
+        self.token_budget = token_budget or CHAT_CONTEXT_TOKENS
+        # Filters and context size of the last retrieval, for logging
+        self.last_filters = {}
+        self.last_context_tokens = 0
+        self._fingerprint = None
+
+    def _load_vectors(self):
+        """(Re)build the matrix and per-row metadata arrays when the vector store changed"""
+        data = self.index.vector_store.data
+        embeddings = data.embedding_dict
+        # Inserts, deletes and updates all change the size or the last-inserted id
+        fingerprint = (id(embeddings), len(embeddings), next(reversed(embeddings), None))
+        if fingerprint == self._fingerprint:
+            return
+
+        self.node_ids = list(embeddings)
+        matrix = np.asarray([embeddings[node_id] for node_id in self.node_ids], dtype=np.float32)
+        matrix = matrix.reshape(len(self.node_ids), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+        self.ref_ids = np.array([data.text_id_to_ref_doc_id.get(node_id, "") for node_id in self.node_ids], dtype=str)
+        metadata = [data.metadata_dict.get(node_id, {}) for node_id in self.node_ids]
+        self.dates = np.array([m.get("email_date", "") for m in metadata], dtype=str)
+        self.senders = np.array([m.get("sender", "").lower() for m in metadata], dtype=str)
+        self.facet_values = {
+            field: np.array([m.get(field, "") for m in metadata], dtype=str) for field in DEFAULT_FACETS
+        }
+        self._fingerprint = fingerprint
+
+    def _filter_mask(self, filters: dict) -> np.ndarray:
+        mask = np.ones(len(self.node_ids), dtype=bool)
+        selected = position_ids(filters, self.date_index) if self.date_index is not None else None
+        if selected is not None:
+            mask &= np.isin(self.ref_ids, selected)
+        if "after" in filters:
+            mask &= self.dates >= filters["after"]
+        if "before" in filters:
+            mask &= (self.dates < filters["before"]) & (self.dates != "")
+        for field in DEFAULT_FACETS:
+            if field in filters:
+                mask &= self.facet_values[field] == filters[field]
+        if "sender" in filters:
+            sender_mask = mask & (np.char.find(self.senders, filters["sender"]) >= 0)
+            # "from" is often not followed by a sender ("from the bank"); ignore it if nothing matches
+            if sender_mask.any():
+                mask = sender_mask
+            else:
+                filters.pop("sender")
+        return mask
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        query = query_bundle.query_str.rsplit(QUERY_MARKER, 1)[-1].strip()
+        self._load_vectors()
+        filters = parse_query_filters(query)
+        candidates = np.flatnonzero(self._filter_mask(filters))
+        self.last_filters = filters
+        self.last_context_tokens = 0
+        if not len(candidates):
+            return []
+
+        query_vector = np.asarray(self.embed_model.get_query_embedding(query), dtype=np.float32)
+        scores = self.matrix[candidates] @ query_vector
+        top_k = min(self.wide_top_k if filters.get("wide") else self.top_k, len(candidates))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        ranked = [(int(i), float(scores[i])) for i in best]
+        if self.keyword_index is not None:
+            ranked = self._fuse(query, ranked, candidates, scores, top_k)
+
+        nodes = self.index.docstore.get_nodes([self.node_ids[candidates[i]] for i, _ in ranked])
+        results = []
+        for node, (_, score) in zip(nodes, ranked):
+            tokens = estimate_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+            # The best match is always kept, even if it alone exceeds the budget
+            if results and self.last_context_tokens + tokens > self.token_budget:
+                break
+            results.append(NodeWithScore(node=node, score=score))
+            self.last_context_tokens += tokens
+        return results
+
+    def _fuse(self, query: str, ranked: list, candidates: np.ndarray, scores: np.ndarray, top_k: int) -> list:
+        """Merge vector and BM25 rankings by reciprocal rank fusion, as (candidate index, score) pairs"""
+        candidate_refs = self.ref_ids[candidates]
+        allowed = None if len(candidates) == len(self.node_ids) else set(candidate_refs.tolist())
+        keyword_hits = self.keyword_index.search(query, limit=top_k, allowed=allowed)
+
+        fused = {}
+        for rank, (i, _) in enumerate(ranked):
+            fused[i] = 1.0 / (RRF_K + rank + 1)
+        for rank, (email_id, _) in enumerate(keyword_hits):
+            # An email can have several nodes; credit the one closest to the query
+            rows = np.flatnonzero(candidate_refs == email_id)
+            if len(rows):
+                i = int(rows[np.argmax(scores[rows])])
+                fused[i] = fused.get(i, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(fused.items(), key=lambda item: -item[1])[:top_k]
@@ -13,6 +13,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # Import with absolute path to avoid relative import issues
 import gmail_chatbot
 GmailChatbot = gmail_chatbot.GmailChatbot
+from summaries import SUMMARY_PAGE_SIZE
+from refresh import BackgroundRefresher
 
 # Configure Streamlit page
 st.set_page_config(
@@ -227,37 +229,68 @@ def initialize_chatbot():
     """Initialize the Gmail chatbot and cache it"""
     return GmailChatbot()
 
-@st.cache_data
-def load_emails(_chatbot, max_emails=10):
-    """Load and process emails with caching"""
-    if _chatbot.fetch_and_process_emails(max_emails=max_emails):
-        if _chatbot.build_index():
-            if _chatbot.setup_chat_engine():
-                return True, _chatbot.get_email_stats(), _chatbot.get_all_emails_summary()
-    return False, None, None
+@st.cache_resource
+def initialize_refresher():
+    """Background refresher around the cached chatbot; loads and re-indexes emails off the script thread"""
+    return BackgroundRefresher(initialize_chatbot()).start()
+
+def load_emails(refresher, max_emails=10, wait=False):
+    """Ask for a refresh, syncing only what changed since the previous load
+    
+    Only the very first load waits for the build; afterwards chats keep being
+    answered from the current snapshot until the new one is swapped in.
+    """
+    if refresher.refresh(max_emails=max_emails, wait=wait):
+        return True, refresher.chatbot.get_email_stats()
+    return False, None
+
+def adopt_snapshot(refresher):
+    """Point the session at the snapshot the refresher is serving, recomputing stats after a swap"""
+    chatbot = refresher.chatbot
+    if chatbot is not None and chatbot is not st.session_state.chatbot:
+        st.session_state.chatbot = chatbot
+        st.session_state.stats = chatbot.get_email_stats()
+        st.session_state.emails_loaded = True
+        st.session_state.summary_page = 0
+
+def render_refresh_status(refresher):
+    status = refresher.status()
+    if status["state"] == "refreshing":
+        st.info(f"🔄 Refreshing in the background ({status['running_for']:.0f}s), still answering from the current emails")
+    elif status["state"] == "failed":
+        st.warning(f"⚠️ Last refresh failed, still using the previous emails: {status['last_error']}")
+    if status["last_duration"] is not None:
+        finished = datetime.fromtimestamp(status["last_finished"]).strftime("%H:%M:%S")
+        st.caption(f"Last build: {status['last_duration']:.1f}s, finished at {finished}")
+    if "next_refresh_in" in status:
+        st.caption(f"Next automatic refresh in {status['next_refresh_in'] / 60:.0f} min")
+
+def stream_response(chatbot, query):
+    """Show the user's message, then render the answer token by token as it is generated"""
+    st.markdown(f"""
+    <div class="chat-message user-message fade-in">
+        <strong>You:</strong> {query}
+    </div>
+    """, unsafe_allow_html=True)
+    
+    placeholder = st.empty()
+    response = ""
+    for delta in chatbot.stream_chat(query):
+        response += delta
+        placeholder.markdown(f"""
+        <div class="chat-message bot-message">
+            <strong>🤖 Assistant:</strong> {response}▌
+        </div>
+        """, unsafe_allow_html=True)
+    return response
 
 def create_email_analytics(stats):
     """Create analytics visualizations for emails"""
     
-    # Email categories analysis (mock data based on subjects)
+    # Categories come from the chatbot's facet index (parsed from each email's AI analysis)
     subjects = stats.get('all_subjects', [])
-    categories = []
-    
-    for subject in subjects:
-        subject_lower = subject.lower()
-        if any(word in subject_lower for word in ['job', 'intern', 'career', 'linkedin']):
-            categories.append('Work/Career')
-        elif any(word in subject_lower for word in ['course', 'skill', 'learn', 'certificate']):
-            categories.append('Education')
-        elif any(word in subject_lower for word in ['patch', 'product', 'offer']):
-            categories.append('Marketing')
-        elif any(word in subject_lower for word in ['event', 'live', 'watch']):
-            categories.append('Entertainment')
-        else:
-            categories.append('Other')
-    
-    # Create category distribution chart
-    category_counts = pd.Series(categories).value_counts()
+    categories = stats.get('email_categories', [])
+    category_counts = pd.Series(stats.get('category_counts', {}))
     
     fig_pie = px.pie(
         values=category_counts.values,
@@ -284,6 +317,46 @@ def create_email_analytics(stats):
     
     return fig_pie, fig_timeline
 
+def render_email_list(chatbot, stats):
+    """One page of precomputed email summaries, with category/priority/text filters"""
+    filter_col1, filter_col2, filter_col3 = st.columns(3)
+    with filter_col1:
+        category = st.selectbox("Category", ["All"] + list(stats.get('category_counts', {})), key="summary_category")
+    with filter_col2:
+        priority = st.selectbox("Priority", ["All"] + list(stats.get('priority_counts', {})), key="summary_priority")
+    with filter_col3:
+        text = st.text_input("Search subjects", key="summary_text")
+    
+    filters = {
+        "category": None if category == "All" else category,
+        "priority": None if priority == "All" else priority,
+        "text": text or None,
+    }
+    if filters != st.session_state.get('summary_filters'):
+        st.session_state.summary_filters = filters
+        st.session_state.summary_page = 0
+    
+    page_size = SUMMARY_PAGE_SIZE
+    page = chatbot.list_email_summaries(offset=st.session_state.summary_page * page_size, limit=page_size, **filters)
+    if not page['items']:
+        st.markdown("*No emails match these filters.*")
+    for item in page['items']:
+        st.markdown(f"**{item['position']}. {item['subject']}**  \n"
+                    + (f"{item['headline']}  \n" if item['headline'] else "")
+                    + f"*Email ID: {item['email_id']}*")
+    
+    prev_col, info_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if st.button("⬅️ Previous", disabled=st.session_state.summary_page == 0, key="summary_prev"):
+            st.session_state.summary_page -= 1
+            st.rerun()
+    with info_col:
+        st.caption(f"Page {st.session_state.summary_page + 1} · {page['total']} emails in total")
+    with next_col:
+        if st.button("Next ➡️", disabled=not page['has_more'], key="summary_next"):
+            st.session_state.summary_page += 1
+            st.rerun()
+
 def main():
     # Header with welcome message
     st.markdown('<h1 class="main-header">📧 Gmail Q&A Chatbot</h1>', unsafe_allow_html=True)
@@ -294,7 +367,12 @@ def main():
         st.session_state.emails_loaded = False
         st.session_state.chat_history = []
         st.session_state.stats = None
-        st.session_state.email_summary = None
+        st.session_state.summary_page = 0
+        st.session_state.refresher = None
+    
+    # Serve every rerun from the latest snapshot the background refresher has swapped in
+    if st.session_state.refresher is not None:
+        adopt_snapshot(st.session_state.refresher)
     
     # Welcome card for new users
     if not st.session_state.emails_loaded:
@@ -333,20 +411,26 @@ def main():
         with load_col1:
             if st.button("🔄 **Load Gmail Data**", type="primary", use_container_width=True):
                 with st.spinner("🤖 Initializing AI assistant..."):
-                    st.session_state.chatbot = initialize_chatbot()
+                    st.session_state.refresher = initialize_refresher()
                 
-                with st.spinner("📧 Fetching and analyzing your emails..."):
-                    success, stats, summary = load_emails(st.session_state.chatbot, max_emails)
+                if st.session_state.emails_loaded:
+                    # Chats keep using the current emails; the new snapshot is picked up on a later rerun
+                    load_emails(st.session_state.refresher, max_emails)
+                    st.toast("🔄 Refreshing your emails in the background...")
+                else:
+                    with st.spinner("📧 Fetching and analyzing your emails..."):
+                        success, stats = load_emails(st.session_state.refresher, max_emails, wait=True)
                     
                     if success:
-                        st.session_state.emails_loaded = True
-                        st.session_state.stats = stats
-                        st.session_state.email_summary = summary
+                        adopt_snapshot(st.session_state.refresher)
                         st.balloons()  # Celebrate success!
                         st.success(f"🎉 Successfully loaded {stats['total_emails']} emails!")
                     else:
                         st.error("❌ Failed to load emails. Please check your Gmail setup and try again.")
         
+        if st.session_state.refresher is not None:
+            render_refresh_status(st.session_state.refresher)
+        
         st.markdown("---")
         
         # Status section with better visual indicators
@@ -357,7 +441,8 @@ def main():
                 <div class="status-success">✅ Chatbot Ready</div>
                 <div style="margin-top: 0.5rem;">
                     📧 <strong>{st.session_state.stats['total_emails']}</strong> emails loaded<br>
-                    🧠 AI assistant is ready to chat
+                    🧠 AI assistant is ready to chat<br>
+                    ⚡ {st.session_state.chatbot.response_cache.stats()['hit_rate']:.0%} of answers served from cache
                 </div>
             </div>
             """, unsafe_allow_html=True)
@@ -502,22 +587,21 @@ def main():
                 # Add user message to history
                 st.session_state.chat_history.append({"role": "user", "content": query})
                 
-                # Get response from chatbot with better feedback
-                with st.spinner("🤔 Analyzing your emails..."):
-                    try:
-                        response = st.session_state.chatbot.chat(query)
+                # Stream the response from the chatbot as it is generated
+                try:
+                    response = stream_response(st.session_state.chatbot, query)
+                    
+                    # Ensure response is not empty
+                    if response and response.strip():
+                        st.session_state.chat_history.append({"role": "assistant", "content": response})
+                    else:
+                        fallback_msg = "I'm sorry, I couldn't generate a proper response to your question. Could you please try asking in a different way? For example, try asking 'What is my most recent email?' or 'Show me a summary of my emails.'"
+                        st.session_state.chat_history.append({"role": "assistant", "content": fallback_msg})
                         
-                        # Ensure response is not empty
-                        if response and response.strip():
-                            st.session_state.chat_history.append({"role": "assistant", "content": response})
-                        else:
-                            fallback_msg = "I'm sorry, I couldn't generate a proper response to your question. Could you please try asking in a different way? For example, try asking 'What is my most recent email?' or 'Show me a summary of my emails.'"
-                            st.session_state.chat_history.append({"role": "assistant", "content": fallback_msg})
-                            
-                    except Exception as e:
-                        error_msg = f"I apologize, but I encountered an issue while processing your request. This might be due to API limits or a temporary connection issue. Please try again in a moment, or try asking a simpler question like 'What emails did I receive?'"
-                        st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
-                        st.error(f"Technical details: {str(e)}")
+                except Exception as e:
+                    error_msg = f"I apologize, but I encountered an issue while processing your request. This might be due to API limits or a temporary connection issue. Please try again in a moment, or try asking a simpler question like 'What emails did I receive?'"
+                    st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
+                    st.error(f"Technical details: {str(e)}")
                 
                 st.rerun()
             
@@ -541,9 +625,8 @@ def main():
                     if st.button(label, key=f"suggestion_{i}", use_container_width=True):
                         # Trigger the suggestion as if user typed it
                         st.session_state.chat_history.append({"role": "user", "content": suggestion})
-                        with st.spinner("🤔 Analyzing..."):
-                            response = st.session_state.chatbot.chat(suggestion)
-                            st.session_state.chat_history.append({"role": "assistant", "content": response})
+                        response = stream_response(st.session_state.chatbot, suggestion)
+                        st.session_state.chat_history.append({"role": "assistant", "content": response})
                         st.rerun()
     
     with col2:
@@ -609,20 +692,8 @@ def main():
             # Detailed email list with better presentation
             st.markdown("---")
             with st.expander("📝 **View All Email Details**", expanded=False):
-                # Format the email summary better
                 st.markdown("**Complete Email List:**")
-                if st.session_state.email_summary:
-                    # Split and format the summary
-                    lines = st.session_state.email_summary.split('\n')
-                    formatted_summary = ""
-                    for line in lines:
-                        if line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '10.')):
-                            formatted_summary += f"\n**{line}**\n"
-                        elif line.strip().startswith('Email ID:'):
-                            formatted_summary += f"*{line}*\n"
-                        else:
-                            formatted_summary += f"{line}\n"
-                    st.markdown(formatted_summary)
+                render_email_list(st.session_state.chatbot, stats)
         else:
             # Better placeholder when no emails loaded
             st.markdown("""
@@ -0,0 +1,117 @@
+"""
+Precomputed one-line email summaries served a page at a time
+"""
+
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+# Emails per page of "summarize all emails" and the Streamlit email list
+SUMMARY_PAGE_SIZE = int(os.getenv("SUMMARY_PAGE_SIZE", 50))
+# Longest one-line analysis kept per email
+SUMMARY_HEADLINE_CHARS = 200
+
+class EmailSummary(NamedTuple):
+    email_id: str
+    subject: str
+    sender: str
+    email_date: str
+    category: str
+    priority: str
+    headline: str
+
+def headline(analysis: str) -> str:
+    """First non-empty line of an analysis, without markdown emphasis, cut at SUMMARY_HEADLINE_CHARS"""
+    for line in (analysis or "").splitlines():
+        line = line.strip().strip("*#-• ").strip()
+        if line:
+            return line[:SUMMARY_HEADLINE_CHARS]
+    return ""
+
+def summary_from_metadata(email_id: str, metadata: dict) -> EmailSummary:
+    return EmailSummary(
+        email_id=email_id,
+        subject=metadata.get("subject", "Unknown Subject"),
+        sender=metadata.get("sender", ""),
+        email_date=metadata.get("email_date", ""),
+        category=metadata.get("category", "Other"),
+        priority=metadata.get("priority", "Normal"),
+        headline=headline(metadata.get("analysis", "")),
+    )
+
+class SummaryIndex:
+    """One EmailSummary per email, in document order (position 1 = most recent).
+
+    Summaries are built once, when an email is added; ``page`` slices them
+    without touching document text, and filters are applied in a single
+    pass that stops as soon as the page is full.
+    """
+
+    def __init__(self):
+        self._summaries: Dict[str, EmailSummary] = {}
+        self._order: List[str] = []
+
+    @classmethod
+    def from_documents(cls, documents: Iterable) -> "SummaryIndex":
+        index = cls()
+        for doc in documents:
+            index.add(doc.doc_id, doc.metadata)
+        index.set_order(doc.doc_id for doc in documents)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def add(self, email_id: str, metadata: dict):
+        """Store (or replace) an email's summary; call ``set_order`` once the document list is final"""
+        self._summaries[email_id] = summary_from_metadata(email_id, metadata)
+
+    def set_order(self, email_ids: Iterable[str]):
+        """Adopt the document order, forgetting emails that are no longer listed"""
+        self._order = list(email_ids)
+        if len(self._summaries) != len(self._order):
+            listed = set(self._order)
+            self._summaries = {email_id: summary for email_id, summary in self._summaries.items()
+                               if email_id in listed}
+
+    def iter(self, category: Optional[str] = None, priority: Optional[str] = None,
+             sender: Optional[str] = None, text: Optional[str] = None) -> Iterator[dict]:
+        """Summaries matching every given filter, most recent first, each with its ``position``
+
+        ``category`` and ``priority`` must match exactly; ``sender`` and
+        ``text`` (subject or analysis line) are case-insensitive substrings.
+        """
+        sender = sender.lower() if sender else None
+        text = text.lower() if text else None
+        for position, email_id in enumerate(self._order, 1):
+            summary = self._summaries[email_id]
+            if category and summary.category != category:
+                continue
+            if priority and summary.priority != priority:
+                continue
+            if sender and sender not in summary.sender.lower():
+                continue
+            if text and text not in summary.subject.lower() and text not in summary.headline.lower():
+                continue
+            yield dict(summary._asdict(), position=position)
+
+    def page(self, offset: int = 0, limit: Optional[int] = None, **filters) -> dict:
+        """``limit`` matching summaries from ``offset`` on, plus whether more follow
+
+        Without filters the page is a plain slice; ``total`` is always the
+        number of emails, ``has_more`` tells whether a next page exists.
+        """
+        limit = limit or SUMMARY_PAGE_SIZE
+        offset = max(0, offset)
+        if not any(filters.values()):
+            items = [
+                dict(self._summaries[email_id]._asdict(), position=position)
+                for position, email_id in enumerate(self._order[offset:offset + limit], offset + 1)
+            ]
+            has_more = offset + limit < len(self._order)
+        else:
+            matches = self.iter(**filters)
+            for _ in zip(range(offset), matches):
+                pass
+            items = [item for _, item in zip(range(limit), matches)]
+            has_more = next(matches, None) is not None
+        return {"total": len(self._order), "offset": offset, "limit": limit, "items": items, "has_more": has_more}
@@ -59,9 +59,8 @@ def test_email_indexing():
     for i, doc in enumerate(chatbot.documents[:3]):  # Show first 3
         print(f"Document {i+1}:")
         print(f"  Subject: {doc.metadata.get('subject', 'Unknown')}")
-        print(f"  Position: {doc.metadata.get('email_position', 'Unknown')}")
-        print(f"  Is Most Recent: {doc.metadata.get('is_most_recent', False)}")
-        print(f"  Total Emails: {doc.metadata.get('total_emails', 'Unknown')}")
+        print(f"  Date: {doc.metadata.get('email_date', 'Unknown')}")
+        print(f"  Position: {chatbot.date_index.rank(doc.doc_id)} of {len(chatbot.date_index)}")
         print()
 
 if __name__ == "__main__":
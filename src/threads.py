@@ -0,0 +1,105 @@
+"""
+Thread-aware ingestion: strips quoted history and signatures from replies
+and collapses each Gmail thread into one indexable record
+"""
+
+import re
+from typing import Dict, Iterable, List
+
+# "On Mon, 1 Jan 2024 at 10:00, Alice <alice@example.com> wrote:" (clients wrap it over up to 3 lines)
+_ATTRIBUTION = re.compile(r"^On\b(?:[^\n]*\n){0,2}[^\n]*\bwrote:[ \t]*$", re.M)
+# Everything after these lines is an earlier message or a signature
+_CUT_MARKERS = re.compile(
+    r"^(?:-{2,}\s*Original Message\s*-{2,}"
+    r"|_{10,}\s*$"
+    r"|From: .+\n(?:Sent|Date): .+"
+    r"|-- ?$"
+    r"|Sent from my \w+.*$"
+    r"|Get Outlook for \w+.*$)",
+    re.M | re.I,
+)
+_REPLY_PREFIX = re.compile(r"^\s*(?:(?:re|fwd?|aw|sv)\s*(?:\[\d+\])?:\s*)+", re.I)
+
+def strip_quoted(body: str) -> str:
+    """The text a reply adds: quoted history, attribution lines and signatures removed"""
+    cut = len(body)
+    for pattern in (_ATTRIBUTION, _CUT_MARKERS):
+        match = pattern.search(body)
+        if match:
+            cut = min(cut, match.start())
+    lines = [line for line in body[:cut].splitlines() if not line.lstrip().startswith(">")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def thread_subject(subject: str) -> str:
+    """Subject without "Re:"/"Fwd:" prefixes, shared by every message of a thread"""
+    return _REPLY_PREFIX.sub("", subject or "").strip() or "No Subject"
+
+def sender_of(record: dict) -> str:
+    """The ``sender`` of a thread record, or the From header of a stored message"""
+    if "sender" in record:
+        return record["sender"]
+    return next((value for name, value in record.get("headers", []) if name.lower() == "from"), "")
+
+def build_threads(records: Iterable[dict]) -> List[dict]:
+    """Group message records by ``thread_id`` into thread records, most recently active first
+
+    A thread record has the fields of a message record (``email_id`` is the
+    thread id, ``body`` the conversation as per-message deltas, oldest first,
+    ``sender`` every participant) plus ``message_ids``, ``message_count``
+    and the body sizes before and after stripping (``raw_bytes``,
+    ``delta_bytes``).
+    """
+    grouped: Dict[str, List[dict]] = {}
+    for record in records:
+        grouped.setdefault(record.get("thread_id") or record["email_id"], []).append(record)
+
+    threads = []
+    for thread_id, messages in grouped.items():
+        messages.sort(key=lambda record: (record.get("internal_date", 0), record["email_id"]))
+        participants, parts = [], []
+        raw_bytes = delta_bytes = 0
+        for record in messages:
+            sender = sender_of(record)
+            if sender and sender not in participants:
+                participants.append(sender)
+            delta = strip_quoted(record["body"])
+            raw_bytes += len(record["body"].encode("utf-8", errors="ignore"))
+            delta_bytes += len(delta.encode("utf-8", errors="ignore"))
+            if delta:
+                parts.append(f"[{sender or 'Unknown sender'}]\n{delta}")
+        first, last = messages[0], messages[-1]
+        threads.append({
+            "email_id": thread_id,
+            "thread_id": thread_id,
+            "raw_subject": first.get("raw_subject"),
+            "subject": thread_subject(first["subject"]),
+            "sender": ", ".join(participants),
+            "internal_date": last.get("internal_date", 0),
+            "fetched_at": max(record["fetched_at"] for record in messages),
+            "body": "\n\n".join(parts),
+            "message_ids": [record["email_id"] for record in messages],
+            "message_count": len(messages),
+            "raw_bytes": raw_bytes,
+            "delta_bytes": delta_bytes,
+        })
+
+    threads.sort(key=lambda thread: thread["internal_date"], reverse=True)
+    return threads
+
+def thread_report(threads: Iterable[dict]) -> dict:
+    """Message/thread counts and body bytes indexed with and without quote stripping
+
+    Takes thread records or the metadata of thread documents, which carry
+    the same ``message_count``, ``raw_bytes`` and ``delta_bytes`` fields.
+    """
+    threads = list(threads)
+    raw = sum(thread.get("raw_bytes", 0) for thread in threads)
+    indexed = sum(thread.get("delta_bytes", 0) for thread in threads)
+    return {
+        "threads": len(threads),
+        "messages": sum(thread.get("message_count", 1) for thread in threads),
+        "raw_bytes": raw,
+        "indexed_bytes": indexed,
+        "saved_bytes": raw - indexed,
+        "saved_pct": (raw - indexed) / raw if raw else 0.0,
+    }